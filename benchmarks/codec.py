@@ -0,0 +1,40 @@
+"""Compares building models with dict(record) and keyword expansion against the compiled codec
+
+Run with ``POSTGRES_URL=... python -m benchmarks.codec``. No tables are needed, the rows are generated.
+"""
+import asyncio
+import os
+import time
+import tracemalloc
+
+import asyncpg
+
+from database import models
+
+ROWS = 50000
+QUERY = "SELECT g::bigint AS id, 1::bigint AS author, 'title' || g AS title, 'some content' AS content, " \
+        "now()::timestamp AS created, NULL::timestamp AS last_edited, 1::bigint AS guild " \
+        "FROM generate_series(1, $1) g"
+
+
+def measure(name: str, build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<24}{elapsed / len(result) * 1e6:>8.2f} us/row{peak / 1024 ** 2:>10.2f} MiB peak")
+
+
+async def main(dsn: str):
+    connection = await asyncpg.connect(dsn)
+    records = await connection.fetch(QUERY, ROWS)
+    await connection.close()
+    codec = models.Tag.codec()
+    measure("dict(record) kwargs", lambda: [models.Tag(client=None, **dict(record)) for record in records])
+    measure("codec", lambda: codec.decode_all(None, records))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(os.environ["POSTGRES_URL"]))
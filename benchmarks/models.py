@@ -0,0 +1,75 @@
+"""Measures the memory held per cached guild, with the guild models as they were and as they are now
+
+Run with ``python -m benchmarks.models``. Guilds are built in memory, no database is needed. Every guild
+gets the same children: two prefixes, one blocked channel and one reaction role, which is more than most
+guilds have.
+"""
+import dataclasses
+import gc
+import tracemalloc
+
+from database import models
+
+GUILDS = 20000
+CONTAINERS = ("_blocked_channels", "_prefixes", "_activities", "_faqs", "_reaction_roles")
+
+
+def legacy(model: type, containers: bool = False) -> type:
+    """A plain dataclass copy of ``model`` with an instance ``__dict__``, optionally with every child
+    container created up front, which is how the models were before they were slotted"""
+    fields = []
+    for field in dataclasses.fields(model):
+        if containers and field.name in CONTAINERS:
+            factory = list if field.name == "_reaction_roles" else dict
+            fields.append((field.name, field.type, dataclasses.field(default_factory=factory)))
+        else:
+            fields.append((field.name, field.type, dataclasses.field(default=field.default,
+                                                                      default_factory=field.default_factory)))
+    return dataclasses.make_dataclass(f"Legacy{model.__name__}", fields)
+
+
+def build_guilds(guild_model: type, prefix_model: type, channel_model: type, reaction_model: type, attach):
+    guilds = []
+    for gid in range(1, GUILDS + 1):
+        guild = guild_model(None, gid, welcome_message="welcome")
+        attach(guild, prefix_model(None, gid * 10, guild=gid, prefix="!", author=1))
+        attach(guild, prefix_model(None, gid * 10 + 1, guild=gid, prefix="?", author=1))
+        attach(guild, channel_model(None, gid * 10 + 2, guild=gid, blocker=1))
+        attach(guild, reaction_model(None, gid * 10 + 3, message_id=1, emoji="👍", guild=gid, role=1))
+        guilds.append(guild)
+    return guilds
+
+
+def attach_legacy(guild, child):
+    if hasattr(child, "prefix"):
+        guild._prefixes[child.prefix] = child
+    elif hasattr(child, "emoji"):
+        guild._reaction_roles.append(child)
+    else:
+        guild._blocked_channels[child.id] = child
+
+
+def measure(name: str, build):
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    guilds = build()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<24}{(after - before) / len(guilds):>10.0f} bytes/guild")
+    return guilds
+
+
+def main():
+    # the legacy classes are built before measuring so only the guilds are counted
+    guild, prefix, channel, reaction_role = (legacy(models.Guild, containers=True), legacy(models.Prefix),
+                                             legacy(models.Channel), legacy(models.ReactionRole))
+    measure("dataclass models", lambda: build_guilds(guild, prefix, channel, reaction_role, attach_legacy))
+    measure("slotted models", lambda: build_guilds(models.Guild, models.Prefix, models.Channel,
+                                                   models.ReactionRole, models.Guild.attach))
+    measure("empty dataclass guilds", lambda: [guild(None, gid) for gid in range(1, GUILDS + 1)])
+    measure("empty slotted guilds", lambda: [models.Guild(None, gid) for gid in range(1, GUILDS + 1)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Compares building the upsert SQL on every save against the precompiled statement registry
+
+Run with ``python -m benchmarks.statements``. If ``POSTGRES_URL`` is set the saves are also
+timed against the database.
+"""
+import asyncio
+import os
+import timeit
+
+from database import models
+from database.sqlclient import SqlClient
+from database.statements import StatementRegistry, clean_columns
+
+
+def build_upsert(model: models.Model):
+    """The query building SqlClient.update did before the statement registry"""
+    model_table = models.tables[type(model)]
+    model_data = model.data
+    model_primary_keys = ','.join(model.PRIMARY_KEY)
+    insert_arguments = ','.join(f'${index}' for index in range(1, len(model_data) + 1))
+    cleaned_column_names = clean_columns(list(model_data.keys())[1:])
+    update_arguments = ','.join(f'{column} = excluded.{column}' for column in cleaned_column_names)
+    query = f'INSERT INTO {model_table} VALUES({insert_arguments}) ' \
+            f'ON CONFLICT ({model_primary_keys}) DO UPDATE set {update_arguments};'
+    return query, tuple(model_data.values())
+
+
+def lookup_upsert(registry: StatementRegistry, model: models.Model):
+    statements = registry[type(model)]
+    return statements.upsert, statements.bind(model)
+
+
+def report(name: str, seconds: float, number: int):
+    print(f"{name:<32}{seconds / number * 1e6:>10.2f} us/op")
+
+
+def bench_python(number: int = 100000):
+    registry = StatementRegistry()
+    registry.compile(models.tables)
+    samples = [
+        models.Member(None, 1, guild=2),
+        models.CommandCall(None, 1, command="help", guild=2, author=3),
+        models.Guild(None, 1),
+    ]
+    for model in samples:
+        print(type(model).__name__)
+        report("  build per save", timeit.timeit(lambda: build_upsert(model), number=number), number)
+        report("  registry lookup + bind", timeit.timeit(lambda: lookup_upsert(registry, model), number=number),
+               number)
+
+
+async def bench_database(dsn: str, number: int = 2000):
+    client = await SqlClient.connect(dsn)
+    await client.setup()
+    guild = models.Guild(client, 1)
+    await guild.save()
+    calls = [models.CommandCall(client, command="bench", guild=guild.id, author=1) for _ in range(number)]
+    loop = asyncio.get_event_loop()
+    async with client.pool.acquire() as connection:
+        start = loop.time()
+        for call in calls:
+            query, args = build_upsert(call)
+            await connection.execute(query, *args)
+        report("build per save (db)", loop.time() - start, number)
+        start = loop.time()
+        for call in calls:
+            query, args = lookup_upsert(client.statements, call)
+            await connection.execute(query, *args)
+        report("registry lookup + bind (db)", loop.time() - start, number)
+        await connection.execute("DELETE FROM commands WHERE command = 'bench'")
+    await client.close()
+
+
+if __name__ == '__main__':
+    bench_python()
+    if os.getenv("POSTGRES_URL"):
+        asyncio.run(bench_database(os.getenv("POSTGRES_URL")))
@@ -34,8 +34,9 @@ class Activity(commands.Cog):
     async def _passive_task(self):
         await self.bot.wait_until_ready()
         for guild in self.bot.guilds:
+            # premium guilds are always loaded, the others aren't fetched just to be skipped
             guild_data = self.bot.get_guild_data(guild.id)
-            if guild_data.premium:
+            if guild_data and guild_data.premium:
                 for member in guild.members:
                     if member.activity:
                         activity = guild_data.activities.get(member.activity.name.lower())
@@ -2,6 +2,7 @@ import discord
 from discord.ext import commands
 
 from database import models
+from utils.digest import MemberAnnouncer
 from utils.iceteacontext import IceTeaContext
 
 
@@ -9,6 +10,12 @@ class Events(commands.Cog):
 
     def __init__(self, bot):
         self.bot: "Iceteabot" = bot
+        config = getattr(bot, "config", {})
+        self.announcer = MemberAnnouncer(threshold=int(config.get("member_digest_threshold") or 5),
+                                         window=float(config.get("member_digest_window") or 10))
+
+    def cog_unload(self):
+        self.announcer.close()
 
     @commands.Cog.listener()
     async def on_command_completion(self, ctx: IceTeaContext):
@@ -21,6 +28,8 @@ class Events(commands.Cog):
             await self.bot.add_guild(guild)
         except:
             pass
+        else:
+            self.bot.loop.create_task(self.bot.import_guild_members(guild))
         try:
             await self.bot.update_discord_bots()
         except:
@@ -33,33 +42,35 @@ class Events(commands.Cog):
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
         if not member.bot:
-            guild_data: models.Guild = self.bot.get_guild_data(member.guild.id)
-            await guild_data.add_member(member.id)
+            guild_data: models.Guild = await self.bot.fetch_guild_data(member.guild.id)
+            guild_data.member_joined(member.id)
             join_channel = self.bot.get_channel(guild_data.welcome_channel)
             if join_channel:
                 if guild_data.welcome_message:
-                    await join_channel.send(guild_data.welcome_message)
+                    await self.announcer.announce(join_channel, "joined", guild_data.welcome_message, member)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member):
         if not member.bot:
-            guild_data: models.Guild = self.bot.get_guild_data(member.guild.id)
-            await guild_data.remove_member(member.id)
+            guild_data: models.Guild = await self.bot.fetch_guild_data(member.guild.id)
+            guild_data.member_left(member.id)
             leaving_channel = self.bot.get_channel(guild_data.leaving_channel)
             if leaving_channel:
                 if guild_data.leaving_message:
-                    await leaving_channel.send(guild_data.leaving_message)
+                    await self.announcer.announce(leaving_channel, "left", guild_data.leaving_message, member)
 
     @commands.Cog.listener()
     async def on_member_update(self, before: discord.Member, after: discord.Member):
         if not before.bot:
             if before.nick != after.nick and after.nick is not None:
-                await self.bot.get_guild_data(after.guild.id).add_member_nickname(after.id, after.nick)
+                (await self.bot.fetch_guild_data(after.guild.id)).add_member_nickname(after.id, after.nick)
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         if message.guild and not message.author.bot:
-            await self.bot.sql.update_member_last_spoke(message.author.id, message.guild.id, message.created_at)
+            guild_data: models.Guild = await self.bot.fetch_guild_data(message.guild.id)
+            if guild_data and guild_data.tracking:
+                self.bot.sql.last_spoke.add(message.author.id, message.guild.id, message.created_at)
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
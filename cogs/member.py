@@ -3,6 +3,7 @@ import timeago
 from discord.ext import commands
 from discord.ext.commands.cooldowns import BucketType
 
+from database import models
 from utils.iceteacontext import IceTeaContext
 
 
@@ -26,7 +27,7 @@ class Members(commands.Cog):
     async def userinfo(self, ctx: "IceTeaContext", target: discord.Member = None):
         """Display's a users information summary"""
         target = target or ctx.author
-        target_data = ctx.author_data if target == ctx.author else await ctx.get_user_data(target)
+        target_data = await ctx.get_author_data() if target == ctx.author else await ctx.get_user_data(target)
         if target_data:
             nicknames = await target_data.get_nicknames()
         else:
@@ -58,6 +59,15 @@ class Members(commands.Cog):
                                 value=f"{target.activity.name}\n{target.activity.details}\n{target.activity.state}")
         await ctx.send(embed=embed)
 
+    @staticmethod
+    async def _save_profile(ctx: "IceTeaContext", **fields):
+        # profiles live on the user row, the member row doesn't save them
+        user_data = await ctx.get_user_data(ctx.author, member=False) or models.User(ctx.bot.sql, ctx.author.id)
+        for name, value in fields.items():
+            setattr(user_data, name, value)
+        await user_data.save()
+        await ctx.send_success()
+
     @commands.group(invoke_without_command=True, name="set")
     async def _set_profiles(self, ctx: "IceTeaContext"):
         """Stores user information"""
@@ -65,24 +75,15 @@ class Members(commands.Cog):
 
     @_set_profiles.command(name="osu")
     async def _osu(self, ctx: "IceTeaContext", *, username: str):
-        author_data = ctx.author_data
-        author_data.osu = username
-        await author_data.save()
-        await ctx.send_success()
+        await self._save_profile(ctx, osu=username)
 
     @_set_profiles.command(name="league")
     async def _league(self, ctx: "IceTeaContext", *, username: str):
-        author_data = ctx.author_data
-        author_data.league = username
-        await author_data.save()
-        await ctx.send_success()
+        await self._save_profile(ctx, league=username)
 
     @_set_profiles.command(name="location")
     async def _location(self, ctx: "IceTeaContext", *, location: str):
-        author_data = ctx.author_data
-        author_data.location = location
-        await author_data.save()
-        await ctx.send_success()
+        await self._save_profile(ctx, location=location)
 
 
 def setup(bot):
@@ -10,6 +10,7 @@ from contextlib import redirect_stdout
 import discord
 from discord.ext import commands
 
+from database.pools import ANALYTICS
 from utils import time as utils_time
 from utils.formats import TabularData, Plural
 from utils.iceteacontext import IceTeaContext
@@ -114,13 +115,13 @@ class Owner(commands.Cog):
         is_multistatement = query.count(';') > 1
         if is_multistatement:
             # fetch does not support multiple statements
-            strategy = ctx.bot.sql.pool.execute
+            strategy = ctx.bot.sql.execute
         else:
-            strategy = ctx.bot.sql.pool.fetch
+            strategy = ctx.bot.sql.raw_get_all
 
         try:
             start = time.perf_counter()
-            results = await strategy(query)
+            results = await strategy(query, pool=ANALYTICS)
             dt = (time.perf_counter() - start) * 1000.0
         except Exception:
             return await ctx.send(f'```py\n{traceback.format_exc()}\n```')
@@ -142,6 +143,44 @@ class Owner(commands.Cog):
         else:
             await ctx.send(fmt)
 
+    @commands.command(hidden=True, name="dbstats")
+    async def db_stats(self, ctx: "IceTeaContext", count: int = 10, order: str = "elapsed"):
+        """Shows the slowest statements, the saturation of each pool and the latest slow queries
+
+        order can be elapsed (total time), mean, wait, errors or calls"""
+        if order not in ("elapsed", "mean", "wait", "errors", "calls"):
+            return await ctx.send("order must be one of elapsed, mean, wait, errors or calls")
+        stats = ctx.bot.sql.query_stats
+        table = TabularData()
+        table.set_columns(["statement", "calls", "total ms", "p50", "p99", "wait ms", "rows", "errors"])
+        table.add_rows([textwrap.shorten(statement.statement, 60), statement.calls,
+                        f"{statement.elapsed * 1000:.0f}", f"{statement.percentile(0.5):.0f}",
+                        f"{statement.percentile(0.99):.0f}", f"{statement.mean_wait * 1000:.1f}",
+                        statement.rows, f"{statement.error_rate:.1%}"]
+                       for statement in stats.worst(count, order))
+        pools = "\n".join(f"{name}: {pool['in_use']}/{pool['max_size']} in use, {pool['waiting']} waiting "
+                           f"(peak {pool['peak_in_use']} in use, {pool['peak_waiting']} waiting), "
+                           f"{pool['rejected']} rejected"
+                           for name, pool in ctx.bot.sql.pool_saturation.items())
+        slow = "\n".join(f"{query.at:%H:%M:%S} {query.elapsed * 1000:.0f}ms "
+                          f"{textwrap.shorten(query.statement, 80)} {query.parameters}"
+                          for query in list(stats.slow_queries)[-5:])
+        fmt = f"```\n{table.render()}\n```\n```\n{pools}\n```"
+        if slow:
+            fmt += f"\n```\n{slow}\n```"
+        if ctx.bot.lazy_guild_data:
+            guilds = ctx.bot.guild_data_stats
+            fmt += (f"\n*guild data: {guilds['cached']} cached, {guilds['pinned']} pinned, {guilds['loads']} loads, "
+                    f"{guilds['coalesced']} coalesced, {guilds['evictions']} evictions*")
+        for progress in ctx.bot.sql.imports.values():
+            if not progress.done:
+                fmt += f"\n*importing members of {progress.guild}: {progress.imported}/{progress.total}*"
+        if len(fmt) > 2000:
+            fp = io.BytesIO(fmt.encode('utf-8'))
+            await ctx.send('Too many results...', file=discord.File(fp, 'dbstats.txt'))
+        else:
+            await ctx.send(fmt)
+
     @commands.command(name="chavatar")
     async def avatar(self, ctx: IceTeaContext, link=None):
         """Edits the bot's avatar. Can only be used by owner can provide a link or attachment"""
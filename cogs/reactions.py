@@ -17,7 +17,7 @@ class ReactionRoles(commands.Cog):
     @commands.Cog.listener()
     async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
         if payload.guild_id:
-            guild_data = self.bot.get_guild_data(payload.guild_id)
+            guild_data = await self.bot.fetch_guild_data(payload.guild_id)
             await guild_data.delete_role_reaction_by_message(payload.message_id)
 
     @commands.Cog.listener()
@@ -35,7 +35,7 @@ class ReactionRoles(commands.Cog):
             member = guild.get_member(payload.user_id)
             if member.bot:
                 return
-            guild_data = self.bot.get_guild_data(guild_id)
+            guild_data = await self.bot.fetch_guild_data(guild_id)
             reaction_role = guild_data.get_reaction_role(payload.message_id, str(payload.emoji))
             if reaction_role:
                 role = reaction_role.get_role()
@@ -115,14 +115,14 @@ class Server(commands.Cog):
             return await ctx.send("You cannot set prefixes with a space")
         elif re.search(r'<@!?([0-9]+)>$', prefix):
             return await ctx.send("You cannot add a mention as a prefix")
-        current_prefixes = ctx.guild_data.prefixes
-        if prefix in current_prefixes:
+        if prefix in ctx.guild_data.prefixes:
             return await ctx.send("This prefix already exists")
 
         new_prefix = await ctx.guild_data.add_prefix(prefix, ctx.author.id)
         if new_prefix is not None:
+            # read after adding, a guild without prefixes only gets its collection with the first one
             await ctx.send(
-                f"Successfully added {prefix}, this guild now has {len(current_prefixes)} prefixes")
+                f"Successfully added {prefix}, this guild now has {len(ctx.guild_data.prefixes)} prefixes")
 
     @_prefix.command(name="delete", aliases=['del'])
     @commands.check(is_guild_admin)
@@ -266,9 +266,10 @@ class Server(commands.Cog):
     @commands.is_owner()
     async def premium(self, ctx: "IceTeaContext", gid: int):
         guild = ctx.bot.get_guild(gid)
-        guild_data = ctx.bot.get_guild_data(gid)
+        guild_data = await ctx.bot.fetch_guild_data(gid)
         guild_data.premium = not guild_data.premium
         await guild_data.save()
+        ctx.bot.pin_guild(guild_data, guild_data.premium)
         await ctx.send_success(f"{guild}'s premium status is now: {'Enabled' if guild_data.premium else 'Disabled'}")
 
 
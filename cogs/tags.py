@@ -32,11 +32,12 @@ class Tags(commands.Cog):
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, TagNotFound):
-            # response_list = await self.search_tags(ctx, error.param)
-            # if len(response_list) > 0:
-            #     response_message = "\n".join([row.id for row in response_list])
-            #     await ctx.send(f"Tag **{error.param}** not found\ninstead found these tags:\n\n{response_message}")
-            await ctx.send(f"Tag ``{error.param}`` Not Found")
+            suggestions = await ctx.guild_data.search_tags(error.param, limit=3)
+            if suggestions:
+                response_message = ", ".join(f"``{title}``" for title in suggestions)
+                await ctx.send(f"Tag ``{error.param}`` Not Found, did you mean {response_message}?")
+            else:
+                await ctx.send(f"Tag ``{error.param}`` Not Found")
         elif isinstance(error, TagAlreadyExists):
             await ctx.send(f"``{error.param}`` already exists")
         else:
@@ -86,7 +87,7 @@ class Tags(commands.Cog):
         if tag_content:
             await ctx.send(tag_content)
         else:
-            await ctx.send("No Tag found")
+            raise TagNotFound(tag_name)
 
     @tag.command(aliases=['add'])
     async def create(self, ctx: "IceTeaContext", name: str, *, content: str):
@@ -208,18 +209,38 @@ class Tags(commands.Cog):
         """
         response_list = await ctx.guild_data.search_tags(query)
         if len(response_list) > 0:
-            response_message = "\n".join([tag.title for tag in response_list])
+            response_message = "\n".join(response_list)
             await ctx.send(f"Found these tags:\n{response_message}")
         else:
             await ctx.send("No similar tags found")
 
+    @tag.command(aliases=['find'])
+    async def grep(self, ctx: "IceTeaContext", *, query: str):
+        """Finds tags by what they say, best matches first
+
+        eg: tag grep good boy
+        """
+        per_page = 10
+
+        async def fetch(cursor):
+            return await ctx.guild_data.search_tag_content(query, per_page, cursor)
+
+        matches, cursor = await fetch(None)
+        if not matches:
+            return await ctx.send("No tags found")
+        paginator = TagPaginator(ctx, entries=matches, per_page=per_page, fetch=fetch, cursor=cursor)
+        await paginator.paginate()
+
     @tag.command()
-    async def random(self, ctx: "IceTeaContext"):
-        """Retrieves a random tag from the database"""
-        random_tag = await ctx.guild_data.get_random_tag()
-        if random_tag is None:
+    async def random(self, ctx: "IceTeaContext", amount: int = 1):
+        """Retrieves one or up to 5 different random tags from the database"""
+        random_tags = await ctx.guild_data.get_random_tags(max(1, min(amount, 5)))
+        if not random_tags:
             return await ctx.send("Unable to find any tags")
-        await ctx.send(random_tag.content)
+        if len(random_tags) == 1:
+            return await ctx.send(random_tags[0].content)
+        for random_tag in random_tags:
+            await ctx.send(f"**{random_tag.title}**\n{random_tag.content}")
 
     @tag.command(name="list")
     async def _list(self, ctx: "IceTeaContext", target: discord.Member = None):
@@ -24,7 +24,7 @@ class Tasks(commands.Cog):
     @task.command(aliases=['create', 'add'])
     async def new(self, ctx: "IceTeaContext", *, content: str):
         """Creates a new task for the user"""
-        author_data = ctx.author_data
+        author_data = await ctx.get_author_data()
         await author_data.add_task(content)
         await ctx.send("Successfully added task")
 
@@ -35,12 +35,14 @@ class Tasks(commands.Cog):
             help_command = ctx.bot.get_command("help")
             await ctx.invoke(help_command, command="task view")
         else:
-            paginator = TaskPaginator(ctx, entries=await ctx.author_data.get_all_tasks())
+            author_data = await ctx.get_author_data()
+            paginator = TaskPaginator(ctx, entries=await author_data.get_all_tasks())
             await paginator.paginate()
 
     @view.command()
     async def unfinished(self, ctx: "IceTeaContext"):
-        all_tasks = await ctx.author_data.get_unfinished_tasks()
+        author_data = await ctx.get_author_data()
+        all_tasks = await author_data.get_unfinished_tasks()
         if all_tasks:
             paginator = TaskPaginator(ctx, entries=all_tasks)
             await paginator.paginate()
@@ -49,7 +51,8 @@ class Tasks(commands.Cog):
 
     @view.command()
     async def finished(self, ctx: "IceTeaContext"):
-        all_tasks = await ctx.author_data.get_finished_tasks()
+        author_data = await ctx.get_author_data()
+        all_tasks = await author_data.get_finished_tasks()
         if all_tasks:
             paginator = TaskPaginator(ctx, entries=all_tasks)
             await paginator.paginate()
@@ -60,7 +63,8 @@ class Tasks(commands.Cog):
     async def delete(self, ctx: "IceTeaContext", number: int):
         """Deletes a task by task number"""
         try:
-            await ctx.author_data.delete_task(number)
+            author_data = await ctx.get_author_data()
+            await author_data.delete_task(number)
             await ctx.send("Task successfully deleted")
         except BadTask as e:
             await ctx.send(e, delete_after=10)
@@ -69,7 +73,8 @@ class Tasks(commands.Cog):
     async def finish(self, ctx: "IceTeaContext", number: int):
         """Marks a task as finished"""
         try:
-            await ctx.author_data.finish_task(number)
+            author_data = await ctx.get_author_data()
+            await author_data.finish_task(number)
             await ctx.send("Task successfully finished")
         except Exception as e:
             await ctx.send("No task with that error found")
@@ -0,0 +1,435 @@
+import array
+import asyncio
+import bisect
+import random
+import sys
+import time
+import typing
+from collections import OrderedDict
+
+KT = typing.TypeVar("KT")
+VT = typing.TypeVar("VT")
+
+
+class LRUCache(typing.Generic[KT, VT]):
+    """A least recently used cache bounded by entry count and, optionally, by approximate size in bytes"""
+
+    def __init__(self, max_size: int = 128, max_bytes: int = None,
+                 sizeof: typing.Callable[[typing.Any], int] = sys.getsizeof):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[KT, typing.Tuple[VT, int]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: KT) -> bool:
+        return key in self._data
+
+    def __iter__(self) -> typing.Iterator[KT]:
+        return iter(self._data)
+
+    def get(self, key: KT, default: VT = None) -> typing.Optional[VT]:
+        try:
+            value, _ = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: KT, default: VT = None) -> typing.Optional[VT]:
+        """Returns a value without counting a hit or refreshing its position"""
+        entry = self._data.get(key)
+        return entry[0] if entry is not None else default
+
+    def put(self, key: KT, value: VT):
+        self.pop(key)
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._data[key] = (value, size)
+        self.bytes += size
+        self._evict()
+
+    __setitem__ = put
+
+    def pop(self, key: KT, default: VT = None) -> typing.Optional[VT]:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        self.bytes -= entry[1]
+        return entry[0]
+
+    def items(self) -> typing.Iterator[typing.Tuple[KT, VT]]:
+        for key, (value, _) in list(self._data.items()):
+            yield key, value
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def _evict(self):
+        while self._data and (len(self._data) > self.max_size or
+                              (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, (_, size) = self._data.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+
+class TTLCache(typing.Generic[KT, VT]):
+    """An LRUCache whose entries also expire ``ttl`` seconds after they were put"""
+
+    def __init__(self, max_size: int = 128, ttl: float = 300.0,
+                 clock: typing.Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._cache: LRUCache[KT, typing.Tuple[VT, float]] = LRUCache(max_size=max_size)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __iter__(self) -> typing.Iterator[KT]:
+        return iter(list(self._cache))
+
+    @property
+    def hits(self) -> int:
+        return self._cache.hits
+
+    @property
+    def misses(self) -> int:
+        return self._cache.misses
+
+    def get(self, key: KT, default: VT = None) -> typing.Optional[VT]:
+        entry = self._cache.peek(key)
+        if entry is not None and entry[1] <= self.clock():
+            self._cache.pop(key)
+        entry = self._cache.get(key)
+        return entry[0] if entry is not None else default
+
+    def peek(self, key: KT, default: VT = None) -> typing.Optional[VT]:
+        entry = self._cache.peek(key)
+        return entry[0] if entry is not None else default
+
+    def put(self, key: KT, value: VT):
+        self._cache.put(key, (value, self.clock() + self.ttl))
+
+    def pop(self, key: KT, default: VT = None) -> typing.Optional[VT]:
+        entry = self._cache.pop(key)
+        return entry[0] if entry is not None else default
+
+    def clear(self):
+        self._cache.clear()
+
+
+class LoadingCache(typing.Generic[KT, VT]):
+    """An LRUCache that loads missing keys through ``loader``, with pinned keys that are never evicted
+
+    ``get`` only ever looks at what is cached, ``fetch`` loads on a miss. Concurrent fetches of the same
+    missing key share one load. Without ``max_size`` nothing is evicted.
+    """
+
+    def __init__(self, loader: typing.Callable[[KT], typing.Awaitable[typing.Optional[VT]]],
+                 max_size: int = None):
+        self.loader = loader
+        self.loads = 0
+        self.coalesced = 0
+        self._cache: LRUCache[KT, VT] = LRUCache(max_size=max_size or sys.maxsize)
+        self._pinned: typing.Dict[KT, VT] = {}
+        self._loading: typing.Dict[KT, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._cache) + len(self._pinned)
+
+    def __contains__(self, key: KT) -> bool:
+        return key in self._pinned or key in self._cache
+
+    def get(self, key: KT, default: VT = None) -> typing.Optional[VT]:
+        value = self._pinned.get(key)
+        if value is None:
+            value = self._cache.get(key)
+        return default if value is None else value
+
+    def put(self, key: KT, value: VT):
+        if key in self._pinned:
+            self._pinned[key] = value
+        else:
+            self._cache.put(key, value)
+
+    def pop(self, key: KT, default: VT = None) -> typing.Optional[VT]:
+        # a load still running for the key is not cached once it completes
+        self._loading.pop(key, None)
+        value = self._pinned.pop(key, None)
+        if value is None:
+            value = self._cache.pop(key)
+        return default if value is None else value
+
+    def pin(self, key: KT, value: VT):
+        self._cache.pop(key)
+        self._pinned[key] = value
+
+    def unpin(self, key: KT):
+        value = self._pinned.pop(key, None)
+        if value is not None:
+            self._cache.put(key, value)
+
+    def values(self) -> typing.List[VT]:
+        return [*self._pinned.values(), *(value for _, value in self._cache.items())]
+
+    async def fetch(self, key: KT) -> typing.Optional[VT]:
+        value = self.get(key)
+        if value is not None:
+            return value
+        future = self._loading.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        future = self._loading[key] = asyncio.get_event_loop().create_future()
+        self.loads += 1
+        try:
+            value = await self.loader(key)
+        except BaseException as e:
+            future.set_exception(e)
+            # retrieved here so a load nobody else waited on doesn't log a never retrieved warning
+            future.exception()
+            raise
+        finally:
+            current = self._loading.get(key)
+            if current is future:
+                del self._loading[key]
+        if value is not None and current is future:
+            self.put(key, value)
+        future.set_result(value)
+        return value
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "cached": len(self._cache),
+            "pinned": len(self._pinned),
+            "loading": len(self._loading),
+            "hits": self._cache.hits,
+            "misses": self._cache.misses,
+            "evictions": self._cache.evictions,
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+        }
+
+
+class CachedTag(typing.NamedTuple):
+    tag_id: int
+    link_id: int
+    content: str
+
+
+def _tag_size(tag: CachedTag) -> int:
+    return sys.getsizeof(tag) + sys.getsizeof(tag.content)
+
+
+class TagCache:
+    """Per guild LRU caches of tag title or alias to tag content
+
+    Each guild keeps at most ``max_tags`` entries and ``max_bytes`` of content, and at most
+    ``max_guilds`` guilds are cached at once.
+    """
+
+    def __init__(self, max_guilds: int = 1000, max_tags: int = 256, max_bytes: int = 256 * 1024):
+        self.max_tags = max_tags
+        self.max_bytes = max_bytes
+        self._guilds: LRUCache[int, LRUCache[str, CachedTag]] = LRUCache(max_size=max_guilds)
+
+    def _guild(self, gid: int, create: bool = False) -> typing.Optional[LRUCache]:
+        cache = self._guilds.peek(gid)
+        if cache is None and create:
+            cache = LRUCache(max_size=self.max_tags, max_bytes=self.max_bytes, sizeof=_tag_size)
+            self._guilds.put(gid, cache)
+        return cache
+
+    def get(self, gid: int, title: str) -> typing.Optional[CachedTag]:
+        cache = self._guilds.get(gid)
+        if cache is not None:
+            return cache.get(title)
+
+    def put(self, gid: int, title: str, tag: CachedTag):
+        self._guild(gid, create=True).put(title, tag)
+
+    def invalidate(self, gid: int, title: str):
+        cache = self._guild(gid)
+        if cache is not None:
+            cache.pop(title)
+
+    def invalidate_tag(self, gid: int, tag_id: int):
+        """Drops the tag and every alias pointing at it"""
+        cache = self._guild(gid)
+        if cache is not None:
+            for title, tag in cache.items():
+                if tag.tag_id == tag_id:
+                    cache.pop(title)
+
+    def invalidate_guild(self, gid: int):
+        self._guilds.pop(gid)
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        caches = [cache for _, cache in self._guilds.items()]
+        return {
+            "guilds": len(caches),
+            "tags": sum(len(cache) for cache in caches),
+            "bytes": sum(cache.bytes for cache in caches),
+            "hits": sum(cache.hits for cache in caches),
+            "misses": sum(cache.misses for cache in caches),
+            "evictions": sum(cache.evictions for cache in caches),
+        }
+
+
+class RandomIdSet:
+    """A set of ids kept in an array, so picking random members is O(1) and needs no query"""
+
+    def __init__(self, ids: typing.Iterable[int] = ()):
+        self._ids: typing.List[int] = []
+        self._positions: typing.Dict[int, int] = {}
+        for member in ids:
+            self.add(member)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, member: int) -> bool:
+        return member in self._positions
+
+    def add(self, member: int):
+        if member not in self._positions:
+            self._positions[member] = len(self._ids)
+            self._ids.append(member)
+
+    def remove(self, member: int):
+        position = self._positions.pop(member, None)
+        if position is None:
+            return
+        # move the last id into the hole instead of shifting everything after it
+        last = self._ids.pop()
+        if last != member:
+            self._ids[position] = last
+            self._positions[last] = position
+
+    def sample(self, count: int) -> typing.List[int]:
+        """Up to ``count`` distinct random ids"""
+        return random.sample(self._ids, min(count, len(self._ids)))
+
+
+class TagIdCache:
+    """The ids of every tag per guild, for picking random tags, for at most ``max_guilds`` guilds"""
+
+    def __init__(self, max_guilds: int = 1000):
+        self._guilds: LRUCache[int, typing.Optional[RandomIdSet]] = LRUCache(max_size=max_guilds)
+
+    def __contains__(self, gid: int) -> bool:
+        return gid in self._guilds
+
+    def get(self, gid: int) -> typing.Optional[RandomIdSet]:
+        return self._guilds.get(gid)
+
+    def put(self, gid: int, ids: typing.Optional[RandomIdSet]):
+        """Caches a guild's ids, None marks a guild with too many tags to hold"""
+        self._guilds.put(gid, ids)
+
+    def add(self, gid: int, tag_id: int):
+        ids = self._guilds.peek(gid)
+        if ids is not None:
+            ids.add(tag_id)
+
+    def remove(self, gid: int, tag_id: int):
+        ids = self._guilds.peek(gid)
+        if ids is not None:
+            ids.remove(tag_id)
+
+    def invalidate(self, gid: int):
+        self._guilds.pop(gid)
+
+
+class MemberIdSet:
+    """The ids of one guild's members in a sorted array of 64 bit ints, 8 bytes per member"""
+    __slots__ = ("_ids",)
+
+    def __init__(self, ids: typing.Iterable[int] = ()):
+        self._ids = array.array("q", sorted(set(ids)))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, member: int) -> bool:
+        index = bisect.bisect_left(self._ids, member)
+        return index < len(self._ids) and self._ids[index] == member
+
+    @property
+    def nbytes(self) -> int:
+        return self._ids.buffer_info()[1] * self._ids.itemsize
+
+    def add(self, member: int):
+        index = bisect.bisect_left(self._ids, member)
+        if index == len(self._ids) or self._ids[index] != member:
+            self._ids.insert(index, member)
+
+    def remove(self, member: int):
+        index = bisect.bisect_left(self._ids, member)
+        if index < len(self._ids) and self._ids[index] == member:
+            del self._ids[index]
+
+    def update(self, members: typing.Iterable[int]):
+        """Adds many ids at once with a single merge instead of one insert each"""
+        self._ids = array.array("q", sorted(set(self._ids).union(members)))
+
+
+class KnownMembers:
+    """Per guild ids of the members known to have a row in members
+
+    Guilds that were never loaded know nobody, so a miss only costs the insert that would have run anyway.
+    """
+
+    def __init__(self):
+        self._guilds: typing.Dict[int, MemberIdSet] = {}
+
+    def contains(self, gid: int, mid: int) -> bool:
+        members = self._guilds.get(gid)
+        return members is not None and mid in members
+
+    def put(self, gid: int, members: MemberIdSet):
+        self._guilds[gid] = members
+
+    def add(self, gid: int, mid: int):
+        members = self._guilds.get(gid)
+        if members is None:
+            members = self._guilds[gid] = MemberIdSet()
+        members.add(mid)
+
+    def remove(self, gid: int, mid: int):
+        members = self._guilds.get(gid)
+        if members is not None:
+            members.remove(mid)
+
+    def update(self, gid: int, mids: typing.Iterable[int]):
+        members = self._guilds.get(gid)
+        if members is None:
+            self._guilds[gid] = MemberIdSet(mids)
+        else:
+            members.update(mids)
+
+    def invalidate(self, gid: int):
+        self._guilds.pop(gid, None)
+
+    def clear(self):
+        self._guilds.clear()
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "guilds": len(self._guilds),
+            "members": sum(len(members) for members in self._guilds.values()),
+            "bytes": sum(members.nbytes for members in self._guilds.values()),
+        }
@@ -0,0 +1,81 @@
+import dataclasses
+import operator
+import typing
+
+import asyncpg
+
+
+class ModelCodec:
+    """Converts between a model class and database rows without going through dicts
+
+    Field metadata is read once per class. Decoders are generated per record shape, so
+    every row of a query is built with a single positional call to the model's ``__init__``.
+    """
+
+    def __init__(self, model: typing.Type["Model"]):
+        self.model = model
+        self.fields: typing.Tuple[dataclasses.Field, ...] = tuple(model.get_fields())
+        self.columns: typing.Tuple[str, ...] = tuple(field.name for field in self.fields)
+        self._init_fields = [field for field in dataclasses.fields(model) if field.init and field.name != "client"]
+        self._getter = operator.attrgetter(*self.columns)
+        self._decoders: typing.Dict[typing.Tuple[str, ...], typing.Callable] = {}
+
+    def encode(self, model: "Model") -> tuple:
+        """Returns the model's column values as a tuple, in ``columns`` order"""
+        if len(self.columns) == 1:
+            return self._getter(model),
+        return self._getter(model)
+
+    def decode(self, client: "SqlClient", record: asyncpg.Record) -> "Model":
+        return self.decoder(tuple(record.keys()))(client, record)
+
+    def decode_all(self, client: "SqlClient", records: typing.Iterable[asyncpg.Record]) -> typing.List["Model"]:
+        decoder = None
+        models = []
+        for record in records:
+            if decoder is None:
+                decoder = self.decoder(tuple(record.keys()))
+            models.append(decoder(client, record))
+        return models
+
+    def decoder(self, keys: typing.Tuple[str, ...]) -> typing.Callable[["SqlClient", asyncpg.Record], "Model"]:
+        decoder = self._decoders.get(keys)
+        if decoder is None:
+            decoder = self._decoders[keys] = self._compile(keys)
+        return decoder
+
+    def _compile(self, keys: typing.Tuple[str, ...]) -> typing.Callable:
+        positions = {}
+        for index, key in enumerate(keys):
+            positions.setdefault(key, index)
+        provided = [index for index, field in enumerate(self._init_fields) if field.name in positions]
+        arguments = []
+        namespace = {"_model": self.model}
+        # fields after the last column the record provides are left to their defaults
+        for index, field in enumerate(self._init_fields[:provided[-1] + 1] if provided else []):
+            if field.name in positions:
+                arguments.append(f"record[{positions[field.name]}]")
+            elif field.default_factory is not dataclasses.MISSING:
+                namespace[f"_factory_{index}"] = field.default_factory
+                arguments.append(f"_factory_{index}()")
+            else:
+                namespace[f"_default_{index}"] = field.default
+                arguments.append(f"_default_{index}")
+        source = f"def decode(client, record):\n    return _model(client, {', '.join(arguments)})\n"
+        exec(source, namespace)
+        return namespace["decode"]
+
+
+_codecs: typing.Dict[type, ModelCodec] = {}
+
+
+def get_codec(model: typing.Type["Model"]) -> ModelCodec:
+    codec = _codecs.get(model)
+    if codec is None:
+        codec = _codecs[model] = ModelCodec(model)
+    return codec
+
+
+if __name__ == '__main__':
+    from database.models import Model
+    from database.sqlclient import SqlClient
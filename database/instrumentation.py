@@ -0,0 +1,176 @@
+import bisect
+import dataclasses
+import datetime
+import functools
+import re
+import typing
+from collections import deque
+
+import asyncpg
+
+# upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS: typing.Tuple[float, ...] = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf"))
+
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_whitespace = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize(query: str) -> str:
+    """Collapses whitespace and replaces inline literals with ``?``, so queries that only differ by the
+    values formatted into them are counted as one statement"""
+    query = _string_literal.sub("?", query)
+    query = _number_literal.sub("?", query)
+    return _whitespace.sub(" ", query).strip().rstrip(";")
+
+
+def redact(args: typing.Sequence) -> typing.Tuple[str, ...]:
+    """Describes query parameters by type and size only, never by value"""
+    redacted = []
+    for arg in args:
+        if isinstance(arg, (str, bytes, list, tuple)):
+            redacted.append(f"{type(arg).__name__}[{len(arg)}]")
+        else:
+            redacted.append(type(arg).__name__)
+    return tuple(redacted)
+
+
+def result_rows(result: typing.Any) -> int:
+    if result is None:
+        return 0
+    if isinstance(result, str):
+        try:
+            return int(result.split()[-1])
+        except (IndexError, ValueError):
+            return 0
+    if isinstance(result, asyncpg.Record):
+        return 1
+    if isinstance(result, list):
+        return len(result)
+    return 1
+
+
+@dataclasses.dataclass()
+class StatementStats:
+    statement: str
+    calls: int = 0
+    errors: int = 0
+    rows: int = 0
+    wait: float = 0.0
+    elapsed: float = 0.0
+    max_elapsed: float = 0.0
+    histogram: typing.List[int] = dataclasses.field(default_factory=lambda: [0] * len(BUCKETS))
+
+    def add(self, wait: float, elapsed: float, rows: int, error: bool):
+        self.calls += 1
+        self.errors += error
+        self.rows += rows
+        self.wait += wait
+        self.elapsed += elapsed
+        self.max_elapsed = max(self.max_elapsed, elapsed)
+        self.histogram[bisect.bisect_left(BUCKETS, elapsed * 1000)] += 1
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.calls if self.calls else 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.elapsed / self.calls if self.calls else 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        return self.wait / self.calls if self.calls else 0.0
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound in milliseconds of the bucket holding the given fraction of calls"""
+        target = fraction * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS, self.histogram):
+            seen += count
+            if seen >= target and count:
+                return min(bound, self.max_elapsed * 1000)
+        return self.max_elapsed * 1000
+
+
+class SlowQuery(typing.NamedTuple):
+    statement: str
+    parameters: typing.Tuple[str, ...]
+    wait: float
+    elapsed: float
+    at: datetime.datetime
+    error: bool
+
+
+@dataclasses.dataclass()
+class PoolUsage:
+    """Connections of one pool in use and callers waiting for one, now and at their peak"""
+    in_use: int = 0
+    waiting: int = 0
+    peak_in_use: int = 0
+    peak_waiting: int = 0
+    rejected: int = 0
+
+    def wait(self):
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+
+    def acquired(self):
+        self.waiting -= 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+
+class QueryStats:
+    """Per statement latency, pool wait, row and error counts, plus a ring buffer of slow queries
+
+    At most ``max_statements`` distinct statements are tracked, any after that are counted together.
+    """
+
+    def __init__(self, *, slow_threshold: float = 0.25, slow_log_size: int = 100, max_statements: int = 500):
+        self.slow_threshold = slow_threshold
+        self.max_statements = max_statements
+        self.statements: typing.Dict[str, StatementStats] = {}
+        self.slow_queries: typing.Deque[SlowQuery] = deque(maxlen=slow_log_size)
+        self.pools: typing.Dict[str, PoolUsage] = {}
+
+    def usage(self, pool: str) -> PoolUsage:
+        usage = self.pools.get(pool)
+        if usage is None:
+            usage = self.pools[pool] = PoolUsage()
+        return usage
+
+    def record(self, query: str, wait: float, elapsed: float, rows: int = 0, args: typing.Sequence = (),
+               error: bool = False):
+        statement = normalize(query)
+        stats = self.statements.get(statement)
+        if stats is None:
+            if len(self.statements) >= self.max_statements:
+                statement = "<other>"
+                stats = self.statements.get(statement)
+            if stats is None:
+                stats = self.statements[statement] = StatementStats(statement)
+        stats.add(wait, elapsed, rows, error)
+        if elapsed >= self.slow_threshold:
+            self.slow_queries.append(SlowQuery(statement, redact(args), wait, elapsed,
+                                               datetime.datetime.utcnow(), error))
+
+    def worst(self, count: int = 10, key: str = "elapsed") -> typing.List[StatementStats]:
+        """The statements with the highest ``key``, such as elapsed (total time), mean, wait or errors"""
+        return sorted(self.statements.values(), key=lambda stats: getattr(stats, key), reverse=True)[:count]
+
+    def reset(self):
+        self.statements.clear()
+        self.slow_queries.clear()
+        for usage in self.pools.values():
+            usage.peak_in_use = usage.in_use
+            usage.peak_waiting = usage.waiting
+            usage.rejected = 0
+
+
+@dataclasses.dataclass()
+class Execution:
+    """A connection checked out through ``SqlClient.acquire``, set ``rows`` to have them recorded"""
+    connection: asyncpg.Connection
+    rows: int = 0
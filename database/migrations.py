@@ -0,0 +1,217 @@
+import dataclasses
+import datetime
+import logging
+import typing
+
+import asyncpg
+
+from database import models, partitions
+from database.models import tag
+from database.statements import clean_columns
+
+log = logging.getLogger(__name__)
+
+# arbitrary key for the advisory lock held while migrating, so two processes never migrate at once
+MIGRATION_LOCK = 0x1ce7ea
+
+
+@dataclasses.dataclass()
+class Migration:
+    """A numbered schema change
+
+    ``apply`` receives a connection. Transactional migrations run inside a transaction together with
+    the version bump, the others (anything using CONCURRENTLY) run on their own and are recorded after.
+    """
+    version: int
+    name: str
+    apply: typing.Callable[[asyncpg.Connection], typing.Awaitable[None]]
+    transactional: bool = True
+
+
+async def create_tables(connection: asyncpg.Connection):
+    for table in models.tables.keys():
+        table: models.Model = table
+        try:
+            table_query = table.setup_table()
+            if table_query:
+                await connection.execute(table_query)
+        except asyncpg.DuplicateTableError:
+            continue
+        except Exception as e:
+            print(f"failed to make table {table}")
+            raise e
+
+
+async def create_index(connection: asyncpg.Connection, index: models.Index, table: str):
+    """Creates an index without blocking writes to the table"""
+    # a concurrent build that failed leaves an invalid index behind, which IF NOT EXISTS would skip
+    invalid = await connection.fetchval("SELECT NOT i.indisvalid FROM pg_index i "
+                                        "INNER JOIN pg_class c ON c.oid = i.indexrelid "
+                                        "WHERE c.relname = $1", index.name)
+    if invalid:
+        await connection.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name};")
+    # partitioned tables can't be indexed concurrently, the index is built on every partition
+    # and partitions created later get it as well
+    concurrently = not await partitions.is_partitioned(connection, table)
+    await connection.execute(index.create(table, concurrently=concurrently))
+
+
+async def create_indexes(connection: asyncpg.Connection):
+    """Creates every index declared in a model's INDEXES"""
+    for model, table in models.tables.items():
+        for index in model.INDEXES:
+            await create_index(connection, index, table)
+
+
+async def create_command_rollups(connection: asyncpg.Connection):
+    """Daily command usage rollups per guild and globally, backfilled from the commands already logged"""
+    await connection.execute("""
+    CREATE TABLE IF NOT EXISTS command_usage_daily(
+    day date,
+    guild bigint references guilds(id) on DELETE CASCADE,
+    command text,
+    uses bigint,
+    PRIMARY KEY (guild, day, command));
+    CREATE TABLE IF NOT EXISTS command_author_daily(
+    day date,
+    guild bigint references guilds(id) on DELETE CASCADE,
+    author bigint,
+    uses bigint,
+    PRIMARY KEY (guild, day, author));
+    CREATE TABLE IF NOT EXISTS command_usage_global_daily(
+    day date,
+    command text,
+    uses bigint,
+    PRIMARY KEY (day, command));
+    CREATE TABLE IF NOT EXISTS command_author_global_daily(
+    day date,
+    author bigint,
+    uses bigint,
+    PRIMARY KEY (day, author));
+    TRUNCATE command_usage_daily, command_author_daily, command_usage_global_daily, command_author_global_daily;
+    INSERT INTO command_usage_daily SELECT called::date, guild, command, COUNT(*) FROM commands
+    WHERE guild IS NOT NULL AND called IS NOT NULL AND command IS NOT NULL GROUP BY 1, 2, 3;
+    INSERT INTO command_author_daily SELECT called::date, guild, author, COUNT(*) FROM commands
+    WHERE guild IS NOT NULL AND called IS NOT NULL AND author IS NOT NULL GROUP BY 1, 2, 3;
+    INSERT INTO command_usage_global_daily SELECT day, command, SUM(uses) FROM command_usage_daily GROUP BY 1, 2;
+    INSERT INTO command_author_global_daily SELECT day, author, SUM(uses) FROM command_author_daily GROUP BY 1, 2;
+    """)
+
+
+async def partition_logs(connection: asyncpg.Connection):
+    """Turns the log tables into tables range partitioned by month
+
+    Tables created before partitioning are rebuilt: the old table is renamed aside, its rows are copied
+    into the partitioned one and it is dropped. Rows without a timestamp land in the default partition.
+    """
+    current = partitions.month_start(datetime.datetime.utcnow())
+    for model, table in models.tables.items():
+        if not model.PARTITION_KEY:
+            continue
+        if await partitions.is_partitioned(connection, table):
+            await partitions.create_partitions(connection, table, current,
+                                               partitions.add_months(current, partitions.MONTHS_AHEAD))
+            continue
+        legacy = f"{table}_legacy"
+        await connection.execute(f"ALTER TABLE {table} RENAME TO {legacy};")
+        # frees the primary key and index names for the new table
+        indexes = await connection.fetch("SELECT c.relname FROM pg_index i "
+                                         "INNER JOIN pg_class c ON c.oid = i.indexrelid "
+                                         "WHERE i.indrelid = $1::regclass", legacy)
+        for record in indexes:
+            await connection.execute(f"ALTER INDEX {record['relname']} RENAME TO {record['relname']}_legacy;")
+        await connection.execute(model.setup_table())
+        first = await connection.fetchval(f"SELECT MIN({model.PARTITION_KEY}) FROM {legacy}")
+        await partitions.create_partitions(connection, table, first or current,
+                                           partitions.add_months(current, partitions.MONTHS_AHEAD))
+        columns = clean_columns(field.name for field in model.get_fields())
+        values = [f"COALESCE({column}, '-infinity')" if column == model.PARTITION_KEY else column
+                  for column in columns]
+        await connection.execute(f"INSERT INTO {table} ({','.join(columns)}) "
+                                 f"SELECT {','.join(values)} FROM {legacy};")
+        # serial ids continue from the old sequence, setval ignores tables without one
+        await connection.execute(f"SELECT setval(pg_get_serial_sequence($1, 'id'), GREATEST(MAX(id), 1)) "
+                                 f"FROM {table};", table)
+        for index in model.INDEXES:
+            await connection.execute(index.create(table, concurrently=False))
+        await connection.execute(f"DROP TABLE {legacy};")
+
+
+async def add_tag_search(connection: asyncpg.Connection):
+    """Adds the full text search column to tags along with the trigger keeping it current, then fills it in"""
+    await connection.execute("ALTER TABLE tags ADD COLUMN IF NOT EXISTS search tsvector;")
+    await connection.execute(tag.SEARCH_TRIGGER)
+    # setting the title fires the trigger for every existing tag
+    await connection.execute("UPDATE tags SET title = title;")
+
+
+async def create_tag_search_index(connection: asyncpg.Connection):
+    await create_index(connection, tag.SEARCH_INDEX, models.tables[models.Tag])
+
+
+async def cascade_nickname_guilds(connection: asyncpg.Connection):
+    """Lets deleting a guild remove its nickname history, which the guild foreign key used to block"""
+    await connection.execute("ALTER TABLE nicknames DROP CONSTRAINT IF EXISTS nicknames_guild_fkey;"
+                             "ALTER TABLE nicknames ADD CONSTRAINT nicknames_guild_fkey FOREIGN KEY (guild) "
+                             "REFERENCES guilds(id) ON DELETE CASCADE;")
+
+
+MIGRATIONS: typing.List[Migration] = [
+    Migration(1, "create tables", create_tables),
+    Migration(2, "hot path indexes", create_indexes, transactional=False),
+    Migration(3, "command usage rollups", create_command_rollups),
+    Migration(4, "partition command and tag call logs", partition_logs),
+    Migration(5, "tag search column", add_tag_search),
+    Migration(6, "tag search index", create_tag_search_index, transactional=False),
+    Migration(7, "tag id range index", create_indexes, transactional=False),
+    Migration(8, "cascade nickname guild deletes", cascade_nickname_guilds),
+]
+
+
+def latest_version() -> int:
+    return max(migration.version for migration in MIGRATIONS)
+
+
+async def get_version(connection: asyncpg.Connection) -> int:
+    try:
+        return await connection.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def migrate(connection: asyncpg.Connection) -> typing.List[Migration]:
+    """Applies every migration newer than the recorded schema version, returns the ones applied
+
+    When the schema is already current this is a single SELECT and no DDL is sent.
+    """
+    if await get_version(connection) >= latest_version():
+        return []
+    applied = []
+    await connection.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK)
+    try:
+        await connection.execute("CREATE TABLE IF NOT EXISTS schema_migrations(version integer primary key,"
+                                 "name text,"
+                                 "applied timestamp);")
+        # another process may have migrated while we waited on the lock
+        version = await get_version(connection)
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if migration.version <= version:
+                continue
+            log.info(f"applying migration {migration.version}: {migration.name}")
+            if migration.transactional:
+                async with connection.transaction():
+                    await migration.apply(connection)
+                    await _record(connection, migration)
+            else:
+                await migration.apply(connection)
+                await _record(connection, migration)
+            applied.append(migration)
+    finally:
+        await connection.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK)
+    return applied
+
+
+async def _record(connection: asyncpg.Connection, migration: Migration):
+    await connection.execute("INSERT INTO schema_migrations (version, name, applied) VALUES ($1,$2,$3) "
+                             "ON CONFLICT (version) DO NOTHING;",
+                             migration.version, migration.name, datetime.datetime.utcnow())
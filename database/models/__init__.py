@@ -7,11 +7,11 @@ from .faq import FAQ
 from .reaction_role import ReactionRole
 from .guild import Guild, CommandStats
 from .member import Member
-from .model import Model
+from .model import Model, Index, slotted
 from .nickname import NickName
 from .prefix import Prefix
 from .reminder import Reminder
-from .tag import Tag, TagLookup
+from .tag import Tag, TagLookup, TagMatch
 from .tag_call import TagCall
 from .task import Task
 from .user import User
@@ -3,9 +3,10 @@ import typing
 
 import discord
 
-from database.models.model import Model
+from database.models.model import Model, slotted
 
 
+@slotted
 @dataclasses.dataclass()
 class Activity(Model):
     guild: int = None
@@ -1,11 +1,17 @@
 import dataclasses
 import datetime
 
-from database.models.model import Model
+from database.models.model import Model, Index
 
 
 @dataclasses.dataclass()
 class CommandCall(Model):
+    PRIMARY_KEY = ("id", "called")
+    PARTITION_KEY = "called"
+    INDEXES = (
+        Index("commands_guild_idx", "guild, called"),
+        Index("commands_called_date_idx", "(called::date), guild"),
+    )
     command: str = None
     guild: int = None
     author: int = None
@@ -14,8 +20,9 @@ class CommandCall(Model):
     @classmethod
     def setup_table(cls) -> str:
         return 'CREATE TABLE IF NOT EXISTS commands (' \
-               'id bigint primary key ,' \
+               'id bigint ,' \
                'command text,' \
                'guild bigint references guilds(id) on DELETE CASCADE ,' \
                'author bigint ,' \
-               'called timestamp);'
+               'called timestamp,' \
+               'PRIMARY KEY (id, called)) PARTITION BY RANGE (called);'
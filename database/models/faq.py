@@ -1,9 +1,10 @@
 import dataclasses
 import datetime
 
-from database.models.model import Model
+from database.models.model import Model, slotted
 
 
+@slotted
 @dataclasses.dataclass()
 class FAQ(Model):
     guild: int = None
@@ -1,25 +1,34 @@
 import dataclasses
 import datetime
+import random
+import types
 import typing
 
 import asyncpg
 import discord
 from sentry_sdk import capture_exception
 
+from database.cache import CachedTag, RandomIdSet
 from database.models import ReactionRole
 from database.models.activity import Activity
 from database.models.channel import Channel
 from database.models.command_call import CommandCall
 from database.models.faq import FAQ
 from database.models.member import Member
-from database.models.model import Model
+from database.models.model import Model, slotted
 from database.models.prefix import Prefix
 from database.models.reminder import Reminder
-from database.models.tag import Tag
+from database.models.tag import Tag, TagMatch, TAG_COLUMNS
+from database.pools import ANALYTICS
+from database.tag_index import TagTitleIndex
 from utils.errors import ActivityAlreadyExists
 from utils.iceteacontext import IceTeaContext
 
+# what the child collection properties return for a kind of child a guild has none of
+EMPTY: typing.Mapping = types.MappingProxyType({})
 
+
+@slotted
 @dataclasses.dataclass()
 class Guild(Model):
     welcome_channel: int = None
@@ -28,12 +37,22 @@ class Guild(Model):
     leaving_message: str = None
     tracking: bool = True
     premium: bool = False
-    _blocked_channels: typing.Dict[int, "Channel"] = dataclasses.field(default_factory=dict, repr=False, compare=False)
-    _prefixes: typing.Dict[str, "Prefix"] = dataclasses.field(default_factory=dict, repr=False, compare=False)
-    _activities: typing.Dict[str, "Activity"] = dataclasses.field(default_factory=dict, repr=False, compare=False)
-    _faqs: typing.Dict[str, "FAQ"] = dataclasses.field(default_factory=dict, repr=False, compare=False)
-    _reaction_roles: typing.List["ReactionRole"] = dataclasses.field(default_factory=list, repr=False,
-                                                                     compare=False)
+    # set by the newuserrole command, guilds has no columns for them so like before they aren't saved
+    role: int = None
+    delay: int = 0
+    # child collections are created by the first child of their kind, most guilds never need all five
+    _blocked_channels: typing.Optional[typing.Dict[int, "Channel"]] = dataclasses.field(default=None, repr=False,
+                                                                                        compare=False)
+    _prefixes: typing.Optional[typing.Dict[str, "Prefix"]] = dataclasses.field(default=None, repr=False,
+                                                                               compare=False)
+    _activities: typing.Optional[typing.Dict[str, "Activity"]] = dataclasses.field(default=None, repr=False,
+                                                                                   compare=False)
+    _faqs: typing.Optional[typing.Dict[str, "FAQ"]] = dataclasses.field(default=None, repr=False, compare=False)
+    _reaction_roles: typing.Optional[typing.List["ReactionRole"]] = dataclasses.field(default=None, repr=False,
+                                                                                      compare=False)
+    CHILD_MODELS = (Prefix, FAQ, Activity, Channel, ReactionRole)
+    SEARCH_CANDIDATES = 1000
+    MAX_CACHED_TAG_IDS = 100000
 
     @classmethod
     def setup_table(cls) -> str:
@@ -46,17 +65,25 @@ class Guild(Model):
                'tracking boolean,' \
                'premium boolean);'
 
+    def _collection(self, name: str, factory: typing.Callable = dict):
+        """The named child collection, created if the guild has none yet, for adding children to"""
+        collection = getattr(self, name)
+        if collection is None:
+            collection = factory()
+            setattr(self, name, collection)
+        return collection
+
     @property
     def activities(self):
-        return self._activities
+        return self._activities or EMPTY
 
     @activities.setter
     def activities(self, value):
         self._activities = value
 
     @property
-    def prefixes(self) -> typing.Dict[str, "Prefix"]:
-        return self._prefixes
+    def prefixes(self) -> typing.Mapping[str, "Prefix"]:
+        return self._prefixes or EMPTY
 
     @prefixes.setter
     def prefixes(self, value):
@@ -64,7 +91,7 @@ class Guild(Model):
 
     @property
     def faqs(self):
-        return self._faqs
+        return self._faqs or EMPTY
 
     @faqs.setter
     def faqs(self, value):
@@ -72,46 +99,73 @@ class Guild(Model):
 
     @property
     def activity_roles(self) -> typing.List[typing.Optional[discord.Role]]:
-        return [activity.get_role() for activity in self._activities.values()]
+        return [activity.get_role() for activity in self.activities.values()]
 
     @property
     def blocked_channels(self):
-        return self._blocked_channels
+        return self._blocked_channels or EMPTY
 
     @property
-    def reaction_roles(self):
-        return self._reaction_roles
+    def reaction_roles(self) -> typing.Sequence["ReactionRole"]:
+        return self._reaction_roles or ()
+
+    def attach(self, child: "Model"):
+        """Adds a row from one of the CHILD_MODELS tables to the guild's cached collections"""
+        if isinstance(child, Prefix):
+            self._collection("_prefixes")[str(child)] = child
+        elif isinstance(child, FAQ):
+            self._collection("_faqs")[child.id] = child
+        elif isinstance(child, Activity):
+            self._collection("_activities")[child.id] = child
+        elif isinstance(child, Channel):
+            self._collection("_blocked_channels")[child.id] = child
+        elif isinstance(child, ReactionRole):
+            self._collection("_reaction_roles", list).append(child)
+        else:
+            raise TypeError(f"{type(child).__name__} is not a guild child model")
 
     def get_reaction_role(self, message_id, emoji) -> typing.Optional['ReactionRole']:
-        return discord.utils.get(self._reaction_roles, message_id=message_id,
+        return discord.utils.get(self.reaction_roles, message_id=message_id,
                                  emoji=emoji)
 
     async def add_member(self, mid):
         new_member = Member(self.client, mid, guild=self.id)
-        connection: asyncpg.Connection = await self.client.pool.acquire()
+        if self.client.known_members.contains(self.id, mid):
+            return new_member
         try:
-            transaction: asyncpg.connection.transaction.Transaction = connection.transaction()
-            await transaction.start()
-            await connection.execute("INSERT INTO users (id) VALUES ($1) ON CONFLICT(id) do nothing;", mid)
-            await connection.execute("INSERT INTO members (id,guild) VALUES ($1,$2) on conflict(id,guild) do nothing;",
-                                     mid, self.id)
-            await transaction.commit()
+            async with self.client.acquire("add member", mid) as execution:
+                connection = execution.connection
+                async with connection.transaction():
+                    await connection.execute("INSERT INTO users (id) VALUES ($1) ON CONFLICT(id) do nothing;", mid)
+                    await connection.execute("INSERT INTO members (id,guild) VALUES ($1,$2) "
+                                             "on conflict(id,guild) do nothing;", mid, self.id)
+            self.client.known_members.add(self.id, mid)
         except Exception as e:
             capture_exception(e)
-        finally:
-            await self.client.pool.release(connection)
         return new_member
 
     async def add_members(self, members: typing.List[int]):
         await self.client.execute_many("INSERT INTO members (id,guild) VALUES($1,$2) on conflict do nothing;",
                                        [(user, self.id) for user in members])
 
+    def member_joined(self, mid: int):
+        """Queues a membership for the next membership batch"""
+        self.client.memberships.add(mid, self.id, joined=True)
+
+    def member_left(self, mid: int):
+        """Queues a membership removal for the next membership batch"""
+        self.client.memberships.add(mid, self.id, joined=False)
+
     async def remove_member(self, mid):
+        self.client.known_members.remove(self.id, mid)
+        self.client.user_data.pop((self.id, mid))
         await self.client.execute("DELETE FROM members where id = $1 and guild = $2", mid, self.id)
 
-    async def remove_members(self, members: typing.List[int]):
-        await self.client.execute_many("DELETE FROM members WHERE id = $1 and guild = $2;",
-                                       [(user, self.id) for user in members])
+    async def remove_members(self, members: typing.List[int]) -> int:
+        for member in members:
+            self.client.known_members.remove(self.id, member)
+            self.client.user_data.pop((self.id, member))
+        return await self.client.delete_all(Member(self.client, user, guild=self.id) for user in members)
 
     async def get_member(self, mid) -> "Member":
         member = await self.client.get_model(Member, "SELECT * FROM members "
@@ -127,69 +181,61 @@ class Guild(Model):
                                       gid)
         return members
 
-    async def add_member_nickname(self, mid: int, nickname: str):
-        connection: asyncpg.Connection = await self.client.pool.acquire()
-        try:
-            transaction: asyncpg.connection.transaction.Transaction = connection.transaction()
-            await transaction.start()
-            await connection.execute("INSERT INTO users (id) VALUES ($1) ON CONFLICT(id) do nothing;", mid)
-            await connection.execute("INSERT INTO members (id,guild) VALUES ($1,$2) on conflict do nothing;", mid,
-                                     self.id)
-            await connection.execute(
-                "INSERT INTO nicknames (id, member, nickname, changed, guild) VALUES ($1,$2,$3,$4,$5)",
-                next(self.client.generator), mid,
-                nickname, datetime.datetime.utcnow(), self.id)
-            await transaction.commit()
-        except Exception as e:
-            capture_exception(e)
-        finally:
-            await self.client.pool.release(connection)
+    def add_member_nickname(self, mid: int, nickname: str):
+        """Queues a nickname change, it is written with the next nickname batch"""
+        self.client.nicknames.add(mid, self.id, nickname)
 
     async def find_tag_by_id(self, tid) -> typing.Optional["Tag"]:
-        return await self.client.get_model(Tag, "SELECT * FROM tags where id = $1", tid)
+        return await self.client.get_model(Tag, f"SELECT {TAG_COLUMNS} FROM tags where id = $1", tid)
 
     async def get_tag(self, title: str) -> typing.Optional["Tag"]:
         tag = await self.client.get_model(Tag,
-                                          'SELECT t.title <> tags.title AS "alias", t.count, tags.* '
+                                          f'SELECT t.title <> tags.title AS "alias", t.count, {TAG_COLUMNS} '
                                           'FROM tags INNER JOIN tagslink t on tags.id = t.tag '
                                           'WHERE t.guild = $1 and t.title = $2',
                                           self.id, title)
         return tag
 
     async def get_all_tags(self) -> typing.List["Tag"]:
-        return [tag async for tag in self.client.get_all(Tag, "SELECT * FROM tags WHERE guild = $1", self.id)]
+        return await self.client.get_models(Tag, f"SELECT {TAG_COLUMNS} FROM tags WHERE guild = $1", self.id)
 
     async def get_member_tags(self, author: int) -> typing.List["Tag"]:
-        tags = self.client.get_all(Tag, 'SELECT * FROM tags where author = $1 and guild = $2', author, self.id)
-        return [tag async for tag in tags]
+        return await self.client.get_models(Tag,
+                                            f'SELECT {TAG_COLUMNS} FROM tags where author = $1 and guild = $2',
+                                            author, self.id)
 
     async def get_member_top_tags(self, author: int) -> typing.List["Tag"]:
         return [tag async for tag in self.client.get_all(Tag,
                                                          "SELECT * FROM tagslink where author = $1 and guild = $2 "
                                                          "ORDER BY count DESC LIMIT 5",
-                                                         author, self.id)]
+                                                         author, self.id, pool=ANALYTICS)]
 
     async def get_tag_stats(self) -> typing.Tuple[int, int]:
-        response = await self.client.get('SELECT SUM(count),COUNT(id) FROM tagslink WHERE guild = $1', self.id)
+        response = await self.client.get('SELECT SUM(count),COUNT(id) FROM tagslink WHERE guild = $1', self.id,
+                                         pool=ANALYTICS)
         return response['sum'], response['count']
 
     async def get_top_tag_users(self) -> typing.List[asyncpg.Record]:
         users = await self.client.raw_get_all(
-            "SELECT author, COUNT(author) FROM tagcalls WHERE guild = $1 ORDER BY COUNT(author) DESC LIMIT 5", self.id)
+            "SELECT author, COUNT(author) FROM tagcalls WHERE guild = $1 ORDER BY COUNT(author) DESC LIMIT 5", self.id,
+            pool=ANALYTICS)
         return users
 
     async def get_top_tags(self):
         return [tag async for tag in
                 self.client.get_all(Tag, "SELECT * FROM tagslink "
-                                         "where guild = $1 ORDER BY count DESC LIMIT  5", self.id)]
+                                         "where guild = $1 ORDER BY count DESC LIMIT  5", self.id,
+                                    pool=ANALYTICS)]
 
     async def get_top_tag_creators(self) -> typing.List[asyncpg.Record]:
         return await self.client.raw_get_all(
-            "SELECT author,Count(author) FROM tags WHERE guild = $1 ORDER BY Count(author) DESC  LIMIT 5", self.id)
+            "SELECT author,Count(author) FROM tags WHERE guild = $1 ORDER BY Count(author) DESC  LIMIT 5", self.id,
+            pool=ANALYTICS)
 
     async def get_member_tag_count(self, mid: int):
         return await self.client.get(
-            "SELECT COUNT(author), SUM(count) FROM tagslink WHERE guild = $1 and author = $2", self.id, mid)
+            "SELECT COUNT(author), SUM(count) FROM tagslink WHERE guild = $1 and author = $2", self.id, mid,
+            pool=ANALYTICS)
 
     async def get_all_aliases(self, tag: typing.Union["Tag", int]) -> typing.List["Tag"]:
         tag_id = getattr(tag, "id", tag)
@@ -197,79 +243,142 @@ class Guild(Model):
         return [alias async for alias in response]
 
     async def create_tag(self, title: str, content: str, author: int):
-        tag_id = next(self.client.generator)
-        tag_link_id = next(self.client.generator)
+        tag_id, tag_link_id = self.client.next_ids(2)
         query = 'WITH tag_insert AS ' \
                 '(INSERT INTO tags (id, author, title, content, created, last_edited, guild) ' \
                 'VALUES ($1,$2,$3,$4,$5,NULL,$6) RETURNING id) ' \
                 'INSERT INTO tagslink (id, title, guild, tag,author,count) VALUES ($7,$3,$6,$1,$2,0);'
-        connection: asyncpg.Connection = await self.client.pool.acquire()
-        transaction: asyncpg.connection.transaction.Transaction = connection.transaction()
-        await transaction.start()
-        try:
-            await connection.execute(query, tag_id, author, title.lower(), content, datetime.datetime.utcnow(), self.id,
-                                     tag_link_id)
-            await transaction.commit()
-        except asyncpg.UniqueViolationError as e:
-            await transaction.rollback()
-            raise e
-        except Exception as e:
-            await transaction.rollback()
-            raise e
-        finally:
-            await self.client.pool.release(connection)
+        # a single statement, so both rows are written or neither is
+        await self.client.execute(query, tag_id, author, title.lower(), content, datetime.datetime.utcnow(), self.id,
+                                  tag_link_id)
+        self.client.tag_cache.invalidate(self.id, title.lower())
+        self.client.tag_titles.add(self.id, title.lower())
+        self.client.tag_ids.add(self.id, tag_id)
 
     async def create_alias(self, original: str, new_alias: str, author: int):
-        snowflake = next(self.client.generator)
+        snowflake = self.client.next_id()
+        new_alias = new_alias.lower()
         query = 'INSERT INTO tagslink (id, title,author, guild,count, tag) ' \
-                'SELECT $1,$4,$5,0, tagslink.guild,tagslink.tag FROM tagslink ' \
+                'SELECT $1,$4,$5,tagslink.guild,0,tagslink.tag FROM tagslink ' \
                 'WHERE tagslink.guild = $3 AND LOWER(tagslink.title)=$2; '
-        await self.client.execute(query, snowflake, original, self.id, new_alias, author)
-
-    async def call_tag(self, request: str, channel: int, author: int):
-        connection: asyncpg.Connection = await self.client.pool.acquire()
-        try:
-            transaction: asyncpg.connection.transaction.Transaction = connection.transaction()
-            await transaction.start()
-            await connection.execute("UPDATE tagslink set count = count + 1 WHERE guild = $1 AND title = $2",
-                                     self.id, request)
-            tag = await connection.fetchrow("SELECT t.content FROM tagslink "
-                                            "INNER JOIN tags t on tagslink.tag = t.id WHERE tagslink.title = $1",
-                                            request.lower())
-            tag_id = await connection.fetchrow("SELECT tagslink.id FROM tagslink WHERE tagslink.title = $1",
-                                               request.lower())
-            await connection.execute(
-                "INSERT INTO tagcalls (id,tag_id, author, channel, guild, called) VALUES (DEFAULT,$1,$2,$3,$4,$5)",
-                tag_id['id'], author, channel, self.id, datetime.datetime.utcnow())
-            if tag:
-                await transaction.commit()
-                return tag['content']
+        status = await self.client.execute(query, snowflake, original.lower(), self.id, new_alias, author)
+        self.client.tag_cache.invalidate(self.id, new_alias)
+        if status != "INSERT 0 0":
+            self.client.tag_titles.add(self.id, new_alias)
+
+    async def call_tag(self, request: str, channel: int, author: int) -> typing.Optional[str]:
+        title = request.lower()
+        tag = self.client.tag_cache.get(self.id, title)
+        if tag is None:
+            record = await self.client.get("SELECT tagslink.id AS link_id, t.id AS tag_id, t.content FROM tagslink "
+                                           "INNER JOIN tags t on tagslink.tag = t.id "
+                                           "WHERE tagslink.guild = $1 AND tagslink.title = $2",
+                                           self.id, title)
+            if record is None:
+                return None
+            tag = CachedTag(record['tag_id'], record['link_id'], record['content'])
+            self.client.tag_cache.put(self.id, title, tag)
+        self.client.tag_uses.add(tag.link_id)
+        self.client.tag_calls.add(tag.link_id, author, channel, self.id)
+        return tag.content
+
+    async def get_title_index(self) -> TagTitleIndex:
+        """The guild's tag and alias titles, read from the database the first time they are needed"""
+        index = self.client.tag_titles.get(self.id)
+        if index is None:
+            records = await self.client.raw_get_all("SELECT title FROM tagslink WHERE guild = $1", self.id)
+            index = TagTitleIndex(record['title'] for record in records if record['title'])
+            self.client.tag_titles.put(self.id, index)
+        return index
+
+    async def search_tags(self, query: str, limit: int = 5) -> typing.List[str]:
+        """Titles starting with ``query`` followed by the ones closest to it"""
+        index = await self.get_title_index()
+        return index.search(query, limit)
+
+    async def search_tag_content(self, query: str, limit: int = 10,
+                                 after: typing.Tuple[float, int] = None) -> typing.Tuple[typing.List[TagMatch],
+                                                                                         typing.Optional[tuple]]:
+        """Tags whose title or content match ``query``, best ranked first
+
+        Returns a page of matches and the cursor to pass as ``after`` for the next page, which is None
+        on the last page. Only the newest ``SEARCH_CANDIDATES`` matches are ranked, so terms that are in
+        most of a large guild's tags still answer in bounded time.
+        """
+        rank, last_id = after or (None, None)
+        records = await self.client.raw_get_all(
+            "WITH query AS (SELECT websearch_to_tsquery('english', $2) AS query), "
+            "candidates AS (SELECT tags.id, tags.title, tags.content, tags.search FROM tags, query "
+            "WHERE tags.guild = $1 AND tags.search @@ query.query ORDER BY tags.id DESC LIMIT $6), "
+            "ranked AS (SELECT c.id, c.title, c.content, ts_rank_cd(c.search, query.query) AS rank "
+            "FROM candidates c, query) "
+            "SELECT ranked.id, ranked.title, ranked.rank, "
+            "ts_headline('english', ranked.content, query.query, "
+            "'StartSel=**, StopSel=**, MaxWords=12, MinWords=4, MaxFragments=1') AS snippet "
+            "FROM ranked, query "
+            "WHERE $3::real IS NULL OR (ranked.rank, ranked.id) < ($3::real, $4::bigint) "
+            "ORDER BY ranked.rank DESC, ranked.id DESC LIMIT $5",
+            self.id, query, rank, last_id, limit + 1, self.SEARCH_CANDIDATES)
+        matches = [TagMatch(*record) for record in records[:limit]]
+        cursor = (matches[-1].rank, matches[-1].id) if len(records) > limit else None
+        return matches, cursor
+
+    async def get_tag_ids(self) -> typing.Optional[RandomIdSet]:
+        """The ids of the guild's tags, read once and kept current by tag create and delete
+
+        Guilds with more than ``MAX_CACHED_TAG_IDS`` tags are not held in memory, None is returned.
+        """
+        cache = self.client.tag_ids
+        if self.id not in cache:
+            records = await self.client.raw_get_all("SELECT id FROM tags WHERE guild = $1 LIMIT $2",
+                                                    self.id, self.MAX_CACHED_TAG_IDS + 1)
+            if len(records) > self.MAX_CACHED_TAG_IDS:
+                cache.put(self.id, None)
             else:
-                await transaction.rollback()
-        except Exception as e:
-            capture_exception(e)
-            raise e
-        finally:
-            await self.client.pool.release(connection)
-
-    async def search_tags(self, query: str) -> typing.List["Tag"]:
-        return [tag async for tag in self.client.get_all(Tag,
-                                                         "SELECT title FROM tags WHERE guild = $1 "
-                                                         "and levenshtein(title,$2) <= 3 "
-                                                         "ORDER BY levenshtein(title,$2) DESC LIMIT 5",
-                                                         self.id, query)]
+                cache.put(self.id, RandomIdSet(record['id'] for record in records))
+        return cache.get(self.id)
+
+    async def probe_random_tag_ids(self, count: int) -> typing.List[int]:
+        """Picks tags by seeking to random points in the guild's id range
+
+        Two index lookups per pick regardless of guild size, but ids that follow a large gap are more
+        likely to be picked, so this is only used when the ids aren't cached.
+        """
+        bounds = await self.client.get("SELECT MIN(id), MAX(id) FROM tags WHERE guild = $1", self.id)
+        if bounds['min'] is None:
+            return []
+        points = [random.randint(bounds['min'], bounds['max']) for _ in range(count * 2)]
+        records = await self.client.raw_get_all("SELECT DISTINCT (SELECT id FROM tags WHERE guild = $1 AND id >= p "
+                                                "ORDER BY id LIMIT 1) AS id FROM unnest($2::bigint[]) p",
+                                                self.id, points)
+        return [record['id'] for record in records][:count]
+
+    async def get_random_tags(self, count: int = 1) -> typing.List["Tag"]:
+        """Up to ``count`` distinct random tags"""
+        ids = await self.get_tag_ids()
+        chosen = ids.sample(count) if ids is not None else await self.probe_random_tag_ids(count)
+        if not chosen:
+            return []
+        tags = await self.client.get_models(Tag, f"SELECT {TAG_COLUMNS} FROM tags WHERE guild = $1 "
+                                                 f"AND id = any($2::bigint[])",
+                                            self.id, chosen)
+        if ids is not None and len(tags) < len(chosen):
+            # deleted by something that didn't go through the cache
+            found = {tag.id for tag in tags}
+            for tag_id in chosen:
+                if tag_id not in found:
+                    ids.remove(tag_id)
+        random.shuffle(tags)
+        return tags
 
     async def get_random_tag(self) -> typing.Optional["Tag"]:
-        return await self.client.get_model(Tag,
-                                           "SELECT title,content FROM tags WHERE guild = $1"
-                                           " OFFSET FLOOR(RANDOM() * (SELECT COUNT(*) "
-                                           "FROM tags where guild = $1)) LIMIT 1",
-                                           self.id)
+        tags = await self.get_random_tags(1)
+        return tags[0] if tags else None
 
     async def call_command(self, ctx: "IceTeaContext"):
         command_call = CommandCall(self.client, author=ctx.author.id, called=ctx.message.created_at,
                                    command=ctx.command.qualified_name, guild=self.id)
-        await command_call.save()
+        self.client.command_calls.add(command_call)
         prefix = ctx.prefix_data
         if prefix:
             await prefix.use()
@@ -284,7 +393,7 @@ class Guild(Model):
             raise ActivityAlreadyExists
 
     async def remove_activity(self, name: str):
-        activity = self._activities.pop(name)
+        activity = self._collection("_activities").pop(name)
         await activity.delete()
         del activity
 
@@ -292,7 +401,7 @@ class Guild(Model):
         block = Channel(client=self.client, guild=self.id, blocker=author, reason=reason)
         response = await block.save()
         if response:
-            self._blocked_channels[channel] = block
+            self._collection("_blocked_channels")[channel] = block
             return block
 
     async def unblock_channel(self, channel):
@@ -300,7 +409,7 @@ class Guild(Model):
         if block is not None:
             response = await block.delete()
             if response:
-                del self.blocked_channels[channel]
+                del self._blocked_channels[channel]
                 return block
 
     async def add_faq(self, ctx, question: str, answer: str) -> typing.Optional["FAQ"]:
@@ -311,20 +420,22 @@ class Guild(Model):
 
     async def load_faqs(self):
         faqs = self.client.get_all(FAQ, "SELECT * FROM faqs WHERE guild = $1", self.id)
-        self._faqs = {faq.id: faq async for faq in faqs}
+        self._faqs = {faq.id: faq async for faq in faqs} or None
 
     async def load_prefixes(self):
         prefixes = self.client.get_all(Prefix, "SELECT * FROM prefixes WHERE guild = $1",
                                        self.id)
-        self._prefixes.update({str(prefix): prefix async for prefix in prefixes})
+        for prefix in [prefix async for prefix in prefixes]:
+            self.attach(prefix)
 
     async def load_activities(self):
         activities = self.client.get_all(Activity, "SELECT * FROM activities WHERE guild = $1", self.id)
-        self._activities.update({activity.id: activity async for activity in activities})
+        for activity in [activity async for activity in activities]:
+            self.attach(activity)
 
     async def load_blocked_channels(self):
         blocked_channels = self.client.get_all(Channel, "SELECT * FROM channels WHERE guild = $1", self.id)
-        self._blocked_channels = {channel.id: channel async for channel in blocked_channels}
+        self._blocked_channels = {channel.id: channel async for channel in blocked_channels} or None
 
     async def populate(self):
         await self.load_prefixes()
@@ -336,11 +447,11 @@ class Guild(Model):
     async def add_prefix(self, prefix: str, author: int):
         new_prefix = Prefix(guild=self.id, author=author, prefix=prefix, client=self.client)
         await new_prefix.save()
-        self._prefixes[prefix] = new_prefix
+        self._collection("_prefixes")[prefix] = new_prefix
         return new_prefix
 
     async def delete_prefix(self, prefix) -> typing.Optional["Prefix"]:
-        selected = self._prefixes.pop(prefix, None)
+        selected = self._collection("_prefixes").pop(prefix, None)
         if selected is not None:
             await selected.delete()
             return selected
@@ -355,41 +466,42 @@ class Guild(Model):
 
     async def get_command_stats_overall(self) -> dict:
         response = {}
-        top_commands = await self.client.raw_get_all("SELECT command,count(command) from commands "
+        top_commands = await self.client.raw_get_all("SELECT command,SUM(uses) AS count FROM command_usage_daily "
                                                      "WHERE guild = $1 "
-                                                     "group by command order by count(command) desc limit 5;", self.id)
+                                                     "group by command order by count desc limit 5;", self.id,
+                                                     pool=ANALYTICS)
         response['top_commands'] = {record['command']: record['count'] for record in top_commands}
-        top_command_users = await self.client.raw_get_all("SELECT author,count(command) from commands WHERE "
-                                                          "guild = $1 "
-                                                          "group by author order by count(command) desc limit 5;",
-                                                          self.id)
+        top_command_users = await self.client.raw_get_all("SELECT author,SUM(uses) AS count FROM command_author_daily "
+                                                          "WHERE guild = $1 "
+                                                          "group by author order by count desc limit 5;",
+                                                          self.id, pool=ANALYTICS)
         response['top_command_users'] = {record['author']: record['count'] for record in top_command_users}
         return response
 
     async def get_todays_stats(self) -> dict:
         response = {}
-        top_commands_today = await self.client.raw_get_all("SELECT command,count(command) from "
-                                                           "commands WHERE guild = $1 "
-                                                           "and called::date = CURRENT_DATE "
-                                                           "group by command order by count(command) desc limit 5;",
-                                                           self.id)
+        top_commands_today = await self.client.raw_get_all("SELECT command,uses AS count FROM command_usage_daily "
+                                                           "WHERE guild = $1 and day = CURRENT_DATE "
+                                                           "order by uses desc limit 5;",
+                                                           self.id, pool=ANALYTICS)
         response['top_commands_today'] = {record['command']: record['count'] for record in top_commands_today}
-        top_command_users_today = await self.client.raw_get_all("SELECT author,count(author) from "
-                                                                "commands WHERE guild = $1 "
-                                                                "and called::date = CURRENT_DATE "
-                                                                "group by author order by count(author) desc limit 5;",
-                                                                self.id)
+        top_command_users_today = await self.client.raw_get_all("SELECT author,uses AS count FROM "
+                                                                "command_author_daily "
+                                                                "WHERE guild = $1 and day = CURRENT_DATE "
+                                                                "order by uses desc limit 5;",
+                                                                self.id, pool=ANALYTICS)
         response['top_command_users_today'] = {record['author']: record['count'] for record in
                                                top_command_users_today}
         return response
 
     async def get_total_commands_used(self) -> int:
-        data = await self.client.fetch("SELECT COUNT(*) FROM commands WHERE guild = $1", self.id)
+        data = await self.client.fetch("SELECT COALESCE(SUM(uses), 0) AS count FROM command_usage_daily "
+                                       "WHERE guild = $1", self.id, pool=ANALYTICS)
         return data.get("count", 0)
 
     async def get_total_commands_used_today(self) -> int:
-        data = await self.client.fetch("SELECT COUNT(*) FROM commands WHERE guild = $1 and called::date = CURRENT_DATE",
-                                       self.id)
+        data = await self.client.fetch("SELECT COALESCE(SUM(uses), 0) AS count FROM command_usage_daily "
+                                       "WHERE guild = $1 and day = CURRENT_DATE", self.id, pool=ANALYTICS)
         return data.get("count", 0)
 
     async def get_command_stats(self) -> "CommandStats":
@@ -403,15 +515,15 @@ class Guild(Model):
     async def load_reaction_roles(self):
         gen = self.client.get_all(ReactionRole, "SELECT * FROM reaction_role WHERE guild = $1", self.id)
         roles = [role async for role in gen]
-        self._reaction_roles = roles
+        self._reaction_roles = roles or None
 
     async def add_role_reaction(self, author_id, message_id, emoji, role_id):
         role_reaction = ReactionRole(
-            self.client, id=next(self.client.generator), message_id=message_id, emoji=emoji, guild=self.id,
+            self.client, id=self.client.next_id(), message_id=message_id, emoji=emoji, guild=self.id,
             author=author_id, role=role_id
         )
         await role_reaction.save()
-        self._reaction_roles.append(role_reaction)
+        self._collection("_reaction_roles", list).append(role_reaction)
         return role_reaction
 
     async def update_role_reaction(self, message_id, emoji, new_role_id):
@@ -431,10 +543,10 @@ class Guild(Model):
             raise Exception()
 
     async def delete_role_reaction_by_message(self, message_id):
-        role_reactions = list(filter(lambda rr: rr.message_id == message_id, self._reaction_roles))
-        for reaction_role in role_reactions:
-            self._reaction_roles.remove(reaction_role)
-            await reaction_role.delete()
+        role_reactions = [rr for rr in self.reaction_roles if rr.message_id == message_id]
+        if role_reactions:
+            self._reaction_roles = [rr for rr in self._reaction_roles if rr.message_id != message_id] or None
+            await self.client.delete_all(role_reactions)
         return role_reactions
 
 
@@ -1,7 +1,9 @@
 import dataclasses
 import datetime
+import functools
 import typing
 
+from database.models.model import Index, Model
 from database.models.nickname import NickName
 from database.models.user import User
 
@@ -9,6 +11,9 @@ from database.models.user import User
 @dataclasses.dataclass()
 class Member(User):
     PRIMARY_KEY = ('id', 'guild')
+    INDEXES = (
+        Index("members_guild_idx", "guild"),
+    )
     guild: int = None
     last_spoke: datetime.datetime = None
     level: int = None
@@ -19,9 +24,11 @@ class Member(User):
     administrator: bool = False
 
     @classmethod
+    @functools.lru_cache(maxsize=None)
     def get_fields(cls):
-        return [field for field in dataclasses.fields(Member) if field not in dataclasses.fields(User) or
-                field.name == "id"]
+        user_fields = {field.name for field in dataclasses.fields(User)}
+        return tuple(field for field in dataclasses.fields(Member) if field.name not in user_fields or
+                     field.name == "id")
 
     @classmethod
     def setup_table(cls) -> str:
@@ -36,6 +43,17 @@ class Member(User):
                'administrator boolean, ' \
                'PRIMARY KEY (id,guild));'
 
+    @property
+    def cache_key(self) -> typing.Tuple[typing.Optional[int], int]:
+        return self.guild, self.id
+
+    async def save(self):
+        # the user's columns aren't saved with a member, so it isn't written through like a user is
+        try:
+            return await Model.save(self)
+        finally:
+            self.client.forget_user(self.id)
+
     async def get_nicknames(self) -> typing.List["NickName"]:
         nicknames = self.client.get_all(NickName,
                                         "SELECT * FROM nicknames WHERE member = $1 and guild = $2 "
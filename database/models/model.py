@@ -1,12 +1,59 @@
 import dataclasses
+import functools
 import typing
 
+from database.codec import ModelCodec, get_codec
+
+
+@dataclasses.dataclass(frozen=True)
+class Index:
+    """A secondary index declared on a model
+
+    ``columns`` is placed inside the index's parentheses as is, so it may hold expressions such as
+    ``(called::date)``. ``where`` turns it into a partial index and ``method`` picks an access method
+    other than btree, such as ``gin``.
+    """
+    name: str
+    columns: str
+    where: str = None
+    unique: bool = False
+    method: str = None
+
+    def create(self, table: str, concurrently: bool = True) -> str:
+        query = f"CREATE {'UNIQUE ' if self.unique else ''}INDEX {'CONCURRENTLY ' if concurrently else ''}" \
+                f"IF NOT EXISTS {self.name} ON {table} {f'USING {self.method} ' if self.method else ''}" \
+                f"({self.columns})"
+        if self.where:
+            query += f" WHERE {self.where}"
+        return query + ";"
+
+
+def slotted(cls: type) -> type:
+    """Rebuilds a model dataclass with ``__slots__`` for the fields it declares, so its instances carry no
+    ``__dict__``. Goes above ``@dataclasses.dataclass()``.
+
+    Fields keep their defaults, so ``get_fields``, ``data``, the codec and ``save`` work as before. Only
+    attributes that aren't fields can no longer be set on instances.
+    """
+    inherited = {name for base in cls.__mro__[1:] for name in getattr(base, "__slots__", ())}
+    names = tuple(field.name for field in dataclasses.fields(cls) if field.name not in inherited)
+    namespace = dict(cls.__dict__)
+    for name in (*names, "__dict__", "__weakref__"):
+        namespace.pop(name, None)
+    namespace["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
 
 class Table:
+    __slots__ = ()
     PRIMARY_KEY: typing.Tuple[str] = ("id",)
+    INDEXES: typing.Tuple[Index, ...] = ()
+    # set on append only log tables that are range partitioned by month on this column
+    PARTITION_KEY: typing.Optional[str] = None
     IGNORED_FIELDS: typing.List[str] = dataclasses.field(default_factory=lambda: ["client", "bot"])
 
 
+@slotted
 @dataclasses.dataclass()
 class Model(Table):
     client: "SqlClient" = dataclasses.field(hash=False, compare=False, repr=False)
@@ -14,7 +61,7 @@ class Model(Table):
 
     def __post_init__(self):
         if not self.id and self.client:
-            self.id = next(self.client.generator)
+            self.id = self.client.next_id()
 
     def __eq__(self, other):
         return self.id == other.id
@@ -31,21 +78,26 @@ class Model(Table):
         return self.client.bot
 
     @property
-    def values(self) -> typing.ValuesView:
-        return self.data.values()
+    def values(self) -> tuple:
+        return self.codec().encode(self)
 
     @classmethod
     def setup_table(cls) -> str:
         raise NotImplementedError
 
     @classmethod
-    def get_fields(cls) -> typing.List[dataclasses.Field]:
+    @functools.lru_cache(maxsize=None)
+    def get_fields(cls) -> typing.Tuple[dataclasses.Field, ...]:
         fields = []
         for key in list(dataclasses.fields(cls)):
             key_name = key.name
             if not any([key_name.startswith("_"), key_name.isupper(), key_name in ['client', 'bot']]):
                 fields.append(key)
-        return fields
+        return tuple(fields)
+
+    @classmethod
+    def codec(cls) -> ModelCodec:
+        return get_codec(cls)
 
     async def refresh(self, data):
         fields = dataclasses.fields(self)
@@ -1,11 +1,14 @@
 import dataclasses
 import datetime
 
-from database.models.model import Model
+from database.models.model import Model, Index
 
 
 @dataclasses.dataclass()
 class NickName(Model):
+    INDEXES = (
+        Index("nicknames_member_guild_changed_idx", "member, guild, changed DESC"),
+    )
     member: int = None
     nickname: str = None
     changed: datetime.datetime = dataclasses.field(default_factory=datetime.datetime.utcnow)
@@ -21,4 +24,4 @@ class NickName(Model):
                'foreign key (member,guild) references members(id,guild) ON DELETE CASCADE ,' \
                'nickname text,' \
                'changed timestamp,' \
-               'guild bigint references guilds(id));'
+               'guild bigint references guilds(id) ON DELETE CASCADE);'
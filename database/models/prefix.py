@@ -1,9 +1,10 @@
 import dataclasses
 import datetime
 
-from database.models.model import Model
+from database.models.model import Model, slotted
 
 
+@slotted
 @dataclasses.dataclass()
 class Prefix(Model):
     guild: int = None
@@ -27,4 +28,4 @@ class Prefix(Model):
 
     async def use(self):
         self.uses += 1
-        await self.client.execute("UPDATE prefixes SET uses = uses + 1 WHERE id = $1", self.id)
+        self.client.prefix_uses.add(self.id)
@@ -4,9 +4,10 @@ import typing
 
 import discord
 
-from database.models.model import Model
+from database.models.model import Model, slotted
 
 
+@slotted
 @dataclasses.dataclass()
 class ReactionRole(Model):
     message_id: int = None
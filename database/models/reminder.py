@@ -2,12 +2,16 @@ import asyncio
 import dataclasses
 import datetime
 
-from database.models.model import Model
+from database.models.model import Model, Index
 from utils import time
 
 
 @dataclasses.dataclass()
 class Reminder(Model):
+    INDEXES = (
+        Index("reminders_delta_idx", "delta"),
+        Index("reminders_user_channel_idx", '"user", channel, delta'),
+    )
     user: int = None
     message: str = None
     guild: int = None
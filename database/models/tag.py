@@ -2,11 +2,50 @@ import dataclasses
 import datetime
 import typing
 
-from database.models.model import Model
+from database.models.model import Model, Index
+
+
+# the words of a tag's title and content, title words rank higher
+SEARCH_VECTOR = "setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') || " \
+                "setweight(to_tsvector('english', coalesce(NEW.content, '')), 'B')"
+
+# keeps the search column current, a generated column would need PostgreSQL 12
+SEARCH_TRIGGER = f"""
+CREATE OR REPLACE FUNCTION tags_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search := {SEARCH_VECTOR};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS tags_search_update ON tags;
+CREATE TRIGGER tags_search_update BEFORE INSERT OR UPDATE OF title, content ON tags
+FOR EACH ROW EXECUTE PROCEDURE tags_search_vector();
+"""
+
+# created by its own migration, once the search column exists
+SEARCH_INDEX = Index("tags_search_idx", "search", method="gin")
+
+# every column but the search vector, which there is no need to send back
+TAG_COLUMNS = "tags.id, tags.author, tags.title, tags.content, tags.created, tags.last_edited, tags.guild"
+
+
+class TagMatch(typing.NamedTuple):
+    """A tag found by searching its content, ``snippet`` holds the matching words in bold"""
+    id: int
+    title: str
+    rank: float
+    snippet: str
+
+    def __str__(self):
+        return f"{self.title} - {self.snippet}"
 
 
 @dataclasses.dataclass()
 class Tag(Model):
+    INDEXES = (
+        Index("tags_guild_author_idx", "guild, author"),
+        Index("tags_guild_id_idx", "guild, id"),
+    )
     author: int = None
     title: str = None
     content: str = None
@@ -25,13 +64,33 @@ class Tag(Model):
                'created timestamp,' \
                'last_edited timestamp,' \
                'guild bigint references guilds(id) on DELETE CASCADE , ' \
+               'search tsvector,' \
                'foreign key (author,guild) references members(id,guild) ON DELETE set null ,' \
-               'unique (title,guild));'
+               'unique (title,guild));' + SEARCH_TRIGGER
+
+    def __str__(self):
+        return self.title
 
     async def get_aliases(self) -> typing.List["Tag"]:
         return [alias async for alias in
                 self.client.get_all(Tag, "SELECT * FROM tagslink WHERE tag = $1", self.id)]
 
+    async def save(self):
+        response = await super().save()
+        self.client.tag_cache.invalidate_tag(self.guild, self.id)
+        if self.title:
+            self.client.tag_titles.add(self.guild, self.title)
+        self.client.tag_ids.add(self.guild, self.id)
+        return response
+
+    async def delete(self):
+        response = await super().delete()
+        self.client.tag_cache.invalidate_tag(self.guild, self.id)
+        # the aliases go with the tag, the index is rebuilt on its next search
+        self.client.tag_titles.invalidate(self.guild)
+        self.client.tag_ids.remove(self.guild, self.id)
+        return response
+
     async def edit(self, *, content: str):
         self.content = content
         self.last_edited = datetime.datetime.utcnow()
@@ -40,6 +99,11 @@ class Tag(Model):
 
 @dataclasses.dataclass()
 class TagLookup(Model):
+    INDEXES = (
+        Index("tagslink_guild_title_idx", "guild, title"),
+        Index("tagslink_tag_idx", "tag"),
+        Index("tagslink_guild_author_idx", "guild, author"),
+    )
     title: str = None
     author: int = None
     guild: int = None
@@ -1,11 +1,17 @@
 import dataclasses
 import datetime
 
-from database.models.model import Model
+from database.models.model import Model, Index
 
 
 @dataclasses.dataclass()
 class TagCall(Model):
+    PRIMARY_KEY = ("id", "called")
+    PARTITION_KEY = "called"
+    INDEXES = (
+        Index("tagcalls_guild_idx", "guild, author"),
+        Index("tagcalls_member_idx", "author, guild"),
+    )
     tag_id: int = None
     author: int = None
     channel: int = None
@@ -14,9 +20,10 @@ class TagCall(Model):
 
     @classmethod
     def setup_table(cls) -> str:
-        return 'CREATE TABLE IF NOT EXISTS tagcalls(id SERIAL PRIMARY KEY,' \
+        return 'CREATE TABLE IF NOT EXISTS tagcalls(id BIGSERIAL,' \
                'tag_id bigint,' \
                'author bigint,' \
                'channel bigint,' \
                'guild bigint references  guilds(id) on DELETE CASCADE,' \
-               'called timestamp, FOREIGN KEY (author,guild) REFERENCES members(id,guild) on DELETE CASCADE );'
+               'called timestamp, FOREIGN KEY (author,guild) REFERENCES members(id,guild) on DELETE CASCADE,' \
+               'PRIMARY KEY (id, called)) PARTITION BY RANGE (called);'
@@ -1,11 +1,15 @@
 import dataclasses
 import datetime
 
-from database.models.model import Model
+from database.models.model import Model, Index
 
 
 @dataclasses.dataclass()
 class Task(Model):
+    INDEXES = (
+        Index("tasks_author_idx", "author"),
+        Index("tasks_author_unfinished_idx", "author", where="finished IS NOT TRUE"),
+    )
     author: int = None
     created: datetime.datetime = dataclasses.field(default_factory=datetime.datetime.utcnow)
     content: str = None
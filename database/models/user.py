@@ -12,6 +12,20 @@ class User(Model):
     location: str = None
     blocked: bool = False
 
+    @property
+    def cache_key(self) -> typing.Tuple[typing.Optional[int], int]:
+        return None, self.id
+
+    async def save(self):
+        try:
+            response = await super().save()
+        finally:
+            # members in every guild hold a copy of these columns, and a failed save may have left
+            # unsaved changes in the cache
+            self.client.forget_user(self.id)
+        self.client.user_data.put(self.cache_key, self)
+        return response
+
     @classmethod
     def setup_table(cls) -> str:
         return f"CREATE TABLE IF NOT EXISTS users(id bigint primary key, " \
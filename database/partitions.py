@@ -0,0 +1,218 @@
+import asyncio
+import datetime
+import gzip
+import logging
+import os
+import re
+import typing
+
+import asyncpg
+
+from database import models
+from database.pools import BACKGROUND
+
+log = logging.getLogger(__name__)
+
+# how many months of partitions are kept created past the current one
+MONTHS_AHEAD = 3
+
+
+def month_start(day: typing.Union[datetime.date, datetime.datetime]) -> datetime.date:
+    return datetime.date(day.year, day.month, 1)
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    total = month.year * 12 + month.month - 1 + months
+    return datetime.date(total // 12, total % 12 + 1, 1)
+
+
+def partition_name(table: str, month: datetime.date) -> str:
+    return f"{table}_p{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(table: str, name: str) -> typing.Optional[datetime.date]:
+    """Reads the month back out of a partition name, None for anything that isn't a monthly partition"""
+    match = re.fullmatch(re.escape(table) + r"_p(\d{4})_(\d{2})", name)
+    if match is None:
+        return None
+    return datetime.date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def partitioned_tables() -> typing.Dict[str, str]:
+    """Every table declared as partitioned, mapped to the column it is partitioned on"""
+    return {table: model.PARTITION_KEY for model, table in models.tables.items() if model.PARTITION_KEY}
+
+
+async def is_partitioned(connection: asyncpg.Connection, table: str) -> bool:
+    return bool(await connection.fetchval("SELECT EXISTS(SELECT 1 FROM pg_partitioned_table p "
+                                          "INNER JOIN pg_class c ON c.oid = p.partrelid "
+                                          "WHERE c.relname = $1 AND c.relnamespace = current_schema()::regnamespace)",
+                                          table))
+
+
+async def get_partitions(connection: asyncpg.Connection, table: str) -> typing.Dict[datetime.date, str]:
+    """The monthly partitions currently attached to ``table``, by month"""
+    records = await connection.fetch("SELECT c.relname FROM pg_inherits i "
+                                     "INNER JOIN pg_class c ON c.oid = i.inhrelid "
+                                     "INNER JOIN pg_class p ON p.oid = i.inhparent "
+                                     "WHERE p.relname = $1 AND p.relnamespace = current_schema()::regnamespace",
+                                     table)
+    partitions = {}
+    for record in records:
+        month = partition_month(table, record['relname'])
+        if month is not None:
+            partitions[month] = record['relname']
+    return partitions
+
+
+async def get_detached(connection: asyncpg.Connection, table: str) -> typing.Dict[datetime.date, str]:
+    """Monthly partitions of ``table`` that were detached but never archived"""
+    records = await connection.fetch("SELECT c.relname FROM pg_class c "
+                                     "WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace "
+                                     "AND c.relname LIKE $1 AND NOT c.relispartition",
+                                     f"{table}\\_p%")
+    detached = {}
+    for record in records:
+        month = partition_month(table, record['relname'])
+        if month is not None:
+            detached[month] = record['relname']
+    return detached
+
+
+async def create_partitions(connection: asyncpg.Connection, table: str, first: datetime.date,
+                            last: datetime.date) -> typing.List[str]:
+    """Creates the monthly partitions of ``table`` from ``first`` to ``last`` inclusive that don't exist yet
+
+    A default partition is created alongside them to catch rows outside every month, such as ones
+    without a timestamp. Rows the default partition caught for a month are moved into that month's
+    partition when it is created, postgres refuses to create it while they are there.
+    """
+    existing = await get_partitions(connection, table)
+    has_default = await connection.fetchval("SELECT to_regclass($1) IS NOT NULL", f"{table}_default")
+    key = partitioned_tables()[table]
+    created = []
+    month = month_start(first)
+    last = month_start(last)
+    while month <= last:
+        if month not in existing:
+            name = partition_name(table, month)
+            bounds = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            condition = f"{key} >= '{month.isoformat()}' AND {key} < '{add_months(month, 1).isoformat()}'"
+            if has_default and await connection.fetchval(
+                    f"SELECT EXISTS(SELECT 1 FROM {table}_default WHERE {condition})"):
+                async with connection.transaction():
+                    await connection.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS "
+                                             f"INCLUDING CONSTRAINTS);"
+                                             f"WITH moved AS (DELETE FROM {table}_default WHERE {condition} "
+                                             f"RETURNING *) INSERT INTO {name} SELECT * FROM moved;"
+                                             f"ALTER TABLE {table} ATTACH PARTITION {name} {bounds};")
+            else:
+                await connection.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} {bounds};")
+            created.append(name)
+        month = add_months(month, 1)
+    if not has_default:
+        await connection.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT;")
+        created.append(f"{table}_default")
+    return created
+
+
+class PartitionManager:
+    """Keeps the monthly partitions of the log tables ahead of time and archives the old ones
+
+    Every ``interval`` seconds partitions are created for the current month and the ``months_ahead``
+    after it. If ``retention_months`` is set, partitions that ended more than that many months ago
+    are detached, dumped to gzipped CSV files under ``archive_path`` and dropped. Detaching first
+    means queries and guild deletes stop touching them straight away, and a dump that fails is
+    retried on the next run since the detached table is kept until its file is written.
+    """
+
+    def __init__(self, client: "SqlClient", *, months_ahead: int = MONTHS_AHEAD, retention_months: int = None,
+                 archive_path: str = "data/archive", interval: float = 6 * 60 * 60):
+        self.client = client
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.archive_path = archive_path
+        self.interval = interval
+        self._task: typing.Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception("partition maintenance failed")
+                try:
+                    from sentry_sdk import capture_exception
+                    capture_exception(e)
+                except ImportError:
+                    pass
+
+    async def run(self, today: datetime.date = None) -> typing.Dict[str, typing.List[str]]:
+        """Runs one maintenance pass, returns the partitions created and archived"""
+        today = today or datetime.datetime.utcnow().date()
+        current = month_start(today)
+        report = {"created": [], "archived": []}
+        async with self._lock:
+            async with self.client.acquire("partition maintenance", pool=BACKGROUND) as execution:
+                connection = execution.connection
+                for table in partitioned_tables():
+                    # one table failing doesn't hold back the others, or the setup this runs in
+                    try:
+                        report["created"] += await create_partitions(connection, table, current,
+                                                                     add_months(current, self.months_ahead))
+                        if self.retention_months:
+                            report["archived"] += await self.archive(connection, table,
+                                                                     add_months(current, -self.retention_months))
+                    except (asyncpg.PostgresError, OSError) as e:
+                        log.exception("partition maintenance of %s failed", table)
+                        try:
+                            from sentry_sdk import capture_exception
+                            capture_exception(e)
+                        except ImportError:
+                            pass
+        return report
+
+    async def archive(self, connection: asyncpg.Connection, table: str,
+                      cutoff: datetime.date) -> typing.List[str]:
+        """Detaches, dumps and drops every partition of ``table`` for a month before ``cutoff``"""
+        for month, name in (await get_partitions(connection, table)).items():
+            if month < cutoff:
+                await connection.execute(f"ALTER TABLE {table} DETACH PARTITION {name};")
+        archived = []
+        for month, name in sorted((await get_detached(connection, table)).items()):
+            if month >= cutoff:
+                continue
+            await self.dump(connection, name)
+            await connection.execute(f"DROP TABLE {name};")
+            archived.append(name)
+        return archived
+
+    async def dump(self, connection: asyncpg.Connection, name: str) -> str:
+        os.makedirs(self.archive_path, exist_ok=True)
+        path = os.path.join(self.archive_path, f"{name}.csv.gz")
+        partial = path + ".partial"
+        with gzip.open(partial, "wb") as output:
+            await connection.copy_from_table(name, output=output, format="csv", header=True)
+        os.replace(partial, path)
+        return path
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
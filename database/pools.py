@@ -0,0 +1,38 @@
+import dataclasses
+import typing
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+ANALYTICS = "analytics"
+
+
+class PoolBusy(Exception):
+    """Raised instead of queueing for a connection when a pool's queue is full or the wait timed out"""
+
+    def __init__(self, pool: str):
+        super().__init__(f"the {pool} connection pool is busy")
+        self.pool = pool
+
+
+@dataclasses.dataclass()
+class PoolClass:
+    """Sizing and queueing policy of one named pool
+
+    ``statement_timeout`` is in milliseconds, 0 disables it. At most ``max_waiting`` callers queue for
+    a connection and each waits at most ``acquire_timeout`` seconds, anyone past either gets PoolBusy.
+    None means no limit.
+    """
+    min_size: int
+    max_size: int
+    statement_timeout: int = 0
+    max_waiting: typing.Optional[int] = None
+    acquire_timeout: typing.Optional[float] = None
+
+
+# interactive serves command handling and must never sit behind a stats query, background holds the
+# writers and maintenance and may queue indefinitely, analytics sheds load instead
+POOL_CLASSES: typing.Dict[str, PoolClass] = {
+    INTERACTIVE: PoolClass(2, 10, statement_timeout=5000, acquire_timeout=10),
+    BACKGROUND: PoolClass(1, 4),
+    ANALYTICS: PoolClass(0, 2, statement_timeout=30000, max_waiting=4, acquire_timeout=15),
+}
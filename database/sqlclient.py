@@ -1,30 +1,225 @@
+import asyncio
+import contextlib
+import dataclasses
 import datetime
+import logging
+import time
 import typing
 
 import asyncpg
 import discord
 
-from database import models
-from utils.snowflake import generator
+from database import migrations, models
+from database.cache import KnownMembers, MemberIdSet, TagCache, TagIdCache, TTLCache
+from database.instrumentation import Execution, QueryStats, result_rows
+from database.partitions import PartitionManager
+from database.pools import ANALYTICS, BACKGROUND, INTERACTIVE, POOL_CLASSES, PoolBusy, PoolClass
+from database.tag_index import TagTitleIndexes
+from database.statements import StatementRegistry, clean_columns, RESERVED_WORDS
+from database.writers import LastSpokeWriter, CommandCallWriter, CountWriter, MembershipWriter, NickNameWriter, \
+    TagCallWriter
+from utils import snowflake
 
-RESERVED_WORDS = ["user"]
+log = logging.getLogger(__name__)
 
+# key space of the advisory locks leasing snowflake worker and datacenter ids to bot processes
+SNOWFLAKE_LEASE_LOCK = 0x1ce7eb
 
-def clean_columns(column_names: typing.Iterable) -> typing.List[str]:
-    cleaned_names = []
-    for column in column_names:
-        if column in RESERVED_WORDS:
-            cleaned_names.append(f'"{column}"')
-        else:
-            cleaned_names.append(column)
-    return cleaned_names
+
+@dataclasses.dataclass()
+class SyncReport:
+    users_added: int = 0
+    members_added: int = 0
+    members_removed: int = 0
+    guilds_synced: int = 0
+    seconds: float = 0.0
+
+
+@dataclasses.dataclass()
+class ImportProgress:
+    guild: int
+    total: int
+    imported: int = 0
+    members_added: int = 0
+    seconds: float = 0.0
+    done: bool = False
+
+    @property
+    def percent(self) -> float:
+        return 100.0 * self.imported / self.total if self.total else 100.0
 
 
 class SqlClient:
-    def __init__(self, pool: asyncpg.pool.Pool, bot: "Iceteabot" = None, ):
+    def __init__(self, pool: asyncpg.pool.Pool, bot: "Iceteabot" = None,
+                 pools: typing.Dict[str, asyncpg.pool.Pool] = None):
         self.bot: typing.Optional["Iceteabot"] = bot
-        self.pool = pool
-        self.generator = generator(1, 1)
+        # a single pool serves every class
+        self.pools: typing.Dict[str, asyncpg.pool.Pool] = pools or {name: pool for name in POOL_CLASSES}
+        self.pool = self.pools[INTERACTIVE]
+        self.pool_classes: typing.Dict[str, PoolClass] = {name: dataclasses.replace(pool_class)
+                                                          for name, pool_class in POOL_CLASSES.items()}
+        config = getattr(bot, "config", {})
+        # without a configured worker id one is leased from postgres in setup
+        self.generator: typing.Optional[snowflake.SnowflakeGenerator] = None
+        if config.get("snowflake_worker_id") is not None:
+            self.generator = snowflake.generator(int(config["snowflake_worker_id"]),
+                                                 int(config.get("snowflake_datacenter_id") or 0))
+        self._lease: typing.Optional[asyncpg.Connection] = None
+        self._lease_renewal: typing.Optional[asyncio.Task] = None
+        self._closing = False
+        # how to open connections of our own, outside the pools
+        self._connect_args: tuple = getattr(pool, "_connect_args", ())
+        self._connect_kwargs: dict = getattr(pool, "_connect_kwargs", {})
+        self.last_spoke = LastSpokeWriter(self)
+        self.command_calls = CommandCallWriter(self)
+        self.prefix_uses = CountWriter(self, "prefixes", "uses")
+        self.tag_uses = CountWriter(self, "tagslink", "count")
+        self.tag_calls = TagCallWriter(self)
+        self.nicknames = NickNameWriter(self)
+        self.memberships = MembershipWriter(self)
+        self.partitions = PartitionManager(self, retention_months=config.get("log_retention_months"),
+                                           archive_path=config.get("archive_path") or "data/archive")
+        self.statements = StatementRegistry()
+        self.tag_cache = TagCache()
+        self.tag_titles = TagTitleIndexes()
+        self.tag_ids = TagIdCache()
+        self.known_members = KnownMembers()
+        # users and members by (guild or None, id), users are written through on save
+        self.user_data: TTLCache[typing.Tuple[typing.Optional[int], int], models.User] = TTLCache(
+            max_size=5000, ttl=300)
+        self.hydration_timings: typing.Dict[str, typing.Tuple[int, float]] = {}
+        self.imports: typing.Dict[int, ImportProgress] = {}
+        self.query_stats = QueryStats(slow_threshold=float(config.get("slow_query_seconds") or 0.25))
+
+    @classmethod
+    async def connect(cls, dsn: str = None, bot: "Iceteabot" = None, **kwargs) -> "SqlClient":
+        """Creates a client along with a pool per pool class, new connections get the model statements prepared
+
+        A ``{name}_pool_size`` config entry overrides the maximum size of that pool.
+        """
+        client = cls(None, bot)
+        config = getattr(bot, "config", {})
+        kwargs.setdefault("statement_cache_size", 256)
+        # a caller's own init runs before ours and its server settings are kept under the per pool ones
+        init = kwargs.pop("init", None)
+        server_settings = kwargs.pop("server_settings", None) or {}
+        client._connect_args, client._connect_kwargs = (dsn,), dict(kwargs, server_settings=server_settings)
+
+        async def init_connection(connection: asyncpg.Connection):
+            if init is not None:
+                await init(connection)
+            await client.init_connection(connection)
+
+        for name, pool_class in client.pool_classes.items():
+            if config.get(f"{name}_pool_size"):
+                pool_class = client.pool_classes[name] = dataclasses.replace(
+                    pool_class, max_size=int(config[f"{name}_pool_size"]))
+            settings = {**server_settings, "application_name": f"iceteabot {name}",
+                        "statement_timeout": str(pool_class.statement_timeout)}
+            client.pools[name] = await asyncpg.create_pool(dsn=dsn, init=init_connection,
+                                                           min_size=min(pool_class.min_size, pool_class.max_size),
+                                                           max_size=pool_class.max_size,
+                                                           server_settings=settings, **kwargs)
+        client.pool = client.pools[INTERACTIVE]
+        return client
+
+    @property
+    def distinct_pools(self) -> typing.List[asyncpg.pool.Pool]:
+        pools = []
+        for pool in self.pools.values():
+            if all(pool is not other for other in pools):
+                pools.append(pool)
+        return pools
+
+    def next_id(self) -> int:
+        return self.next_ids(1)[0]
+
+    def next_ids(self, count: int) -> typing.List[int]:
+        """Allocates ``count`` snowflake ids at once, for rows inserted in bulk"""
+        if self.generator is None:
+            raise snowflake.SnowflakeUnavailable("no snowflake worker id is held, either setup hasn't run yet "
+                                                 "or the lease was lost and is being renewed")
+        return self.generator.next_ids(count)
+
+    async def lease_snowflake_node(self) -> typing.Tuple[int, int]:
+        """Claims the first worker and datacenter id pair no other process holds
+
+        The claim is a session advisory lock on a connection of its own, opened outside the pools and
+        held until ``close``. Should that connection drop, the lock goes with it, so ids stop being
+        handed out until a pair is leased again.
+        """
+        settings = dict(self._connect_kwargs.get("server_settings") or {},
+                        application_name="iceteabot snowflake lease")
+        connection = await asyncpg.connect(*self._connect_args,
+                                           **{**self._connect_kwargs, "server_settings": settings})
+        workers = snowflake.max_worker_id + 1
+        try:
+            for node in range(workers * (snowflake.max_data_center_id + 1)):
+                if await connection.fetchval("SELECT pg_try_advisory_lock($1, $2)", SNOWFLAKE_LEASE_LOCK, node):
+                    connection.add_termination_listener(self._lease_lost)
+                    self._lease = connection
+                    return node % workers, node // workers
+        except BaseException:
+            await connection.close()
+            raise
+        await connection.close()
+        raise RuntimeError("every snowflake worker id is leased to another process")
+
+    def _lease_lost(self, connection: asyncpg.Connection):
+        if connection is not self._lease or self._closing:
+            return
+        log.warning("lost the snowflake lease connection, ids are unavailable until it is renewed")
+        previous, self.generator, self._lease = self.generator, None, None
+        self._lease_renewal = asyncio.get_event_loop().create_task(self._renew_lease(previous))
+
+    async def _renew_lease(self, previous: snowflake.SnowflakeGenerator):
+        delay = 1
+        while not self._closing:
+            try:
+                node = await self.lease_snowflake_node()
+            except (OSError, asyncpg.PostgresError, RuntimeError) as e:
+                log.warning(f"failed to renew the snowflake lease, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+                continue
+            if node == (previous.worker_id, previous.data_center_id):
+                # carries on from the last id handed out, which may be ahead of the clock
+                self.generator = previous
+            else:
+                self.generator = snowflake.generator(*node)
+            log.info(f"renewed the snowflake lease as worker {node[0]} of datacenter {node[1]}")
+            return
+
+    async def init_connection(self, connection: asyncpg.Connection):
+        if self.statements.ready:
+            await self.statements.prepare(connection)
+
+    @property
+    def writers(self) -> typing.List["BatchWriter"]:
+        return [self.last_spoke, self.command_calls, self.prefix_uses, self.tag_uses, self.tag_calls, self.nicknames,
+                self.memberships]
+
+    async def close(self):
+        for writer in self.writers:
+            try:
+                await writer.close()
+            except Exception as e:
+                log.exception(f"failed to drain {type(writer).__name__}")
+                try:
+                    from sentry_sdk import capture_exception
+                    capture_exception(e)
+                except ImportError:
+                    pass
+        await self.partitions.close()
+        self._closing = True
+        if self._lease_renewal is not None:
+            self._lease_renewal.cancel()
+        if self._lease is not None:
+            self._lease.remove_termination_listener(self._lease_lost)
+            await self._lease.close()
+            self._lease = None
+        for pool in self.distinct_pools:
+            await pool.close()
 
     async def add_user(self, user: int) -> models.User:
         new_user = models.User(self, user)
@@ -35,153 +230,340 @@ class SqlClient:
         return await self.execute_many("INSERT INTO users (id) VALUES ($1) on conflict (id) do nothing;",
                                        [(getattr(user, "id", user),) for user in users])
 
-    async def execute(self, query: str, *args) -> str:
-        connection: asyncpg.Connection = await self.pool.acquire()
+    async def sync_members(self, users: typing.Iterable[typing.Union[discord.User, int]],
+                           guilds: typing.Iterable[discord.Guild]) -> SyncReport:
+        """Brings users and members in line with the gateway cache using set based statements
+
+        Every id is copied into a temporary table once. Missing users and memberships are inserted
+        and memberships of people who left a guild while the bot was offline are removed. Guilds
+        whose member list has not been fully chunked are left alone.
+        """
+        start = time.perf_counter()
+        report = SyncReport()
+        user_ids = {getattr(user, "id", user) for user in users}
+        guild_ids = []
+        memberships = []
+        for guild in guilds:
+            if not guild.chunked:
+                continue
+            guild_ids.append(guild.id)
+            for member in guild.members:
+                if not member.bot:
+                    user_ids.add(member.id)
+                    memberships.append((member.id, guild.id))
+        report.guilds_synced = len(guild_ids)
+        async with self.acquire("sync members", pool=BACKGROUND) as execution:
+            connection = execution.connection
+            async with connection.transaction():
+                await connection.execute("CREATE TEMP TABLE sync_users (id bigint) ON COMMIT DROP;")
+                await connection.copy_records_to_table("sync_users", records=[(uid,) for uid in user_ids])
+                report.users_added = result_rows(await connection.execute(
+                    "INSERT INTO users (id) SELECT s.id FROM sync_users s "
+                    "WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = s.id) ON CONFLICT (id) DO NOTHING;"))
+                await connection.execute("CREATE TEMP TABLE sync_members (id bigint, guild bigint) ON COMMIT DROP;")
+                await connection.copy_records_to_table("sync_members", records=memberships)
+                await connection.execute("ANALYZE sync_members;")
+                report.members_added = result_rows(await connection.execute(
+                    "INSERT INTO members (id,guild) SELECT s.id,s.guild FROM sync_members s "
+                    "INNER JOIN guilds g ON g.id = s.guild "
+                    "WHERE NOT EXISTS (SELECT 1 FROM members m WHERE m.id = s.id AND m.guild = s.guild) "
+                    "ON CONFLICT (id,guild) DO NOTHING;"))
+                report.members_removed = result_rows(await connection.execute(
+                    "DELETE FROM members m WHERE m.guild = any($1::bigint[]) "
+                    "AND NOT EXISTS (SELECT 1 FROM sync_members s WHERE s.id = m.id AND s.guild = m.guild);",
+                    guild_ids))
+            execution.rows = report.users_added + report.members_added + report.members_removed
+        report.seconds = time.perf_counter() - start
+        return report
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, statement: str, *args, pool: str = INTERACTIVE) -> typing.AsyncIterator[Execution]:
+        """Checks out a connection of the ``pool`` class, recording the pool wait and the time it is held
+        under ``statement``
+
+        Every query the client runs goes through here. Blocks running several statements on one
+        connection pass a label instead and may set ``rows`` on the yielded execution.
+        """
+        pool_class = self.pool_classes[pool]
+        usage = self.query_stats.usage(pool)
+        # only callers past the pool's size actually queue, the others get a free or new connection
+        queued = usage.in_use + usage.waiting - pool_class.max_size
+        if pool_class.max_waiting is not None and queued >= pool_class.max_waiting:
+            usage.rejected += 1
+            raise PoolBusy(pool)
+        usage.wait()
+        start = time.perf_counter()
         try:
-            response = await connection.execute(query, *args)
-            return response
-        finally:
-            await self.pool.release(connection)
-
-    async def execute_many(self, query: str, args: typing.List):
-        connection: asyncpg.Connection = await self.pool.acquire()
+            connection: asyncpg.Connection = await self.pools[pool].acquire(timeout=pool_class.acquire_timeout)
+        except asyncio.TimeoutError:
+            usage.waiting -= 1
+            usage.rejected += 1
+            raise PoolBusy(pool) from None
+        except BaseException:
+            usage.waiting -= 1
+            raise
+        usage.acquired()
+        acquired = time.perf_counter()
+        execution = Execution(connection)
+        error = False
         try:
-            response = await connection.executemany(query, args)
-            return response
+            yield execution
+        except GeneratorExit:
+            # a cursor the caller stopped reading early
+            raise
+        except BaseException:
+            error = True
+            raise
         finally:
-            await self.pool.release(connection)
-
-    async def get(self, query, *args) -> asyncpg.Record:
-        connection: asyncpg.Connection = await self.pool.acquire()
-        try:
-            response: asyncpg.Record = await connection.fetchrow(query, *args)
+            usage.in_use -= 1
+            self.query_stats.record(statement, acquired - start, time.perf_counter() - acquired, execution.rows,
+                                    args, error)
+            await self.pools[pool].release(connection)
+
+    async def _run(self, method: str, query: str, *args, pool: str = INTERACTIVE):
+        async with self.acquire(query, *args, pool=pool) as execution:
+            response = await getattr(execution.connection, method)(query, *args)
+            execution.rows = result_rows(response)
             return response
-        finally:
-            await self.pool.release(connection)
 
-    async def get_model(self, model: "models.Model()", query: str, *args) -> typing.Any:
-        connection: asyncpg.Connection = await self.pool.acquire()
+    @property
+    def pool_saturation(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        """Connections in use and callers waiting for one per pool class, now and at their peak"""
+        saturation = {}
+        for name, pool_class in self.pool_classes.items():
+            saturation[name] = dataclasses.asdict(self.query_stats.usage(name))
+            saturation[name]["max_size"] = pool_class.max_size
+        return saturation
+
+    async def import_members(self, gid: int, members: typing.Iterable[typing.Union[discord.Member, int]], *,
+                             batch_size: int = 5000, pause: float = 0.1,
+                             progress: typing.Callable[[ImportProgress], typing.Any] = None) -> ImportProgress:
+        """Copies a guild's members into users and members, for guilds joined with many members at once
+
+        Members are copied in batches of ``batch_size`` on the background pool, each batch in its own
+        transaction. Between batches the connection goes back to the pool and the import sleeps ``pause``
+        seconds, so the batch writers queued behind it get their turn. ``progress`` is called after every
+        batch, the progress of every running import is also kept in ``imports``.
+        """
+        ids = list(dict.fromkeys(getattr(member, "id", member) for member in members))
+        report = self.imports[gid] = ImportProgress(gid, len(ids))
+        start = time.perf_counter()
         try:
-            response: asyncpg.Record = await connection.fetchrow(query, *args)
-            if response:
-                model_fields = model.get_fields()
-                return model(client=self, **{field.name: response.get(field.name) for field in model_fields})
+            for offset in range(0, len(ids), batch_size):
+                batch = ids[offset:offset + batch_size]
+                async with self.acquire("import members", pool=BACKGROUND) as execution:
+                    connection = execution.connection
+                    async with connection.transaction():
+                        await connection.execute("CREATE TEMP TABLE import_members (id bigint) ON COMMIT DROP;")
+                        await connection.copy_records_to_table("import_members",
+                                                               records=[(mid,) for mid in batch])
+                        await connection.execute("INSERT INTO users (id) SELECT id FROM import_members "
+                                                 "ON CONFLICT (id) DO NOTHING;")
+                        execution.rows = result_rows(await connection.execute(
+                            "INSERT INTO members (id,guild) SELECT id, $1 FROM import_members "
+                            "ON CONFLICT (id,guild) DO NOTHING;", gid))
+                self.known_members.update(gid, batch)
+                report.imported += len(batch)
+                report.members_added += execution.rows
+                report.seconds = time.perf_counter() - start
+                if progress is not None:
+                    progress(report)
+                if report.imported < report.total:
+                    await asyncio.sleep(pause)
         finally:
-            await self.pool.release(connection)
+            # a newer import of the same guild may have replaced this one
+            if self.imports.get(gid) is report:
+                del self.imports[gid]
+        report.done = True
+        report.seconds = time.perf_counter() - start
+        return report
+
+    async def load_known_members(self) -> int:
+        """Replaces the known member ids of every guild with the memberships in the database, returns how many"""
+        known = KnownMembers()
+        loaded = 0
+        query = "SELECT guild, array_agg(id) AS ids FROM members WHERE guild IS NOT NULL GROUP BY guild"
+        async with self.acquire(query, pool=BACKGROUND) as execution:
+            async with execution.connection.transaction():
+                async for record in execution.connection.cursor(query, prefetch=100):
+                    known.put(record['guild'], MemberIdSet(record['ids']))
+                    loaded += len(record['ids'])
+            execution.rows = loaded
+        self.known_members = known
+        return loaded
+
+    async def execute(self, query: str, *args, pool: str = INTERACTIVE) -> str:
+        return await self._run("execute", query, *args, pool=pool)
+
+    async def execute_many(self, query: str, args: typing.List, pool: str = INTERACTIVE):
+        async with self.acquire(query, pool=pool) as execution:
+            response = await execution.connection.executemany(query, args)
+            execution.rows = len(args)
+            return response
 
-    async def get_all(self, model: "models.Model()", query: str, *args) -> typing.AsyncGenerator:
-        connection: asyncpg.Connection = await self.pool.acquire()
-        try:
+    async def get(self, query, *args, pool: str = INTERACTIVE) -> asyncpg.Record:
+        return await self._run("fetchrow", query, *args, pool=pool)
+
+    async def get_model(self, model: "models.Model()", query: str, *args, pool: str = INTERACTIVE) -> typing.Any:
+        response: asyncpg.Record = await self._run("fetchrow", query, *args, pool=pool)
+        if response:
+            return model.codec().decode(self, response)
+
+    async def get_all(self, model: "models.Model()", query: str, *args,
+                      prefetch: int = 50, pool: str = INTERACTIVE) -> typing.AsyncGenerator:
+        codec = model.codec()
+        decoder = None
+        # the recorded time includes however long the caller takes to consume the rows
+        async with self.acquire(query, *args, pool=pool) as execution:
+            connection = execution.connection
             async with connection.transaction():
-                async for record in connection.cursor(query, *args):
-                    yield model(client=self, **dict(record))
-        finally:
-            await self.pool.release(connection)
+                async for record in connection.cursor(query, *args, prefetch=prefetch):
+                    if decoder is None:
+                        decoder = codec.decoder(tuple(record.keys()))
+                    execution.rows += 1
+                    yield decoder(self, record)
 
-    async def raw_get_all(self, query: str, *args) -> typing.List[asyncpg.Record]:
-        connection: asyncpg.Connection = await self.pool.acquire()
-        try:
-            return await connection.fetch(query, *args)
-        finally:
-            await self.pool.release(connection)
+    async def get_models(self, model: "models.Model()", query: str, *args,
+                         pool: str = INTERACTIVE) -> typing.List[typing.Any]:
+        """Like get_all, but fetches every row in one round trip instead of streaming through a cursor"""
+        return model.codec().decode_all(self, await self._run("fetch", query, *args, pool=pool))
 
-    async def fetch(self, query: str, *args) -> asyncpg.Record:
-        async with self.pool.acquire() as connection:
-            response: asyncpg.Record = await connection.fetchrow(query, *args)
-            return response
+    async def raw_get_all(self, query: str, *args, pool: str = INTERACTIVE) -> typing.List[asyncpg.Record]:
+        return await self._run("fetch", query, *args, pool=pool)
+
+    async def fetch(self, query: str, *args, pool: str = INTERACTIVE) -> asyncpg.Record:
+        return await self._run("fetchrow", query, *args, pool=pool)
 
     async def get_user(self, pid: int) -> models.User:
-        async with self.pool.acquire() as connection:
-            response = await connection.fetchrow("SELECT * FROM users where id = $1", pid)
-            if response:
-                return models.User(client=self, **dict(response))
+        return await self.get_model(models.User, self.statements[models.User].select, pid)
+
+    def forget_user(self, uid: int):
+        """Drops every cached copy of a user, members carry the user's columns in every guild"""
+        for key in self.user_data:
+            if key[1] == uid:
+                self.user_data.pop(key)
 
     async def get_guild(self, pid: int) -> models.Guild:
-        async with self.pool.acquire() as connection:
-            response = await connection.fetchrow("SELECT * FROM guilds where id = $1", pid)
-            if response:
-                guild = models.Guild(client=self, **dict(response))
-                await guild.populate()
-                return guild
+        guild = await self.get_model(models.Guild, self.statements[models.Guild].select, pid)
+        if guild:
+            await guild.populate()
+            return guild
 
     async def get_all_guilds(self) -> typing.List[models.Guild]:
-        guilds = []
-        async for guild in self.get_all(models.Guild, "SELECT * FROM guilds"):
-            await guild.populate()
-            guilds.append(guild)
+        start = time.perf_counter()
+        guilds = await self.get_models(models.Guild, "SELECT * FROM guilds", pool=BACKGROUND)
+        self.hydration_timings = {"guilds": (len(guilds), time.perf_counter() - start)}
+        self.hydration_timings.update(await self.populate_guilds(guilds))
         return guilds
 
+    async def get_guilds(self, ids: typing.Iterable[int]) -> typing.List[models.Guild]:
+        """Loads and populates the given guilds with one query per table, skipping ids without a row"""
+        guilds = await self.get_models(models.Guild, "SELECT * FROM guilds WHERE id = any($1::bigint[])",
+                                       list(ids), pool=BACKGROUND)
+        if guilds:
+            await self.populate_guilds(guilds, only=True)
+        return guilds
+
+    async def populate_guilds(self, guilds: typing.Iterable[models.Guild], only: bool = False) -> \
+            typing.Dict[str, typing.Tuple[int, float]]:
+        """Loads the child tables of many guilds at once
+
+        Every child table is streamed exactly once and its rows are attached to the matching guild,
+        instead of running Guild.populate per guild. With ``only`` just the rows of the given guilds are
+        read instead of every guild's. Returns the rows loaded and seconds taken per table.
+        """
+        guild_data = {guild.id: guild for guild in guilds}
+        timings = {}
+        for model in models.Guild.CHILD_MODELS:
+            table = models.tables[model]
+            start = time.perf_counter()
+            rows = 0
+            if only:
+                # noinspection SqlResolve
+                query, args = f"SELECT * FROM {table} WHERE guild = any($1::bigint[])", (list(guild_data),)
+            else:
+                # noinspection SqlResolve
+                query, args = f"SELECT * FROM {table} WHERE guild IS NOT NULL", ()
+            async for child in self.get_all(model, query, *args, prefetch=1000, pool=BACKGROUND):
+                guild = guild_data.get(child.guild)
+                if guild is not None:
+                    guild.attach(child)
+                    rows += 1
+            timings[table] = (rows, time.perf_counter() - start)
+        return timings
+
     async def update(self, model: models.Model):
-        model_table = models.tables[type(model)]
-        model_data = model.data
-        model_primary_keys = ','.join(model.PRIMARY_KEY)
-        insert_arguments = ','.join(f'${index}' for index in range(1, len(model_data) + 1))
-        cleaned_column_names = clean_columns(list(model_data.keys())[1:])
-        update_arguments = ','.join(
-            f'{column} = excluded.{column}' for column in
-            cleaned_column_names)
-        connection: asyncpg.Connection = await self.pool.acquire()
-        query = f'INSERT INTO {model_table} VALUES({insert_arguments}) ' \
-                f'ON CONFLICT ({model_primary_keys}) DO UPDATE set {update_arguments};'
-        try:
-            await connection.execute(query,
-                                     *model_data.values())
-        finally:
-            await self.pool.release(connection)
+        statements = self.statements[type(model)]
+        return await self.execute(statements.upsert, *statements.bind(model))
 
     async def delete(self, model: models.Model):
-        model_table = models.tables[type(model)]
-        # noinspection SqlResolve
-        query = f"DELETE FROM {model_table} WHERE id = $1"
-        await self.execute(query, model.id)
-
-    async def delete_all(self, models_to_delete: typing.List[models.Model]):
-        # TODO
-        pass
+        statements = self.statements[type(model)]
+        return await self.execute(statements.delete, *statements.bind_key(model))
+
+    async def delete_all(self, models_to_delete: typing.Iterable[models.Model], pool: str = INTERACTIVE) -> int:
+        """Deletes many models with one set based statement per model class, returns the rows deleted
+
+        Every class is deleted in the same transaction. Subclass overrides of ``Model.delete`` are not called.
+        """
+        groups: typing.Dict[type, typing.List[models.Model]] = {}
+        for model in models_to_delete:
+            groups.setdefault(type(model), []).append(model)
+        if not groups:
+            return 0
+        statements = [(self.statements[model_type], group) for model_type, group in groups.items()]
+        label = " ".join(model_statements.delete_many for model_statements, _ in statements)
+        async with self.acquire(label, pool=pool) as execution:
+            async with execution.connection.transaction():
+                for model_statements, group in statements:
+                    execution.rows += result_rows(await execution.connection.execute(
+                        model_statements.delete_many, *model_statements.bind_keys(group)))
+        return execution.rows
 
     async def setup(self):
-        async with self.pool.acquire() as connection:
-            for table in models.tables.keys():
-                table: models.Model = table
-                try:
-                    table_query = table.setup_table()
-                    if table_query:
-                        await connection.execute(table_query)
-                except asyncpg.DuplicateTableError:
-                    continue
-                except Exception as e:
-                    print(f"failed to make table {table}")
-                    raise e
+        async with self.acquire("setup", pool=BACKGROUND) as execution:
+            await migrations.migrate(execution.connection)
+            await self.statements.build(execution.connection, models.tables)
+        if self.generator is None:
+            self.generator = snowflake.generator(*await self.lease_snowflake_node())
+        await self.partitions.run()
+        self.partitions.start()
+        # connections opened before the statements existed get re-initialized on their next acquire
+        for pool in self.distinct_pools:
+            await pool.expire_connections()
+        for writer in self.writers:
+            writer.start()
 
     async def get_command_stats_overall(self) -> dict:
         response = {}
-        top_commands = await self.raw_get_all("SELECT command,count(command) from commands "
-                                              "group by command order by count(command) desc limit 5;")
+        top_commands = await self.raw_get_all("SELECT command,SUM(uses) AS count FROM command_usage_global_daily "
+                                              "group by command order by count desc limit 5;", pool=ANALYTICS)
         response['top_commands'] = {record['command']: record['count'] for record in top_commands}
-        top_command_users = await self.raw_get_all("SELECT author,count(command) from commands "
-                                                   "group by author order by count(command) desc limit 5")
+        top_command_users = await self.raw_get_all("SELECT author,SUM(uses) AS count FROM command_author_global_daily "
+                                                   "group by author order by count desc limit 5", pool=ANALYTICS)
         response['top_command_users'] = {record['author']: record['count'] for record in top_command_users}
         return response
 
     async def get_todays_stats(self) -> dict:
         response = {}
         top_commands_today = await self.raw_get_all(
-            "SELECT command,count(command) from commands WHERE called::date = CURRENT_DATE "
-            "group by command order by count(command) desc limit 5;")
+            "SELECT command,uses AS count FROM command_usage_global_daily WHERE day = CURRENT_DATE "
+            "order by uses desc limit 5;", pool=ANALYTICS)
         response['top_commands_today'] = {record['command']: record['count'] for record in top_commands_today}
         top_command_users_today = await self.raw_get_all(
-            "SELECT author,count(author) from commands WHERE called::date = CURRENT_DATE "
-            "group by author order by count(author) desc limit 5;")
+            "SELECT author,uses AS count FROM command_author_global_daily WHERE day = CURRENT_DATE "
+            "order by uses desc limit 5;", pool=ANALYTICS)
         response['top_command_users_today'] = {record['author']: record['count'] for record in
                                                top_command_users_today}
         return response
 
     async def get_total_commands_used(self) -> int:
-        data = await self.fetch("SELECT COUNT(*) FROM commands")
+        data = await self.fetch("SELECT COALESCE(SUM(uses), 0) AS count FROM command_usage_global_daily",
+                                pool=ANALYTICS)
         return data.get("count", 0)
 
     async def get_total_commands_used_today(self) -> int:
-        data = await self.fetch("SELECT COUNT(*) FROM commands where called::date = CURRENT_DATE")
+        data = await self.fetch("SELECT COALESCE(SUM(uses), 0) AS count FROM command_usage_global_daily "
+                                "WHERE day = CURRENT_DATE", pool=ANALYTICS)
         return data.get("count", 0)
 
     async def get_command_stats(self) -> "models.guild.CommandStats":
@@ -204,7 +586,11 @@ class SqlClient:
             "INSERT INTO members (id,guild,last_spoke) VALUES ($1,$2,$3) "
             "ON CONFLICT(id,guild) do update set last_spoke = $3 WHERE members.guild = $2 "
             "AND members.id = $1;", mid, gid, timestamp)
+        member = self.user_data.peek((gid, mid))
+        if member is not None:
+            member.last_spoke = timestamp
 
 
 if __name__ == '__main__':
+    from database.writers import BatchWriter
     from utils.iceteabot import Iceteabot
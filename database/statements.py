@@ -0,0 +1,161 @@
+import dataclasses
+import datetime
+import operator
+import typing
+
+import asyncpg
+
+RESERVED_WORDS = ["user"]
+
+# postgres types assumed for key columns when the table's own types are unknown
+FIELD_TYPES = {
+    int: "bigint",
+    str: "text",
+    bool: "boolean",
+    float: "double precision",
+    datetime.datetime: "timestamp",
+    datetime.date: "date",
+}
+
+
+def clean_columns(column_names: typing.Iterable) -> typing.List[str]:
+    cleaned_names = []
+    for column in column_names:
+        if column in RESERVED_WORDS:
+            cleaned_names.append(f'"{column}"')
+        else:
+            cleaned_names.append(column)
+    return cleaned_names
+
+
+@dataclasses.dataclass(frozen=True)
+class ModelStatements:
+    """The precompiled SQL for a single model class"""
+    table: str
+    columns: typing.Tuple[str, ...]
+    primary_key: typing.Tuple[str, ...]
+    upsert: str
+    delete: str
+    delete_many: str
+    select: str
+    _getter: typing.Callable = dataclasses.field(repr=False, compare=False)
+    _key_getter: typing.Callable = dataclasses.field(repr=False, compare=False)
+
+    def bind(self, model: "Model") -> tuple:
+        """Returns the upsert parameters for a model, in column order"""
+        return self._getter(model)
+
+    def bind_key(self, model: "Model") -> tuple:
+        return self._key_getter(model)
+
+    def bind_keys(self, models: typing.Iterable["Model"]) -> typing.List[list]:
+        """Returns the delete_many parameters for many models, one array per key column"""
+        keys = [self._key_getter(model) for model in models]
+        return [list(column) for column in zip(*keys)] if keys else [[] for _ in self.primary_key]
+
+    @classmethod
+    def compile(cls, model: typing.Type["Model"], table: str,
+                table_columns: typing.Mapping[str, str] = None) -> "ModelStatements":
+        """Builds the statements for ``model``
+
+        If ``table_columns`` is given, a mapping of column name to type, fields that have no matching
+        column in the table are left out.
+        """
+        columns = tuple(field.name for field in model.get_fields()
+                        if table_columns is None or field.name in table_columns)
+        primary_key = tuple(model.PRIMARY_KEY)
+        quoted = clean_columns(columns)
+        quoted_key = clean_columns(primary_key)
+        updates = [column for column in quoted if column not in quoted_key]
+        insert_arguments = ','.join(f'${index}' for index in range(1, len(columns) + 1))
+        key_arguments = ' AND '.join(f'{column} = ${index}' for index, column in enumerate(quoted_key, 1))
+        if len(primary_key) == 1:
+            key_type = _column_type(model, primary_key[0], table_columns)
+            delete_many = f'DELETE FROM {table} WHERE {quoted_key[0]} = any($1::{key_type}[]);'
+        else:
+            # composite keys are joined against one array per key column, unnested side by side
+            arrays = ','.join(f'${index}::{_column_type(model, column, table_columns)}[]'
+                              for index, column in enumerate(primary_key, 1))
+            matches = ' AND '.join(f'{table}.{column} = v.{column}' for column in quoted_key)
+            delete_many = f'DELETE FROM {table} USING unnest({arrays}) AS v({",".join(quoted_key)}) ' \
+                          f'WHERE {matches};'
+        if updates:
+            conflict = 'DO UPDATE SET ' + ','.join(f'{column} = excluded.{column}' for column in updates)
+        else:
+            conflict = 'DO NOTHING'
+        return cls(
+            table=table,
+            columns=columns,
+            primary_key=primary_key,
+            upsert=f'INSERT INTO {table} ({",".join(quoted)}) VALUES({insert_arguments}) '
+                   f'ON CONFLICT ({",".join(quoted_key)}) {conflict};',
+            delete=f'DELETE FROM {table} WHERE {key_arguments};',
+            delete_many=delete_many,
+            select=f'SELECT {",".join(quoted)} FROM {table} WHERE {key_arguments};',
+            _getter=_tuple_getter(columns),
+            _key_getter=_tuple_getter(primary_key),
+        )
+
+
+def _column_type(model: typing.Type["Model"], column: str, table_columns: typing.Mapping[str, str] = None) -> str:
+    if table_columns and column in table_columns:
+        return table_columns[column]
+    field_type = next((field.type for field in model.get_fields() if field.name == column), None)
+    return FIELD_TYPES.get(field_type, "text")
+
+
+def _tuple_getter(names: typing.Sequence[str]) -> typing.Callable[[typing.Any], tuple]:
+    getter = operator.attrgetter(*names)
+    if len(names) == 1:
+        return lambda model: (getter(model),)
+    return getter
+
+
+class StatementRegistry:
+    """Holds the upsert, delete and select statements of every model, built once at setup"""
+
+    def __init__(self):
+        self._statements: typing.Dict[type, ModelStatements] = {}
+
+    def __getitem__(self, model: type) -> ModelStatements:
+        return self._statements[model]
+
+    def __contains__(self, model: type) -> bool:
+        return model in self._statements
+
+    def __len__(self):
+        return len(self._statements)
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._statements)
+
+    def compile(self, tables: typing.Dict[type, str],
+                table_columns: typing.Dict[str, typing.Mapping[str, str]] = None):
+        table_columns = table_columns or {}
+        self._statements = {model: ModelStatements.compile(model, table, table_columns.get(table))
+                            for model, table in tables.items()}
+
+    async def build(self, connection: asyncpg.Connection, tables: typing.Dict[type, str]):
+        records = await connection.fetch("SELECT table_name, column_name, udt_name FROM information_schema.columns "
+                                         "WHERE table_schema = current_schema() AND table_name = any($1::text[]);",
+                                         list(tables.values()))
+        table_columns: typing.Dict[str, typing.Dict[str, str]] = {}
+        for record in records:
+            table_columns.setdefault(record['table_name'], {})[record['column_name']] = record['udt_name']
+        self.compile(tables, table_columns)
+
+    async def prepare(self, connection: asyncpg.Connection):
+        """Prepares every statement on ``connection``
+
+        Statements are put into asyncpg's per-connection statement cache, the same cache used by
+        ``execute`` and ``fetchrow``, so later calls with the same query text only bind parameters.
+        """
+        for statements in self._statements.values():
+            for query in (statements.upsert, statements.delete, statements.delete_many, statements.select):
+                # noinspection PyProtectedMember
+                await connection._get_statement(query, None)
+
+
+if __name__ == '__main__':
+    from database.models import Model
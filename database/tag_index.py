@@ -0,0 +1,242 @@
+import typing
+
+from database.cache import LRUCache
+
+
+def levenshtein(first: str, second: str) -> int:
+    """Edit distance between two strings, using Myers' bit-parallel algorithm over the shorter one"""
+    if len(first) < len(second):
+        first, second = second, first
+    if not second:
+        return len(first)
+    positions: typing.Dict[str, int] = {}
+    for index, char in enumerate(second):
+        positions[char] = positions.get(char, 0) | (1 << index)
+    full = (1 << len(second)) - 1
+    last = 1 << (len(second) - 1)
+    positive, negative, score = full, 0, len(second)
+    for char in first:
+        matches = positions.get(char, 0)
+        vertical = matches | negative
+        horizontal = (((matches & positive) + positive) ^ positive) | matches
+        horizontal_positive = negative | (~(horizontal | positive) & full)
+        horizontal_negative = positive & horizontal
+        if horizontal_positive & last:
+            score += 1
+        elif horizontal_negative & last:
+            score -= 1
+        horizontal_positive = ((horizontal_positive << 1) | 1) & full
+        horizontal_negative = (horizontal_negative << 1) & full
+        positive = horizontal_negative | (~(vertical | horizontal_positive) & full)
+        negative = horizontal_positive & vertical
+    return score
+
+
+class _TrieNode:
+    __slots__ = ("children", "end")
+
+    def __init__(self):
+        self.children: typing.Dict[str, "_TrieNode"] = {}
+        self.end = False
+
+
+class TitleTrie:
+    """A prefix tree of titles, used for completions"""
+
+    def __init__(self):
+        self._root = _TrieNode()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, title: str) -> bool:
+        node = self._find(title)
+        return node is not None and node.end
+
+    def _find(self, prefix: str) -> typing.Optional[_TrieNode]:
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def add(self, title: str):
+        node = self._root
+        for char in title:
+            node = node.children.setdefault(char, _TrieNode())
+        if not node.end:
+            node.end = True
+            self._size += 1
+
+    def remove(self, title: str):
+        path = [self._root]
+        for char in title:
+            node = path[-1].children.get(char)
+            if node is None:
+                return
+            path.append(node)
+        if not path[-1].end:
+            return
+        path[-1].end = False
+        self._size -= 1
+        # prune the branch back up to the nearest node still in use
+        for depth in range(len(title), 0, -1):
+            node = path[depth]
+            if node.end or node.children:
+                break
+            del path[depth - 1].children[title[depth - 1]]
+
+    def complete(self, prefix: str, limit: int = 5) -> typing.List[str]:
+        """Up to ``limit`` titles starting with ``prefix``, in alphabetical order"""
+        node = self._find(prefix)
+        if node is None:
+            return []
+        found = []
+        stack = [(prefix, node)]
+        while stack and len(found) < limit:
+            title, node = stack.pop()
+            if node.end:
+                found.append(title)
+            stack.extend((title + char, child) for char, child in sorted(node.children.items(), reverse=True))
+        return found
+
+
+class BKTree:
+    """A Burkhard-Keller tree of titles keyed by edit distance
+
+    Lookups only descend into children whose distance to their parent is within the search radius of
+    the query's distance to that parent, so most of the tree is never compared. Removed titles are
+    kept as tombstones and the tree is rebuilt once they outnumber the live ones.
+    """
+
+    def __init__(self, distance: typing.Callable[[str, str], int] = levenshtein):
+        self.distance = distance
+        self._root: typing.Optional[tuple] = None
+        self._size = 0
+        self._removed: typing.Set[str] = set()
+
+    def __len__(self):
+        return self._size - len(self._removed)
+
+    def add(self, title: str):
+        if title in self._removed:
+            self._removed.discard(title)
+            return
+        if self._root is None:
+            self._root = (title, {})
+            self._size += 1
+            return
+        node_title, children = self._root
+        while True:
+            distance = self.distance(title, node_title)
+            if distance == 0:
+                return
+            child = children.get(distance)
+            if child is None:
+                children[distance] = (title, {})
+                self._size += 1
+                return
+            node_title, children = child
+
+    def remove(self, title: str):
+        if self.search(title, 0):
+            self._removed.add(title)
+            if len(self._removed) > self._size // 2:
+                self._rebuild()
+
+    def _rebuild(self):
+        titles = [title for title in self._walk() if title not in self._removed]
+        self._root = None
+        self._size = 0
+        self._removed.clear()
+        for title in titles:
+            self.add(title)
+
+    def _walk(self) -> typing.Iterator[str]:
+        stack = [self._root] if self._root else []
+        while stack:
+            title, children = stack.pop()
+            yield title
+            stack.extend(children.values())
+
+    def search(self, query: str, max_distance: int) -> typing.List[typing.Tuple[int, str]]:
+        """Every title within ``max_distance`` edits of ``query`` as (distance, title), closest first"""
+        found = []
+        stack = [self._root] if self._root else []
+        while stack:
+            title, children = stack.pop()
+            distance = self.distance(query, title)
+            if distance <= max_distance and title not in self._removed:
+                found.append((distance, title))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        found.sort()
+        return found
+
+
+class TagTitleIndex:
+    """Every tag title and alias of one guild, searchable by prefix and by edit distance"""
+
+    def __init__(self, titles: typing.Iterable[str] = ()):
+        self.trie = TitleTrie()
+        self.tree = BKTree()
+        for title in titles:
+            self.add(title)
+
+    def __len__(self):
+        return len(self.trie)
+
+    def __contains__(self, title: str) -> bool:
+        return title in self.trie
+
+    def add(self, title: str):
+        self.trie.add(title)
+        self.tree.add(title)
+
+    def remove(self, title: str):
+        self.trie.remove(title)
+        self.tree.remove(title)
+
+    def search(self, query: str, limit: int = 5, max_distance: int = 3) -> typing.List[str]:
+        """Titles completing ``query`` first, then the closest ones by edit distance"""
+        query = query.lower()
+        found = self.trie.complete(query, limit)
+        if len(found) < limit:
+            # short queries would otherwise match almost every short title
+            max_distance = min(max_distance, max(1, (len(query) + 1) // 2))
+            for _, title in self.tree.search(query, max_distance):
+                if title not in found:
+                    found.append(title)
+                    if len(found) >= limit:
+                        break
+        return found
+
+
+class TagTitleIndexes:
+    """The title indexes of the most recently searched guilds, loaded on first use"""
+
+    def __init__(self, max_guilds: int = 1000):
+        self._guilds: LRUCache[int, TagTitleIndex] = LRUCache(max_size=max_guilds)
+
+    def get(self, gid: int) -> typing.Optional[TagTitleIndex]:
+        return self._guilds.get(gid)
+
+    def put(self, gid: int, index: TagTitleIndex):
+        self._guilds.put(gid, index)
+
+    def add(self, gid: int, title: str):
+        """Adds a title to a guild's index if it is loaded, unloaded ones will read it from the database"""
+        index = self._guilds.peek(gid)
+        if index is not None:
+            index.add(title)
+
+    def remove(self, gid: int, title: str):
+        index = self._guilds.peek(gid)
+        if index is not None:
+            index.remove(title)
+
+    def invalidate(self, gid: int):
+        self._guilds.pop(gid)
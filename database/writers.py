@@ -0,0 +1,411 @@
+import asyncio
+import datetime
+import logging
+import typing
+from collections import Counter, deque
+
+import asyncpg
+
+from database import models
+from database.pools import BACKGROUND
+
+log = logging.getLogger(__name__)
+
+
+async def copy_rows(connection: asyncpg.Connection, table: str, columns: typing.Sequence[str], records: list,
+                    parent_join: str):
+    """Copies ``records`` into ``table``, falling back to an insert filtered by ``parent_join`` when some rows
+    reference parents that no longer exist"""
+    try:
+        async with connection.transaction():
+            await connection.copy_records_to_table(table, records=records, columns=columns)
+    except asyncpg.ForeignKeyViolationError:
+        await connection.execute(f"CREATE TEMP TABLE {table}_buffer (LIKE {table}) ON COMMIT DROP;")
+        await connection.copy_records_to_table(f"{table}_buffer", records=records, columns=columns)
+        await connection.execute(f"INSERT INTO {table} ({','.join(columns)}) "
+                                 f"SELECT {','.join(f'b.{column}' for column in columns)} "
+                                 f"FROM {table}_buffer b {parent_join};")
+
+
+class BatchWriter:
+    """Buffers rows in memory and writes them to postgres in bulk.
+
+    Rows are flushed every ``interval`` seconds or as soon as ``max_size`` pending rows
+    are buffered, whichever comes first. ``close`` drains whatever is left.
+    """
+
+    def __init__(self, client: "SqlClient", *, interval: float = 10.0, max_size: int = 1000):
+        self.client = client
+        self.interval = interval
+        self.max_size = max_size
+        self.stats: typing.Counter[str] = Counter()
+        self._task: typing.Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        raise NotImplementedError
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def _added(self):
+        if len(self) >= self.max_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception(f"{type(self).__name__} failed to flush")
+                try:
+                    from sentry_sdk import capture_exception
+                    capture_exception(e)
+                except ImportError:
+                    pass
+
+    def _take(self) -> list:
+        """Swaps out the pending rows, returning them as a list"""
+        raise NotImplementedError
+
+    def _restore(self, batch: list):
+        """Puts a batch that failed to write back into the buffer"""
+        self.stats['dropped'] += len(batch)
+
+    async def _write(self, connection: asyncpg.Connection, batch: list):
+        raise NotImplementedError
+
+    def _written(self, batch: list):
+        """Called once a batch is committed"""
+
+    async def flush(self) -> int:
+        async with self._lock:
+            batch = self._take()
+            if not batch:
+                return 0
+            try:
+                async with self.client.acquire(f"{type(self).__name__} flush", pool=BACKGROUND) as execution:
+                    async with execution.connection.transaction():
+                        await self._write(execution.connection, batch)
+                    execution.rows = len(batch)
+            except BaseException:
+                self.stats['failed'] += len(batch)
+                self._restore(batch)
+                raise
+            self._written(batch)
+            self.stats['flushed'] += len(batch)
+            self.stats['flushes'] += 1
+            return len(batch)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+class LastSpokeWriter(BatchWriter):
+    """Write-behind buffer for members.last_spoke, only the newest timestamp per member is kept"""
+
+    def __init__(self, client: "SqlClient", **kwargs):
+        super().__init__(client, **kwargs)
+        self._pending: typing.Dict[typing.Tuple[int, int], datetime.datetime] = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, mid: int, gid: int, timestamp: datetime.datetime):
+        key = (mid, gid)
+        current = self._pending.get(key)
+        self.stats['queued'] += 1
+        if current is not None:
+            self.stats['coalesced'] += 1
+            if current >= timestamp:
+                return
+        self._pending[key] = timestamp
+        # keeps a cached member from writing an older last_spoke back on its next save
+        member = self.client.user_data.peek((gid, mid))
+        if member is not None:
+            member.last_spoke = timestamp
+        self._added()
+
+    def _take(self) -> list:
+        pending, self._pending = self._pending, {}
+        return [(mid, gid, timestamp) for (mid, gid), timestamp in pending.items()]
+
+    def _restore(self, batch: list):
+        for mid, gid, timestamp in batch:
+            key = (mid, gid)
+            current = self._pending.get(key)
+            if current is None or current < timestamp:
+                self._pending[key] = timestamp
+
+    async def _write(self, connection: asyncpg.Connection, batch: list):
+        await connection.execute("CREATE TEMP TABLE last_spoke_buffer (id bigint, guild bigint, last_spoke timestamp) "
+                                 "ON COMMIT DROP;")
+        await connection.copy_records_to_table("last_spoke_buffer", records=batch,
+                                               columns=("id", "guild", "last_spoke"))
+        await connection.execute(
+            "INSERT INTO members (id,guild,last_spoke) "
+            "SELECT b.id,b.guild,b.last_spoke FROM last_spoke_buffer b "
+            "INNER JOIN guilds g ON g.id = b.guild "
+            "ON CONFLICT (id,guild) DO UPDATE SET last_spoke = excluded.last_spoke "
+            "WHERE members.last_spoke IS NULL OR members.last_spoke < excluded.last_spoke;")
+
+
+class CopyWriter(BatchWriter):
+    """Ingestion queue for append only tables, rows are copied into ``table`` in batches
+
+    At most ``max_pending`` rows are held in memory, anything past that is dropped and counted.
+    ``PARENT_JOIN`` is used to filter out rows whose parent row was deleted while they were buffered.
+    """
+    PARENT_JOIN = "INNER JOIN guilds g ON g.id = b.guild"
+
+    def __init__(self, client: "SqlClient", table: str, columns: typing.Sequence[str], *,
+                 max_pending: int = 50000, **kwargs):
+        super().__init__(client, **kwargs)
+        self.table = table
+        self.columns = tuple(columns)
+        self.max_pending = max_pending
+        self._pending: typing.Deque[tuple] = deque()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, row: tuple):
+        if len(self._pending) >= self.max_pending:
+            self.stats['dropped'] += 1
+            self._wakeup.set()
+            return
+        self._pending.append(row)
+        self.stats['queued'] += 1
+        self.stats['high_water'] = max(self.stats['high_water'], len(self._pending))
+        self._added()
+
+    def _take(self) -> list:
+        pending, self._pending = self._pending, deque()
+        return list(pending)
+
+    def _restore(self, batch: list):
+        room = self.max_pending - len(self._pending)
+        self.stats['dropped'] += max(len(batch) - room, 0)
+        self._pending.extendleft(reversed(batch[-room:] if room > 0 else []))
+
+    async def _write(self, connection: asyncpg.Connection, batch: list):
+        await copy_rows(connection, self.table, self.columns, batch, self.PARENT_JOIN)
+
+
+class CommandCallWriter(CopyWriter):
+    """Copies command calls into commands and keeps the daily usage rollups in step, in the same transaction"""
+    ROLLUPS = (
+        ("command_usage_daily", "command_usage_global_daily", "command"),
+        ("command_author_daily", "command_author_global_daily", "author"),
+    )
+
+    def __init__(self, client: "SqlClient", **kwargs):
+        super().__init__(client, "commands", models.CommandCall.codec().columns, **kwargs)
+        self._command = self.columns.index("command")
+        self._guild = self.columns.index("guild")
+        self._author = self.columns.index("author")
+        self._called = self.columns.index("called")
+
+    def add(self, call: "models.CommandCall"):
+        super().add(call.values)
+
+    async def _write(self, connection: asyncpg.Connection, batch: list):
+        await super()._write(connection, batch)
+        for table, global_table, key in self.ROLLUPS:
+            index = self._command if key == "command" else self._author
+            usage = Counter((row[self._called].date(), row[self._guild], row[index])
+                            for row in batch
+                            if row[self._guild] is not None and row[self._called] is not None
+                            and row[index] is not None)
+            if not usage:
+                continue
+            days, guilds, keys = zip(*usage.keys())
+            key_type = "text" if key == "command" else "bigint"
+            await connection.execute(
+                f"CREATE TEMP TABLE {table}_batch ON COMMIT DROP AS "
+                f"SELECT v.day, v.guild, v.{key}, v.uses FROM unnest($1::date[], $2::bigint[], "
+                f"$3::{key_type}[], $4::bigint[]) AS v(day, guild, {key}, uses) "
+                f"INNER JOIN guilds g ON g.id = v.guild;", days, guilds, keys, list(usage.values()))
+            await connection.execute(
+                f"INSERT INTO {table} (day, guild, {key}, uses) SELECT day, guild, {key}, uses FROM {table}_batch "
+                f"ON CONFLICT (guild, day, {key}) DO UPDATE SET uses = {table}.uses + excluded.uses;")
+            await connection.execute(
+                f"INSERT INTO {global_table} (day, {key}, uses) SELECT day, {key}, SUM(uses) FROM {table}_batch "
+                f"GROUP BY day, {key} "
+                f"ON CONFLICT (day, {key}) DO UPDATE SET uses = {global_table}.uses + excluded.uses;")
+
+
+class TagCallWriter(CopyWriter):
+    PARENT_JOIN = "INNER JOIN members m ON m.id = b.author AND m.guild = b.guild"
+
+    def __init__(self, client: "SqlClient", **kwargs):
+        # tagcalls.id is a serial, postgres fills it in
+        super().__init__(client, "tagcalls", ("tag_id", "author", "channel", "guild", "called"), **kwargs)
+
+    def add(self, link_id: int, author: int, channel: int, guild: int, called: datetime.datetime = None):
+        super().add((link_id, author, channel, guild, called or datetime.datetime.utcnow()))
+
+
+class NickNameWriter(BatchWriter):
+    """Write-behind buffer for nickname history
+
+    Only the last nickname a member took within one flush interval is kept, so rename storms collapse to
+    a row per member. Each batch ensures the users and members rows with one set based upsert each and
+    copies the nicknames in.
+    """
+    COLUMNS = ("id", "member", "nickname", "changed", "guild")
+
+    def __init__(self, client: "SqlClient", **kwargs):
+        super().__init__(client, **kwargs)
+        self._pending: typing.Dict[typing.Tuple[int, int], typing.Tuple[str, datetime.datetime]] = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, mid: int, gid: int, nickname: str, changed: datetime.datetime = None):
+        key = (mid, gid)
+        self.stats['queued'] += 1
+        if key in self._pending:
+            self.stats['coalesced'] += 1
+        self._pending[key] = (nickname, changed or datetime.datetime.utcnow())
+        self._added()
+
+    def _take(self) -> list:
+        pending, self._pending = self._pending, {}
+        return [(mid, gid, nickname, changed) for (mid, gid), (nickname, changed) in pending.items()]
+
+    def _restore(self, batch: list):
+        for mid, gid, nickname, changed in batch:
+            # a newer rename queued while the batch was being written wins
+            self._pending.setdefault((mid, gid), (nickname, changed))
+
+    async def _write(self, connection: asyncpg.Connection, batch: list):
+        members, guilds, _, _ = zip(*batch)
+        await connection.execute("INSERT INTO users (id) SELECT DISTINCT unnest($1::bigint[]) "
+                                 "ON CONFLICT (id) DO NOTHING;", members)
+        await connection.execute("INSERT INTO members (id,guild) SELECT v.id,v.guild "
+                                 "FROM unnest($1::bigint[], $2::bigint[]) AS v(id, guild) "
+                                 "INNER JOIN guilds g ON g.id = v.guild "
+                                 "ON CONFLICT (id,guild) DO NOTHING;", members, guilds)
+        records = [(nickname_id, mid, nickname, changed, gid)
+                   for nickname_id, (mid, gid, nickname, changed) in zip(self.client.next_ids(len(batch)), batch)]
+        await copy_rows(connection, "nicknames", self.COLUMNS, records,
+                        "INNER JOIN members m ON m.id = b.member AND m.guild = b.guild")
+
+
+class MembershipWriter(BatchWriter):
+    """Write-behind buffer for members joining and leaving guilds
+
+    Only the last event per member is kept, so joining and leaving within one interval collapses to a
+    single delete. Joins are written with one set based upsert into users and one into members, leaves
+    with one set based delete.
+    """
+
+    def __init__(self, client: "SqlClient", *, interval: float = 2.0, **kwargs):
+        super().__init__(client, interval=interval, **kwargs)
+        self._pending: typing.Dict[typing.Tuple[int, int], bool] = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, mid: int, gid: int, joined: bool):
+        key = (mid, gid)
+        self.stats['queued'] += 1
+        if key in self._pending:
+            self.stats['coalesced'] += 1
+        self._pending[key] = joined
+        if not joined:
+            self.client.known_members.remove(gid, mid)
+            self.client.user_data.pop((gid, mid))
+        self._added()
+
+    def _take(self) -> list:
+        pending, self._pending = self._pending, {}
+        return [(mid, gid, joined) for (mid, gid), joined in pending.items()]
+
+    def _restore(self, batch: list):
+        for mid, gid, joined in batch:
+            self._pending.setdefault((mid, gid), joined)
+
+    async def _write(self, connection: asyncpg.Connection, batch: list):
+        joins = [(mid, gid) for mid, gid, joined in batch if joined]
+        leaves = [(mid, gid) for mid, gid, joined in batch if not joined]
+        if joins:
+            members, guilds = zip(*joins)
+            await connection.execute("INSERT INTO users (id) SELECT DISTINCT unnest($1::bigint[]) "
+                                     "ON CONFLICT (id) DO NOTHING;", members)
+            await connection.execute("INSERT INTO members (id,guild) SELECT v.id,v.guild "
+                                     "FROM unnest($1::bigint[], $2::bigint[]) AS v(id, guild) "
+                                     "INNER JOIN guilds g ON g.id = v.guild "
+                                     "ON CONFLICT (id,guild) DO NOTHING;", members, guilds)
+        if leaves:
+            members, guilds = zip(*leaves)
+            await connection.execute("DELETE FROM members USING unnest($1::bigint[], $2::bigint[]) AS v(id, guild) "
+                                     "WHERE members.id = v.id AND members.guild = v.guild;", members, guilds)
+
+    def _written(self, batch: list):
+        joins: typing.Dict[int, typing.List[int]] = {}
+        for mid, gid, joined in batch:
+            # a leave queued while the batch was written is about to delete the row again
+            if joined and self._pending.get((mid, gid), True):
+                joins.setdefault(gid, []).append(mid)
+        for gid, mids in joins.items():
+            self.client.known_members.update(gid, mids)
+
+
+class CountWriter(BatchWriter):
+    """Aggregates counter increments per row id in memory and applies them with a single multi-row update"""
+
+    def __init__(self, client: "SqlClient", table: str, column: str, **kwargs):
+        super().__init__(client, **kwargs)
+        self.table = table
+        self.column = column
+        self._pending: typing.Counter[int] = Counter()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, row_id: int, amount: int = 1):
+        if row_id in self._pending:
+            self.stats['coalesced'] += 1
+        self._pending[row_id] += amount
+        self.stats['queued'] += 1
+        self._added()
+
+    def _take(self) -> list:
+        pending, self._pending = self._pending, Counter()
+        return list(pending.items())
+
+    def _restore(self, batch: list):
+        for row_id, amount in batch:
+            self._pending[row_id] += amount
+
+    async def _write(self, connection: asyncpg.Connection, batch: list):
+        row_ids, amounts = zip(*batch)
+        await connection.execute(f"UPDATE {self.table} SET {self.column} = COALESCE({self.table}.{self.column}, 0) "
+                                 f"+ v.amount FROM unnest($1::bigint[], $2::bigint[]) AS v(id, amount) "
+                                 f"WHERE {self.table}.id = v.id;", row_ids, amounts)
+
+
+if __name__ == '__main__':
+    from database.sqlclient import SqlClient
@@ -1 +1,2 @@
 from .test_sql import *
+from .test_digest import *
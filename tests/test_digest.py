@@ -0,0 +1,59 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+import discord
+
+from utils.digest import MemberAnnouncer
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, error: Exception = None):
+        self.id = channel_id
+        self.error = error
+        self.sent = []
+
+    async def send(self, message: str):
+        if self.error is not None:
+            raise self.error
+        self.sent.append(message)
+
+
+class MemberAnnouncerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_digest(self):
+        now = [0.0]
+        announcer = MemberAnnouncer(threshold=2, window=0.05, clock=lambda: now[0])
+        channel = FakeChannel(1)
+        for name in ("first", "second", "third", "fourth"):
+            await announcer.announce(channel, "joined", "welcome", name)
+        # past the threshold members wait for one digest at the end of the window
+        self.assertEqual(channel.sent, ["welcome", "welcome"])
+        await asyncio.sleep(0.1)
+        self.assertEqual(channel.sent[-1], "welcome\n*2 members joined: third, fourth*")
+        self.assertEqual(announcer.stats, {"sent": 2, "digested": 2, "digests": 1})
+        # once the window has passed members are announced one by one again and idle channels are forgotten
+        now[0] = 1.0
+        await announcer.announce(FakeChannel(2), "left", "bye", "other")
+        self.assertNotIn((1, "joined"), announcer._recent)
+        await announcer.announce(channel, "joined", "welcome", "fifth")
+        self.assertEqual(channel.sent[-1], "welcome")
+
+    async def test_send_errors(self):
+        forbidden = discord.Forbidden(SimpleNamespace(status=403, reason="Forbidden"), "missing permissions")
+        announcer = MemberAnnouncer(threshold=0, window=0.05, clock=lambda: 0.0)
+        channel = FakeChannel(1, error=forbidden)
+        await announcer.announce(channel, "joined", "welcome", "first")
+        await asyncio.sleep(0.1)
+        self.assertEqual(announcer.stats["digests"], 1)
+        self.assertFalse(announcer._tasks)
+
+    async def test_close(self):
+        announcer = MemberAnnouncer(threshold=0, window=10, clock=lambda: 0.0)
+        channel = FakeChannel(1)
+        await announcer.announce(channel, "joined", "welcome", "first")
+        task = next(iter(announcer._tasks))
+        announcer.close()
+        await asyncio.sleep(0)
+        self.assertTrue(task.cancelled())
+        self.assertEqual(channel.sent, [])
@@ -1,9 +1,18 @@
+import asyncio
+import contextlib
+import datetime
+import gzip
 import os
+import tempfile
+from types import SimpleNamespace
 
 import asyncpg
 import unittest
-from database import models
+from database import migrations, models, partitions
+from database.cache import LoadingCache, TTLCache
+from database.pools import PoolBusy
 from database.sqlclient import SqlClient
+from utils import snowflake
 
 database_settings = {
     "user": os.getenv("DATABASE_USER"),
@@ -46,6 +55,180 @@ class TestGuildMethods(unittest.IsolatedAsyncioTestCase):
         self.assertIsNone(response)
 
 
+class DeleteAllTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_delete_all(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        # a guild of its own, this test deletes it and the shared 12345 holds other tests' rows
+        guild = models.Guild(client, 13579)
+        await guild.save()
+        for member in (1, 2, 3):
+            await guild.add_member(member)
+        self.assertEqual(await guild.remove_members([1, 2, 4]), 2)
+        self.assertIsNone(await guild.get_member(1))
+        self.assertIsNotNone(await guild.get_member(3))
+
+        await guild.add_role_reaction(1, 555, "a", 10)
+        await guild.add_role_reaction(1, 555, "b", 11)
+        kept = await guild.add_role_reaction(1, 556, "a", 12)
+        self.assertEqual(len(await guild.delete_role_reaction_by_message(555)), 2)
+        self.assertEqual(guild._reaction_roles, [kept])
+        await guild.load_reaction_roles()
+        self.assertEqual(guild._reaction_roles, [kept])
+        self.assertEqual(await client.delete_all([]), 0)
+        await guild.delete()
+        await client.close()
+
+
+class KnownMembersTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_known_members(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        # a guild of its own, this test deletes it and the shared 12345 holds other tests' rows
+        guild = models.Guild(client, 24680)
+        await guild.save()
+        await guild.add_member(1)
+        await guild.add_member(1)
+        self.assertEqual(client.query_stats.statements["add member"].calls, 1)
+        await guild.add_member(2)
+        await guild.remove_member(2)
+        self.assertFalse(client.known_members.contains(guild.id, 2))
+
+        client.known_members.clear()
+        # other tests may leave members behind, so only this guild's memberships are checked
+        self.assertGreaterEqual(await client.load_known_members(), 1)
+        self.assertTrue(client.known_members.contains(guild.id, 1))
+        self.assertFalse(client.known_members.contains(guild.id, 2))
+        stats = client.known_members.stats
+        self.assertEqual(stats["bytes"], 8 * stats["members"])
+        await guild.delete()
+        await client.close()
+
+
+class UserDataCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_user_data_cache(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        now = [0.0]
+        client.user_data = TTLCache(max_size=10, ttl=60, clock=lambda: now[0])
+        # a guild of its own, this test deletes it and the shared 12345 holds other tests' rows
+        guild = models.Guild(client, 35791)
+        await guild.save()
+        await guild.add_member(1)
+        member = await guild.get_member(1)
+        member.experience = 10
+        await member.save()
+        # a member doesn't save the user's columns, so it isn't written through
+        self.assertIsNone(client.user_data.get((guild.id, 1)))
+        member = await guild.get_member(1)
+        client.user_data.put(member.cache_key, member)
+        client.last_spoke.add(1, guild.id, datetime.datetime(2020, 1, 1))
+        self.assertEqual(member.last_spoke, datetime.datetime(2020, 1, 1))
+        user = await client.get_user(1)
+        user.location = "Paris"
+        await user.save()
+        self.assertIsNone(client.user_data.get((guild.id, 1)))
+        self.assertIs(client.user_data.get((None, 1)), user)
+        self.assertEqual((await guild.get_member(1)).location, "Paris")
+        client.user_data.put(member.cache_key, member)
+        now[0] = 61
+        self.assertIsNone(client.user_data.get((guild.id, 1)))
+        self.assertEqual((await guild.get_member(1)).experience, 10)
+        user.location = None
+        await user.save()
+        await guild.delete()
+        await client.close()
+
+
+class NickNameWriterTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_nickname_batches(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 46802)
+        await guild.save()
+        for nickname in ("first", "second", "third"):
+            guild.add_member_nickname(1, nickname)
+        guild.add_member_nickname(2, "other")
+        # a guild that doesn't exist is skipped instead of failing the batch
+        client.nicknames.add(3, 999, "gone")
+        self.assertEqual(await client.nicknames.flush(), 3)
+        self.assertEqual(client.nicknames.stats['coalesced'], 2)
+        member = await guild.get_member(1)
+        self.assertEqual([str(nickname) for nickname in await member.get_nicknames()], ["third"])
+        self.assertEqual((await client.get("SELECT COUNT(*) FROM nicknames WHERE guild = $1", guild.id))[0], 2)
+        await guild.delete()
+        await client.close()
+
+
+class MembershipWriterTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_membership_batches(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 57913)
+        await guild.save()
+        await guild.add_member(1)
+        for member in range(2, 102):
+            guild.member_joined(member)
+        guild.member_left(1)
+        # joining and leaving inside one batch leaves no row behind
+        guild.member_joined(200)
+        guild.member_left(200)
+        self.assertEqual(await client.memberships.flush(), 102)
+        count = await client.get("SELECT COUNT(*) FROM members WHERE guild = $1", guild.id)
+        self.assertEqual(count[0], 100)
+        self.assertTrue(client.known_members.contains(guild.id, 101))
+        self.assertFalse(client.known_members.contains(guild.id, 1))
+        write = client.memberships._write
+
+        async def write_then_leave(connection, batch):
+            await write(connection, batch)
+            # the member leaves again while the join is being written
+            guild.member_left(300)
+
+        client.memberships._write = write_then_leave
+        guild.member_joined(300)
+        await client.memberships.flush()
+        self.assertFalse(client.known_members.contains(guild.id, 300))
+        client.memberships._write = write
+        await client.memberships.flush()
+        await guild.delete()
+        await client.close()
+
+
+class MemberImportTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_member_import(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 68024)
+        await guild.save()
+        await guild.add_member(5)
+        reports = []
+        report = await client.import_members(guild.id, range(1, 12001), batch_size=5000, pause=0,
+                                             progress=lambda progress: reports.append(progress.imported))
+        self.assertEqual(reports, [5000, 10000, 12000])
+        self.assertTrue(report.done)
+        # finished imports aren't kept around
+        self.assertNotIn(guild.id, client.imports)
+        self.assertEqual(report.members_added, 11999)
+        count = await client.get("SELECT COUNT(*) FROM members WHERE guild = $1", guild.id)
+        self.assertEqual(count[0], 12000)
+        self.assertTrue(client.known_members.contains(guild.id, 12000))
+        await guild.delete()
+        await client.close()
+
+
 class TestCommandStats(unittest.IsolatedAsyncioTestCase):
 
     async def test_command_stats(self):
@@ -107,3 +290,494 @@ class CallTagTest(unittest.IsolatedAsyncioTestCase):
         await client.setup()
         guild = await client.get_guild(12345)
         await guild.call_tag("fooalias", 1111, 1234)
+
+
+class LastSpokeWriterTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_last_spoke_buffer(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 12345)
+        await guild.save()
+        older = datetime.datetime(2020, 1, 1)
+        newer = datetime.datetime(2020, 1, 2)
+        client.last_spoke.add(1234, guild.id, newer)
+        client.last_spoke.add(1234, guild.id, older)
+        self.assertEqual(len(client.last_spoke), 1)
+        self.assertEqual(client.last_spoke.stats['coalesced'], 1)
+        flushed = await client.last_spoke.flush()
+        self.assertEqual(flushed, 1)
+        member = await client.get("SELECT last_spoke FROM members WHERE id = $1 and guild = $2", 1234, guild.id)
+        self.assertEqual(member['last_spoke'], newer)
+        await client.close()
+
+
+class CommandIngestionTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_command_ingestion(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 12345)
+        await guild.save()
+        prefix = await guild.add_prefix("??", 1234)
+        calls = []
+        for x in range(0, 100):
+            call = models.CommandCall(client, command="ingest", guild=guild.id, author=1234)
+            calls.append(call.id)
+            client.command_calls.add(call)
+            await prefix.use()
+        self.assertEqual(len(client.prefix_uses), 1)
+        await client.close()
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        data = await client.fetch("SELECT COUNT(*) FROM commands WHERE id = any($1::bigint[])", calls)
+        self.assertEqual(data['count'], 100)
+        data = await client.fetch("SELECT uses FROM prefixes WHERE id = $1", prefix.id)
+        self.assertEqual(data['uses'], 100)
+        await client.execute("DELETE FROM commands WHERE id = any($1::bigint[])", calls)
+        await client.execute("DELETE FROM prefixes WHERE id = $1", prefix.id)
+        await client.close()
+
+
+class LazyGuildDataTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_lazy_guild_data(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 79135)
+        await guild.save()
+        await guild.add_prefix("%%", 1234)
+        loaded = []
+
+        async def load(gid):
+            loaded.append(gid)
+            await asyncio.sleep(0.01)
+            return await client.get_guild(gid)
+
+        guild_data = LoadingCache(load, max_size=1)
+        self.assertIsNone(guild_data.get(guild.id))
+        # concurrent misses share a single load
+        first, second = await asyncio.gather(guild_data.fetch(guild.id), guild_data.fetch(guild.id))
+        self.assertIs(first, second)
+        self.assertIn("%%", first.prefixes)
+        self.assertEqual(loaded, [guild.id])
+        self.assertEqual(guild_data.coalesced, 1)
+        self.assertIs(guild_data.get(guild.id), first)
+        # a missing guild isn't cached, and loading another evicts the least recently used guild
+        self.assertIsNone(await guild_data.fetch(97531))
+        self.assertNotIn(97531, guild_data)
+        guild_data.put(1, models.Guild(client, 1))
+        self.assertNotIn(guild.id, guild_data)
+        # pinned guilds are never evicted
+        guild_data.pin(guild.id, (await client.get_guilds([guild.id, 97531]))[0])
+        guild_data.put(2, models.Guild(client, 2))
+        self.assertIn("%%", guild_data.get(guild.id).prefixes)
+        self.assertNotIn(1, guild_data)
+        await guild.delete()
+        await client.close()
+
+
+class SlottedModelTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_slotted_models(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 86420)
+        await guild.save()
+        self.assertFalse(hasattr(guild, "__dict__"))
+        self.assertEqual(guild.data["id"], guild.id)
+        self.assertEqual(len(guild.prefixes), 0)
+        self.assertIsNone(guild._prefixes)
+        prefixes = guild.prefixes
+        prefix = await guild.add_prefix("&&", 1234)
+        # the empty mapping handed out before the first prefix isn't the guild's collection
+        self.assertEqual(len(prefixes), 0)
+        self.assertEqual(len(guild.prefixes), 1)
+        self.assertFalse(hasattr(prefix, "__dict__"))
+        await prefix.use()
+        self.assertEqual(prefix.data["uses"], 1)
+        loaded = (await client.get_guilds([guild.id]))[0]
+        self.assertIn("&&", loaded.prefixes)
+        self.assertEqual(len(loaded.reaction_roles), 0)
+        self.assertIsNone(loaded._reaction_roles)
+        await guild.delete()
+        await client.close()
+
+
+class GuildHydrationTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_bulk_hydration(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        # guilds of its own, other tests leave prefixes on theirs
+        guild = models.Guild(client, 91357)
+        await guild.save()
+        other_guild = models.Guild(client, 91358)
+        await other_guild.save()
+        await guild.add_prefix("!!", 1234)
+        await other_guild.add_prefix("$$", 1234)
+        guilds = {guild.id: guild for guild in await client.get_all_guilds()}
+        self.assertEqual(set(guilds[guild.id].prefixes), {"!!"})
+        self.assertEqual(set(guilds[other_guild.id].prefixes), {"$$"})
+        self.assertEqual(client.hydration_timings["prefixes"][0],
+                         (await client.fetch("SELECT COUNT(*) FROM prefixes"))[0])
+        await other_guild.delete()
+        await guild.delete()
+        await client.close()
+
+
+class MemberSyncTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_member_sync(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 12345)
+        await guild.save()
+        await guild.add_member(4321)
+        members = [SimpleNamespace(id=1234, bot=False), SimpleNamespace(id=1111, bot=True)]
+        discord_guild = SimpleNamespace(id=guild.id, chunked=True, members=members)
+        report = await client.sync_members([1234, 1111], [discord_guild])
+        self.assertEqual(report.members_removed, 1)
+        self.assertIsNone(await guild.get_member(4321))
+        self.assertIsNotNone(await guild.get_member(1234))
+        report = await client.sync_members([1234, 1111], [discord_guild])
+        self.assertEqual((report.users_added, report.members_added, report.members_removed), (0, 0, 0))
+        await client.close()
+
+
+class TagCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_tag_cache(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 12345)
+        await guild.save()
+        await guild.add_member(1234)
+        await guild.create_tag("cached", "first", 1234)
+        self.assertEqual(await guild.call_tag("Cached", 1111, 1234), "first")
+        self.assertIsNotNone(client.tag_cache.get(guild.id, "cached"))
+        self.assertEqual(await guild.call_tag("cached", 1111, 1234), "first")
+        tag = await guild.get_tag("cached")
+        await tag.edit(content="second")
+        self.assertIsNone(client.tag_cache.get(guild.id, "cached"))
+        self.assertEqual(await guild.call_tag("cached", 1111, 1234), "second")
+        await tag.delete()
+        self.assertIsNone(await guild.call_tag("cached", 1111, 1234))
+        await client.close()
+
+
+class TagUsageTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_tag_usage(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 12345)
+        await guild.save()
+        await guild.add_member(1234)
+        await guild.create_tag("counted", "content", 1234)
+        for x in range(0, 3):
+            await guild.call_tag("counted", 1111, 1234)
+        self.assertEqual(len(client.tag_uses), 1)
+        self.assertEqual(len(client.tag_calls), 3)
+        await client.tag_uses.flush()
+        await client.tag_calls.flush()
+        tag = await guild.get_tag("counted")
+        self.assertEqual(tag.count, 3)
+        link_id = client.tag_cache.get(guild.id, "counted").link_id
+        calls = await client.fetch("SELECT COUNT(*) FROM tagcalls WHERE tag_id = $1", link_id)
+        self.assertEqual(calls['count'], 3)
+        await tag.delete()
+        await client.close()
+
+
+class TagSearchTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_tag_search(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 23456)
+        await guild.save()
+        await guild.add_member(1234)
+        await guild.create_tag("doggo", "woof", 1234)
+        await guild.create_tag("catalog", "meow", 1234)
+        self.assertEqual(await guild.search_tags("dog"), ["doggo"])
+        await guild.create_alias("doggo", "dogs", 1234)
+        await guild.create_alias("missing", "nothing", 1234)
+        self.assertEqual(await guild.search_tags("dog"), ["doggo", "dogs"])
+        self.assertEqual(await guild.search_tags("catalgo"), ["catalog"])
+        self.assertEqual(await guild.search_tags("nothing"), [])
+        tag = await guild.get_tag("doggo")
+        await tag.delete()
+        self.assertEqual(await guild.search_tags("dog"), [])
+        await guild.delete()
+        await client.close()
+
+
+class TagContentSearchTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_tag_content_search(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 34567)
+        await guild.save()
+        await guild.add_member(1234)
+        for x in range(0, 5):
+            await guild.create_tag(f"pet{x}", f"a picture of a dog number {x}", 1234)
+        await guild.create_tag("dogs", "a list of dogs and more dogs", 1234)
+        await guild.create_tag("cats", "a picture of a cat", 1234)
+        matches, cursor = await guild.search_tag_content("dogs", limit=4)
+        self.assertEqual(matches[0].title, "dogs")
+        self.assertIn("**", matches[0].snippet)
+        self.assertIsNotNone(cursor)
+        rest, cursor = await guild.search_tag_content("dogs", limit=4, after=cursor)
+        self.assertIsNone(cursor)
+        titles = [match.title for match in matches + rest]
+        self.assertEqual(sorted(titles), ["dogs", "pet0", "pet1", "pet2", "pet3", "pet4"])
+        self.assertEqual((await guild.search_tag_content("picture -dog"))[0][0].title, "cats")
+        await guild.delete()
+        await client.close()
+
+
+class RandomTagTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_random_tags(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 45678)
+        await guild.save()
+        await guild.add_member(1234)
+        self.assertIsNone(await guild.get_random_tag())
+        for x in range(0, 4):
+            await guild.create_tag(f"random{x}", f"content {x}", 1234)
+        self.assertEqual(len(client.tag_ids.get(guild.id)), 4)
+        tags = await guild.get_random_tags(10)
+        self.assertEqual(sorted(tag.title for tag in tags), ["random0", "random1", "random2", "random3"])
+        await tags[0].delete()
+        self.assertEqual(len(client.tag_ids.get(guild.id)), 3)
+        self.assertEqual(len(await guild.get_random_tags(10)), 3)
+        probed = await guild.probe_random_tag_ids(2)
+        self.assertTrue(1 <= len(probed) <= 2)
+        self.assertEqual(len(set(probed)), len(probed))
+        await guild.delete()
+        await client.close()
+
+
+class SnowflakeLeaseTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_snowflake_lease(self):
+        first = SqlClient(await asyncpg.create_pool(**database_settings))
+        second = SqlClient(await asyncpg.create_pool(**database_settings))
+        await first.setup()
+        await second.setup()
+        self.assertNotEqual((first.generator.worker_id, first.generator.data_center_id),
+                            (second.generator.worker_id, second.generator.data_center_id))
+        ids = first.next_ids(5000) + second.next_ids(5000)
+        self.assertEqual(len(set(ids)), 10000)
+        # losing the lease connection stops allocation until a worker id is leased again
+        await second.execute("SELECT pg_terminate_backend($1)", first._lease.get_server_pid())
+        for _ in range(50):
+            if first.generator is None:
+                break
+            await asyncio.sleep(0.1)
+        with self.assertRaises(snowflake.SnowflakeUnavailable):
+            models.Guild(first)
+        for _ in range(100):
+            if first.generator is not None:
+                break
+            await asyncio.sleep(0.1)
+        self.assertIsNotNone(first.generator)
+        ids = first.next_ids(5000) + second.next_ids(5000)
+        self.assertEqual(len(set(ids)), 10000)
+        await second.close()
+        await first.close()
+        with self.assertRaises(snowflake.SnowflakeUnavailable):
+            models.Guild(SqlClient(None))
+
+
+class QueryStatsTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_query_stats(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        client.query_stats.slow_threshold = 0
+        await client.raw_get_all("SELECT generate_series(1, 5)")
+        await client.raw_get_all("SELECT generate_series(1,   3)")
+        await client.get("SELECT $1::text", "secret")
+        with self.assertRaises(asyncpg.PostgresError):
+            await client.execute("SELECT * FROM missing_table")
+        series = client.query_stats.statements["SELECT generate_series(?, ?)"]
+        self.assertEqual((series.calls, series.rows, sum(series.histogram)), (2, 8, 2))
+        missing = client.query_stats.statements["SELECT * FROM missing_table"]
+        self.assertEqual(missing.error_rate, 1.0)
+        self.assertIn(("str[6]",), [query.parameters for query in client.query_stats.slow_queries])
+        self.assertNotIn("secret", repr(list(client.query_stats.slow_queries)))
+        self.assertEqual(client.pool_saturation["interactive"]["in_use"], 0)
+        await client.close()
+
+
+class PoolClassTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_pool_classes(self):
+        client = await SqlClient.connect(**database_settings)
+        self.assertEqual(len(client.distinct_pools), 3)
+        timeouts = {name: await client.get("SHOW statement_timeout", pool=name) for name in client.pools}
+        self.assertEqual(timeouts["interactive"]["statement_timeout"], "5s")
+        self.assertEqual(timeouts["background"]["statement_timeout"], "0")
+        # analytics sheds load instead of queueing past its limit
+        client.pool_classes["analytics"].max_waiting = 0
+        self.assertEqual(len(await client.raw_get_all("SELECT 1", pool="analytics")), 1)
+        async with contextlib.AsyncExitStack() as stack:
+            for _ in range(client.pool_classes["analytics"].max_size):
+                await stack.enter_async_context(client.acquire("hold", pool="analytics"))
+            with self.assertRaises(PoolBusy):
+                await client.raw_get_all("SELECT 1", pool="analytics")
+        self.assertEqual(client.pool_saturation["analytics"]["rejected"], 1)
+        await client.close()
+
+    async def test_caller_connection_settings(self):
+        initialised = []
+
+        async def init(connection):
+            initialised.append(connection)
+
+        client = await SqlClient.connect(server_settings={"search_path": "public", "statement_timeout": "1s"},
+                                         init=init, **database_settings)
+        self.assertTrue(initialised)
+        settings = await client.get("SELECT current_setting('search_path') AS search_path, "
+                                    "current_setting('statement_timeout') AS statement_timeout")
+        self.assertEqual(settings["search_path"], "public")
+        self.assertEqual(settings["statement_timeout"], "5s")
+        await client.close()
+
+    async def test_single_background_connection(self):
+        # the snowflake lease is held outside the pools, so one background connection is enough for setup
+        client = await SqlClient.connect(bot=SimpleNamespace(config={"background_pool_size": 1}),
+                                         **database_settings)
+        await asyncio.wait_for(client.setup(), timeout=30)
+        self.assertEqual(len(client.next_ids(10)), 10)
+        await client.close()
+
+
+class MigrationTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_migrations(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        async with pool.acquire() as connection:
+            self.assertEqual(await migrations.get_version(connection), migrations.latest_version())
+            self.assertEqual(await migrations.migrate(connection), [])
+            index = await connection.fetchval("SELECT indisvalid FROM pg_index i INNER JOIN pg_class c "
+                                              "ON c.oid = i.indexrelid WHERE c.relname = 'tagslink_guild_title_idx'")
+            self.assertTrue(index)
+        await client.close()
+
+
+class CommandRollupTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_command_rollups(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 67890)
+        await guild.save()
+        for x in range(0, 30):
+            client.command_calls.add(models.CommandCall(client, command="rolled", guild=guild.id, author=x % 3))
+        client.command_calls.add(models.CommandCall(client, command="other", guild=guild.id, author=5))
+        await client.command_calls.flush()
+        stats = await guild.get_command_stats()
+        self.assertEqual(stats.total_commands_used, 31)
+        self.assertEqual(stats.total_commands_used_today, 31)
+        self.assertEqual(list(stats.top_commands.items())[0], ("rolled", 30))
+        self.assertEqual(stats.top_command_users_today[0], 10)
+        global_stats = await client.get_command_stats()
+        self.assertGreaterEqual(global_stats.top_commands["rolled"], 30)
+        await guild.delete()
+        await client.close()
+
+
+class PartitionTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_partition_archive(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        guild = models.Guild(client, 78901)
+        await guild.save()
+        old = datetime.datetime(2001, 1, 15)
+        async with pool.acquire() as connection:
+            self.assertTrue(await partitions.is_partitioned(connection, "commands"))
+            await partitions.create_partitions(connection, "commands", old, old)
+        for x in range(0, 5):
+            client.command_calls.add(models.CommandCall(client, command="archived", guild=guild.id, author=1,
+                                                        called=old))
+        client.command_calls.add(models.CommandCall(client, command="live", guild=guild.id, author=1))
+        await client.command_calls.flush()
+        with tempfile.TemporaryDirectory() as archive_path:
+            client.partitions.archive_path = archive_path
+            client.partitions.retention_months = 12
+            report = await client.partitions.run()
+            self.assertIn("commands_p2001_01", report["archived"])
+            with gzip.open(os.path.join(archive_path, "commands_p2001_01.csv.gz"), "rt") as archive:
+                self.assertEqual(len(archive.read().splitlines()), 6)
+        self.assertEqual((await client.fetch("SELECT COUNT(*) FROM commands WHERE guild = $1", guild.id))[0], 1)
+        stats = await guild.get_command_stats()
+        self.assertEqual(stats.total_commands_used, 6)
+        await guild.delete()
+        await client.close()
+
+    async def test_partition_over_default_rows(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        month = datetime.date(2002, 5, 1)
+        async with pool.acquire() as connection:
+            transaction = connection.transaction()
+            await transaction.start()
+            try:
+                await connection.execute("INSERT INTO commands (id, command, author, called) "
+                                         "VALUES (1, 'a', 1, '2002-05-02'), (2, 'b', 1, '2002-06-02');")
+                created = await partitions.create_partitions(connection, "commands", month, month)
+                self.assertEqual(created, ["commands_p2002_05"])
+                self.assertEqual(await connection.fetchval("SELECT COUNT(*) FROM commands_p2002_05"), 1)
+                self.assertEqual(await connection.fetchval("SELECT COUNT(*) FROM commands_default "
+                                                           "WHERE id IN (1, 2)"), 1)
+                self.assertEqual(await connection.fetchval("SELECT COUNT(*) FROM commands WHERE id IN (1, 2)"), 2)
+            finally:
+                await transaction.rollback()
+        await client.close()
+
+    async def test_partition_existing_table(self):
+        pool = await asyncpg.create_pool(**database_settings)
+        client = SqlClient(pool)
+        await client.setup()
+        async with pool.acquire() as connection:
+            transaction = connection.transaction()
+            await transaction.start()
+            try:
+                await connection.execute("DROP TABLE commands;"
+                                         "CREATE TABLE commands (id bigint primary key, command text, guild bigint,"
+                                         "author bigint, called timestamp);"
+                                         "CREATE INDEX commands_guild_idx ON commands (guild, called);"
+                                         "INSERT INTO commands VALUES (1, 'a', NULL, 1, '2019-03-02'),"
+                                         "(2, 'b', NULL, 1, NULL), (3, 'c', NULL, 1, now());")
+                await migrations.partition_logs(connection)
+                self.assertTrue(await partitions.is_partitioned(connection, "commands"))
+                self.assertEqual(await connection.fetchval("SELECT COUNT(*) FROM commands"), 3)
+                self.assertEqual(await connection.fetchval("SELECT COUNT(*) FROM commands_p2019_03"), 1)
+                self.assertEqual(await connection.fetchval("SELECT COUNT(*) FROM commands_default"), 1)
+                self.assertIsNone(await connection.fetchval("SELECT to_regclass('commands_legacy')"))
+            finally:
+                await transaction.rollback()
+        await client.close()
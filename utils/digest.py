@@ -0,0 +1,82 @@
+import asyncio
+import time
+import typing
+from collections import deque
+
+import discord
+
+
+class MemberAnnouncer:
+    """Sends welcome and leave messages, collapsing bursts into digests
+
+    Each member gets their own message until more than ``threshold`` arrive in one channel within
+    ``window`` seconds. Past that, members are collected and announced together in one digest message
+    per window until the burst is over.
+    """
+    MAX_NAMES = 20
+
+    def __init__(self, threshold: int = 5, window: float = 10.0, clock: typing.Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.window = window
+        self.clock = clock
+        self._recent: typing.Dict[typing.Tuple[int, str], typing.Deque[float]] = {}
+        self._pending: typing.Dict[typing.Tuple[int, str], typing.List[discord.abc.User]] = {}
+        self._tasks: typing.Set[asyncio.Task] = set()
+        self._pruned = clock()
+        self.stats = {"sent": 0, "digested": 0, "digests": 0}
+
+    async def announce(self, channel: discord.abc.Messageable, kind: str, message: str,
+                       member: discord.abc.User):
+        """Announces ``member`` in ``channel``, ``kind`` is joined or left and names the digest"""
+        key = (channel.id, kind)
+        now = self.clock()
+        if now - self._pruned >= self.window:
+            self._prune(now)
+        recent = self._recent.setdefault(key, deque())
+        recent.append(now)
+        while recent[0] <= now - self.window:
+            recent.popleft()
+        if key in self._pending:
+            self._pending[key].append(member)
+            self.stats["digested"] += 1
+        elif len(recent) <= self.threshold:
+            self.stats["sent"] += 1
+            await self._send(channel, message)
+        else:
+            self._pending[key] = [member]
+            self.stats["digested"] += 1
+            task = asyncio.get_event_loop().create_task(self._send_digest(channel, key, kind, message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def close(self):
+        """Cancels the digests still waiting for their window to end"""
+        for task in list(self._tasks):
+            task.cancel()
+        self._pending.clear()
+
+    def _prune(self, now: float):
+        """Forgets the channels nobody joined or left within the last window"""
+        self._pruned = now
+        for key, recent in list(self._recent.items()):
+            if recent[-1] <= now - self.window:
+                del self._recent[key]
+
+    @staticmethod
+    async def _send(channel: discord.abc.Messageable, message: str):
+        try:
+            await channel.send(message)
+        except (discord.NotFound, discord.Forbidden, discord.HTTPException):
+            pass
+
+    async def _send_digest(self, channel: discord.abc.Messageable, key: typing.Tuple[int, str], kind: str,
+                           message: str):
+        await asyncio.sleep(self.window)
+        members = self._pending.pop(key, [])
+        if not members:
+            return
+        self.stats["digests"] += 1
+        names = ", ".join(str(member) for member in members[:self.MAX_NAMES])
+        if len(members) > self.MAX_NAMES:
+            names += f" and {len(members) - self.MAX_NAMES} more"
+        await self._send(channel, f"{message}\n*{len(members)} members {kind}: {names}*")
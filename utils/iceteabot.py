@@ -8,18 +8,46 @@ import traceback
 import typing
 from collections import Counter
 
-import asyncpg
 import discord
 import psutil
 from aiohttp import ClientSession
 from discord.ext import commands
+from sentry_sdk import capture_exception
 
 from database import models
+from database.cache import LoadingCache
+from database.pools import BACKGROUND, PoolBusy
 from database.sqlclient import SqlClient
 from utils.help import IceHelpCommand
 from utils.iceteacontext import IceTeaContext
 
 
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a whole number, got {value!r}") from None
+
+
+def _env_ids(name: str) -> typing.List[int]:
+    """A comma separated list of ids, blank entries are skipped"""
+    value = os.getenv(name, '')
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise ValueError(f"{name} must be comma separated ids, got {value!r}") from None
+
+
 class Iceteabot(commands.Bot):
     def __init__(self, *args, **kwargs):
         self.config: dict = {
@@ -32,6 +60,18 @@ class Iceteabot(commands.Bot):
             "sentry_token": os.getenv('SENTRY_TOKEN'),
             "discordbots_token": os.getenv('DISCORDBOTS_TOKEN'),
             "postgres_url": os.getenv('POSTGRES_URL'),
+            "log_retention_months": int(os.getenv('LOG_RETENTION_MONTHS', 0)) or None,
+            "archive_path": os.getenv('ARCHIVE_PATH', 'data/archive'),
+            "snowflake_worker_id": os.getenv('SNOWFLAKE_WORKER_ID'),
+            "snowflake_datacenter_id": os.getenv('SNOWFLAKE_DATACENTER_ID'),
+            "interactive_pool_size": os.getenv('INTERACTIVE_POOL_SIZE'),
+            "background_pool_size": os.getenv('BACKGROUND_POOL_SIZE'),
+            "analytics_pool_size": os.getenv('ANALYTICS_POOL_SIZE'),
+            "member_digest_threshold": os.getenv('MEMBER_DIGEST_THRESHOLD', 5),
+            "member_digest_window": os.getenv('MEMBER_DIGEST_WINDOW', 10),
+            "lazy_guild_data": _env_flag('LAZY_GUILD_DATA'),
+            "guild_cache_size": _env_int('GUILD_CACHE_SIZE', 10000),
+            "pinned_guilds": _env_ids('PINNED_GUILDS'),
         }
         super(Iceteabot, self).__init__(
             command_prefix=self.get_guild_prefix,
@@ -53,7 +93,10 @@ class Iceteabot(commands.Bot):
             self.aioconnection: ClientSession = ClientSession(loop=self.loop)
         self._database_loaded = asyncio.Event(loop=self.loop)
         self.sql: typing.Optional[SqlClient] = None
-        self._guild_data: typing.Dict[int, models.Guild] = {}
+        # with lazy guild data only the most recently used guilds are kept, plus the pinned ones
+        self.lazy_guild_data: bool = self.config["lazy_guild_data"]
+        self._guild_data: LoadingCache[int, models.Guild] = LoadingCache(
+            self._load_guild_data, max_size=self.config["guild_cache_size"] if self.lazy_guild_data else None)
         self.logger: typing.Optional[logging.Logger] = None
         self.error_logger: typing.Optional[logging.Logger] = None
         self.data_base_built = False
@@ -110,7 +153,7 @@ class Iceteabot(commands.Bot):
 
     async def close(self):
         await self.aioconnection.close()
-        await self.sql.pool.close()
+        await self.sql.close()
         await super(Iceteabot, self).close()
 
     async def on_ready(self):
@@ -136,6 +179,8 @@ class Iceteabot(commands.Bot):
             await ctx.send(
                 f"Sorry, I could not do anything with what you provided me.\n"
                 f"You can use ``{ctx.prefix}help {ctx.invoked_with}`` for more info")
+        elif isinstance(error, commands.errors.CommandInvokeError) and isinstance(error.original, PoolBusy):
+            await ctx.send("I'm a bit busy right now, try that again in a moment")
         # Reports on non generic errors
         elif isinstance(error, commands.errors.CommandInvokeError):
             try:
@@ -211,19 +256,33 @@ class Iceteabot(commands.Bot):
             return
 
     async def populate_database(self):
-        await self.sql.add_users(self.users)
-        guilds = await self.sql.get_all_guilds()
-        self._guild_data.update({guild.id: guild for guild in guilds})
-        for guild in self.guilds:
-            if guild.id not in self._guild_data:
-                await self.add_guild(guild)
+        if self.lazy_guild_data:
+            await self.pin_guilds()
+        else:
+            guilds = await self.sql.get_all_guilds()
+            for guild in guilds:
+                self._guild_data.put(guild.id, guild)
+            if self.logger:
+                for table, (rows, seconds) in self.sql.hydration_timings.items():
+                    self.logger.info(f"Loaded {rows} {table} rows in {seconds * 1000:.2f}ms")
+            for guild in self.guilds:
+                if guild.id not in self._guild_data:
+                    await self.add_guild(guild)
+        report = await self.sql.sync_members(self.users, self.guilds)
+        if self.logger:
+            self.logger.info(f"Synced {report.guilds_synced} guilds in {report.seconds * 1000:.2f}ms: "
+                             f"{report.users_added} users added, {report.members_added} members added, "
+                             f"{report.members_removed} members removed")
+        known = await self.sql.load_known_members()
+        if self.logger:
+            self.logger.info(f"Loaded {known} known members")
         self._database_loaded.set()
         self.data_base_built = True
 
     async def setup_database(self):
         # noinspection PyBroadException
         try:
-            self.sql = SqlClient(await asyncpg.create_pool(dsn=self.config['postgres_url']), self)
+            self.sql = await SqlClient.connect(self.config['postgres_url'], self)
             await self.sql.setup()
         except Exception as e:
             print(traceback.format_tb(e))
@@ -285,7 +344,7 @@ class Iceteabot(commands.Bot):
         if message.guild is None:
             return commands.when_mentioned_or(*iceteabot.config['default_prefix'])(iceteabot, message)
         else:
-            guild_data: models.Guild = iceteabot.get_guild_data(message.guild.id)
+            guild_data: models.Guild = await iceteabot.fetch_guild_data(message.guild.id)
             if guild_data:
                 if guild_data.prefixes:
                     return commands.when_mentioned_or(*guild_data.prefixes.keys())(iceteabot, message)
@@ -296,8 +355,8 @@ class Iceteabot(commands.Bot):
 
     @staticmethod
     async def _create_user_data(ctx: "IceTeaContext"):
+        # author data itself is only loaded by the commands that ask for it
         await ctx.guild_data.add_member(ctx.author.id)
-        ctx.author_data = await ctx.get_user_data(ctx.author)
 
     async def update_discord_bots(self) -> bool:
         if self.config.get('discordbots_token'):
@@ -307,18 +366,81 @@ class Iceteabot(commands.Bot):
                 if response.status == 200:
                     return True
 
+    @property
+    def guild_data_stats(self) -> typing.Dict[str, int]:
+        return self._guild_data.stats
+
     def get_guild_data(self, gid: int) -> models.Guild:
+        """The guild's data if it is loaded, with lazy guild data that is only guaranteed from fetch_guild_data"""
         return self._guild_data.get(gid)
 
+    async def fetch_guild_data(self, gid: int) -> models.Guild:
+        """The guild's data, loading it first if it isn't cached and guild data is lazy"""
+        if not self.lazy_guild_data:
+            return self._guild_data.get(gid)
+        return await self._guild_data.fetch(gid)
+
+    async def _load_guild_data(self, gid: int) -> typing.Optional[models.Guild]:
+        guild_data = await self.sql.get_guild(gid)
+        if guild_data is None:
+            guild = self.get_guild(gid)
+            if guild is not None:
+                guild_data = await self.add_guild(guild)
+        return guild_data
+
+    async def pin_guilds(self):
+        """Loads the premium guilds and the configured pinned guilds and keeps them out of the LRU"""
+        records = await self.sql.raw_get_all("SELECT id FROM guilds WHERE premium", pool=BACKGROUND)
+        ids = {record['id'] for record in records}.union(self.config["pinned_guilds"])
+        guilds = await self.sql.get_guilds(ids)
+        for guild in guilds:
+            self.pin_guild(guild)
+        if self.logger:
+            self.logger.info(f"Pinned {len(guilds)} guilds, the others are loaded on first use")
+
+    def pin_guild(self, guild_data: models.Guild, pinned: bool = True):
+        if pinned:
+            self._guild_data.pin(guild_data.id, guild_data)
+        else:
+            self._guild_data.unpin(guild_data.id)
+
     async def add_guild(self, guild: discord.Guild) -> models.Guild:
         new_guild = models.Guild(client=self.sql, id=guild.id)
         await new_guild.save()
-        self._guild_data[guild.id] = new_guild
+        self._guild_data.put(guild.id, new_guild)
         return new_guild
 
+    async def import_guild_members(self, guild: discord.Guild):
+        """Imports every member of a newly joined guild in the background, logging progress"""
+
+        def log_progress(progress):
+            if self.logger:
+                self.logger.info(f"Imported {progress.imported}/{progress.total} members of {guild.id} "
+                                 f"({progress.percent:.0f}%) in {progress.seconds:.2f}s")
+
+        try:
+            if not guild.chunked:
+                await guild.chunk()
+            return await self.sql.import_members(guild.id, [member for member in guild.members if not member.bot],
+                                                 progress=log_progress)
+        except Exception as e:
+            if self.error_logger:
+                self.error_logger.exception(f"failed to import the members of {guild.id}")
+            capture_exception(e)
+
     async def remove_guild(self, guild_id: int):
         old_guild = self._guild_data.pop(guild_id)
+        if old_guild is None:
+            # not loaded with lazy guild data, the row is deleted all the same
+            old_guild = models.Guild(client=self.sql, id=guild_id)
         await old_guild.delete()
+        self.sql.tag_cache.invalidate_guild(guild_id)
+        self.sql.tag_titles.invalidate(guild_id)
+        self.sql.tag_ids.invalidate(guild_id)
+        self.sql.known_members.invalidate(guild_id)
+        for key in self.sql.user_data:
+            if key[0] == guild_id:
+                self.sql.user_data.pop(key)
 
     @staticmethod
     def get_time_difference(time, *, brief=False, reverse: bool = False):
@@ -11,7 +11,7 @@ class IceTeaContext(Context):
     def __init__(self, **attrs):
         super().__init__(**attrs)
         self.bot: "Iceteabot" = self.bot
-        self.author_data: typing.Optional[typing.Union[models.User, models.Member]] = None
+        self._author_data: typing.Optional[typing.Union[models.User, models.Member]] = None
 
     @property
     def prefix_data(self) -> "models.Prefix":
@@ -30,17 +30,28 @@ class IceTeaContext(Context):
     def get_guild_data(self, guild: int = None) -> "models.Guild":
         return self.bot.get_guild_data(guild)
 
-    async def get_author_data(self):
-        return await self.get_user_data(self.author)
+    async def get_author_data(self) -> typing.Optional[typing.Union["models.Member", "models.User"]]:
+        """The author's member or user data, loaded on first use and kept for the rest of the invocation"""
+        if self._author_data is None:
+            self._author_data = await self.get_user_data(self.author)
+        return self._author_data
 
-    async def get_user_data(self, user: typing.Union[discord.Member, discord.User]) -> \
+    async def get_user_data(self, user: typing.Union[discord.Member, discord.User], member: bool = True) -> \
             typing.Union["models.Member", "models.User"]:
-        if hasattr(user, "guild"):
-            guild = self.get_guild_data(user.guild.id)
-            if guild:
-                return await guild.get_member(user.id)
-        else:
-            return await self.bot.sql.get_user(user.id)
+        """Member data inside a guild and user data elsewhere, or user data anywhere when member is False,
+        served from the client's user cache when fresh"""
+        guild = None
+        if member and hasattr(user, "guild"):
+            guild = await self.bot.fetch_guild_data(user.guild.id)
+            if guild is None:
+                return None
+        key = (guild.id if guild else None, user.id)
+        data = self.bot.sql.user_data.get(key)
+        if data is None:
+            data = await guild.get_member(user.id) if guild else await self.bot.sql.get_user(user.id)
+            if data is not None:
+                self.bot.sql.user_data.put(key, data)
+        return data
 
     def dispatch_error(self, error: Exception):
         self.bot.dispatch("command_error", self, error)
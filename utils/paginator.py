@@ -702,14 +702,44 @@ class TaskPaginator(Pages):
 
 
 class TagPaginator(Pages):
+    """Lists tags, either all given up front or fetched a page at a time
+
+    ``fetch`` is called with a cursor and returns the next page of entries along with the cursor
+    after it, None once there are no more. ``cursor`` is the one following ``entries``.
+    """
+
+    def __init__(self, ctx, *, entries, fetch=None, cursor=None, **kwargs):
+        super().__init__(ctx, entries=list(entries), **kwargs)
+        self.fetch = fetch
+        self.cursor = cursor
+        if self.cursor is not None:
+            self.maximum_pages += 1
+            if not self.paginating:
+                self.paginating = True
+                if not self.permissions.add_reactions:
+                    raise CannotPaginate('Bot does not have add reactions permission.')
+                if not self.permissions.read_message_history:
+                    raise CannotPaginate('Bot does not have Read Message History permission.')
+
+    async def load_page(self, page):
+        while self.cursor is not None and len(self.entries) < page * self.per_page:
+            entries, self.cursor = await self.fetch(self.cursor)
+            self.entries.extend(entries)
+        pages, left_over = divmod(len(self.entries), self.per_page)
+        self.maximum_pages = pages + bool(left_over) + (self.cursor is not None)
+
     async def show_page(self, page, *, first=False):
+        if self.fetch is not None:
+            await self.load_page(page)
+            page = max(1, min(page, self.maximum_pages))
         self.current_page = page
         entry = self.get_page(page)
         self.embed.clear_fields()
         self.embed.set_author(name=self.author, icon_url=self.author.avatar_url)
         self.embed.colour = self.author.top_role.color
         self.embed.add_field(name="\u200b",
-                             value="\n".join([f"{self.entries.index(tag) + 1}. {tag}" for tag in entry]))
+                             value="\n".join([f"{index}. {tag}" for index, tag in
+                                              enumerate(entry, 1 + (page - 1) * self.per_page)]))
         if not self.paginating:
             return await self.channel.send(embed=self.embed)
         if not first:
@@ -1,5 +1,6 @@
 import logging
 import time
+import typing
 
 log = logging.getLogger(__name__)
 
@@ -52,37 +53,69 @@ def generate_id(worker_id, data_center_id):
             sequence)
 
 
-def generator(worker_id, data_center_id):
-    assert 0 <= worker_id <= max_worker_id
-    assert 0 <= data_center_id <= max_data_center_id
-
-    last_timestamp = -1
-    sequence = 0
-
-    while True:
-        timestamp = int(time.time() * 1000)
-
-        if last_timestamp > timestamp:
-            log.warning(
-                "clock is moving backwards. waiting until %i" % last_timestamp)
-            continue
-
-        if last_timestamp == timestamp:
-            sequence = (sequence + 1) & sequence_mask
-            if sequence == 0:
-                log.warning("sequence overrun")
-                sequence = -1 & sequence_mask
-                continue
-        else:
-            sequence = 0
-
-        last_timestamp = timestamp
-
-        yield (
-                ((timestamp - twepoch) << timestamp_left_shift) |
-                (data_center_id << data_center_id_shift) |
-                (worker_id << worker_id_shift) |
-                sequence)
+class SnowflakeUnavailable(RuntimeError):
+    """Raised when ids are asked for while no worker id is held"""
+
+
+class SnowflakeGenerator:
+    """Hands out snowflake ids for one worker and datacenter, singly or in bulk
+
+    Ids are always increasing and never block. When a millisecond's 4096 sequence numbers run out,
+    or the wall clock steps backwards, the generator moves on to the next millisecond ahead of the
+    clock instead of spinning until the clock catches up. ``drift`` says how far ahead it is.
+    """
+
+    def __init__(self, worker_id: int, data_center_id: int, clock=time.time):
+        assert 0 <= worker_id <= max_worker_id
+        assert 0 <= data_center_id <= max_data_center_id
+        self.worker_id = worker_id
+        self.data_center_id = data_center_id
+        self.clock = clock
+        self._node = (data_center_id << data_center_id_shift) | (worker_id << worker_id_shift)
+        self._timestamp = -1
+        self._sequence = 0
+        self.drift_warning = 1000
+        self._warned = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> int:
+        return self.next_ids(1)[0]
+
+    @property
+    def drift(self) -> int:
+        """Milliseconds the last id handed out is ahead of the clock"""
+        return max(0, self._timestamp - int(self.clock() * 1000))
+
+    def next_ids(self, count: int) -> typing.List[int]:
+        """Allocates ``count`` consecutive ids at once"""
+        now = int(self.clock() * 1000)
+        if now > self._timestamp:
+            self._timestamp = now
+            self._sequence = 0
+        ids = []
+        while count > 0:
+            taken = min(count, sequence_mask + 1 - self._sequence)
+            prefix = ((self._timestamp - twepoch) << timestamp_left_shift) | self._node
+            ids.extend(range(prefix | self._sequence, (prefix | self._sequence) + taken))
+            self._sequence += taken
+            count -= taken
+            if self._sequence > sequence_mask:
+                # borrow the next millisecond rather than wait for it
+                self._timestamp += 1
+                self._sequence = 0
+        drift = self._timestamp - now
+        if drift > self.drift_warning and not self._warned:
+            log.warning(f"snowflake generator is {drift}ms ahead of the clock")
+            self._warned = True
+        elif drift <= self.drift_warning:
+            self._warned = False
+        return ids
+
+
+def generator(worker_id, data_center_id) -> SnowflakeGenerator:
+    return SnowflakeGenerator(worker_id, data_center_id)
 
 
 if __name__ == '__main__':